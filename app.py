@@ -1,13 +1,24 @@
 import os
 import json
+import hashlib
+import mimetypes
 import sqlite3
+import bisect
 import csv
 import io
+import itertools
+import shutil
+import threading
+import time
+import click
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, Response, send_file, abort
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import safe_join
+from backup import create_backup
 
 # JobTread API integration
 try:
@@ -18,6 +29,13 @@ except ImportError:
     def get_jobtread_data():
         return None
 
+# Image thumbnails (optional - uploads are shown as plain links without Pillow)
+try:
+    from PIL import Image, ImageOps
+    THUMBNAILS_ENABLED = True
+except ImportError:
+    THUMBNAILS_ENABLED = False
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crm.db')
@@ -32,7 +50,7 @@ CORS(app, resources={
             "http://127.0.0.1:8888"
         ],
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "X-API-Key"]
+        "allow_headers": ["Content-Type", "X-API-Key", "Idempotency-Key"]
     }
 })
 
@@ -48,6 +66,8 @@ def get_db():
     if db is None:
         db = g._database = sqlite3.connect(DATABASE)
         db.row_factory = sqlite3.Row
+        # Enforce the schema's REFERENCES / ON DELETE CASCADE clauses (off by default in SQLite)
+        db.execute('PRAGMA foreign_keys = ON')
     return db
 
 @app.teardown_appcontext
@@ -70,6 +90,167 @@ def execute_db(query, args=()):
     cur.close()
     return lastrowid
 
+@contextmanager
+def db_transaction():
+    """Run a block of statements in a single transaction (commit on success, rollback on error)"""
+    db = get_db()
+    if db.in_transaction:
+        db.commit()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+def insert_leads_bulk(db, lead_rows):
+    """
+    Insert many leads inside an open transaction, reusing one prepared statement.
+    lead_rows are tuples in LEAD_INSERT_COLUMNS order. Returns the new lead IDs, in order,
+    as SQLite assigned them.
+    """
+    sql = f'''INSERT INTO leads ({', '.join(LEAD_INSERT_COLUMNS)})
+               VALUES ({', '.join('?' for _ in LEAD_INSERT_COLUMNS)})'''
+    cursor = db.cursor()
+    lead_ids = []
+    for row in lead_rows:
+        cursor.execute(sql, row)
+        lead_ids.append(cursor.lastrowid)
+    return lead_ids
+
+def detach_references(db, parent_table, parent_ids):
+    """
+    Before deleting parent rows: clear child rows whose foreign keys have no ON DELETE action
+    (set NULL, or delete the child if the column is NOT NULL). CASCADE/SET NULL keys are left
+    to SQLite.
+    """
+    parent_ids = list(parent_ids)
+    tables = [row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    for table in tables:
+        not_null = {row[1] for row in db.execute(f'PRAGMA table_info("{table}")') if row[3]}
+        for fk in db.execute(f'PRAGMA foreign_key_list("{table}")').fetchall():
+            if fk[2] != parent_table or fk[6] not in ('NO ACTION', 'RESTRICT'):
+                continue
+            column = fk[3]
+            for start in range(0, len(parent_ids), 500):
+                chunk = parent_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                if column in not_null:
+                    db.execute(f'DELETE FROM "{table}" WHERE {column} IN ({placeholders})', chunk)
+                else:
+                    db.execute(f'UPDATE "{table}" SET {column} = NULL WHERE {column} IN ({placeholders})', chunk)
+
+def repair_foreign_keys(db, apply=False):
+    """
+    Rows left dangling while foreign keys weren't enforced, as (table, rowid, column, action)
+    with action 'delete' or 'set null'. Only changes them when apply is set (inside a transaction).
+    """
+    repairs = []
+    for table, rowid, _, fk_id in db.execute('PRAGMA foreign_key_check').fetchall():
+        fk = next(row for row in db.execute(f'PRAGMA foreign_key_list("{table}")') if row[0] == fk_id)
+        not_null = {row[1] for row in db.execute(f'PRAGMA table_info("{table}")') if row[3]}
+        action = 'delete' if fk[6] == 'CASCADE' or fk[3] in not_null else 'set null'
+        repairs.append((table, rowid, fk[3], action))
+        if not apply:
+            continue
+        if action == 'delete':
+            db.execute(f'DELETE FROM "{table}" WHERE rowid = ?', [rowid])
+        else:
+            db.execute(f'UPDATE "{table}" SET {fk[3]} = NULL WHERE rowid = ?', [rowid])
+    return repairs
+
+def run_in_background(target, *args):
+    """Run target(*args) on a daemon thread with its own application context (and DB connection)"""
+    def runner():
+        with app.app_context():
+            try:
+                target(*args)
+            except Exception as e:
+                print(f"[Background] {target.__name__} failed: {e}")
+    thread = threading.Thread(target=runner, name=target.__name__, daemon=True)
+    thread.start()
+    return thread
+
+def schedule_periodic(target, lock, last_run_setting, interval_hours):
+    """Run target in the background if the setting says it last ran more than interval_hours ago"""
+    last_run = get_setting(last_run_setting)
+    if last_run:
+        try:
+            if datetime.now() - datetime.fromisoformat(last_run) < timedelta(hours=interval_hours):
+                return
+        except ValueError:
+            pass
+    if not lock.locked():
+        run_in_background(target)
+
+# Reference data (custom fields, statuses, views, type colors) cached per worker.
+# Each cache is tagged with a version counter in cache_versions; mutations bump it,
+# and every worker notices on its next request with a single primary-key lookup.
+_metadata_cache = {}
+_metadata_cache_lock = threading.Lock()
+
+def get_cache_version(name):
+    """Current version counter for a cache (read at most once per request)"""
+    versions = g.setdefault('_cache_versions', {})
+    if name not in versions:
+        row = get_db().execute('SELECT version FROM cache_versions WHERE name = ?', [name]).fetchone()
+        versions[name] = row[0] if row else 0
+    return versions[name]
+
+def bump_cache_version(*names, db=None):
+    """Invalidate caches in every worker. Commits unless an open transaction's db is passed in."""
+    conn = db or get_db()
+    conn.executemany(
+        '''INSERT INTO cache_versions (name, version) VALUES (?, 1)
+           ON CONFLICT(name) DO UPDATE SET version = version + 1''',
+        [(name,) for name in names]
+    )
+    if db is None:
+        conn.commit()
+    versions = g.get('_cache_versions', {})
+    for name in names:
+        versions.pop(name, None)
+
+def cached(name, key, loader):
+    """
+    Return loader() from the in-process cache for the current version of `name`
+    (or a tuple of names, for data derived from more than one cache).
+    """
+    names = name if isinstance(name, tuple) else (name,)
+    if any(n in g.get('_cache_bypass', ()) for n in names):
+        return loader()
+    version = tuple(get_cache_version(n) for n in names)
+    with _metadata_cache_lock:
+        cache = _metadata_cache.get(name)
+        if cache is None or cache['version'] != version:
+            cache = _metadata_cache[name] = {'version': version, 'entries': {}}
+        if key in cache['entries']:
+            return cache['entries'][key]
+    value = loader()
+    with _metadata_cache_lock:
+        cache['entries'][key] = value
+    return value
+
+def invalidates_cache(*names):
+    """
+    Decorator for mutation endpoints: reads during the request skip the cache,
+    and the version is bumped after a successful response so every worker reloads.
+    Error responses and exceptions leave the cache alone.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method == 'GET':
+                return f(*args, **kwargs)
+            g._cache_bypass = set(g.get('_cache_bypass', ())) | set(names)
+            response = app.make_response(f(*args, **kwargs))
+            if response.status_code < 400:
+                bump_cache_version(*names)
+            return response
+        return decorated_function
+    return decorator
+
 # Initialize database
 def init_db():
     with app.app_context():
@@ -435,6 +616,142 @@ def init_db():
             )
             print("Added 'Won' status to pipeline")
 
+        # Create idempotency_keys table so webhook retries are answered from the stored response
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                request_hash TEXT NOT NULL,
+                status_code INTEGER,
+                response_body TEXT,
+                content_type TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                reserved_at TIMESTAMP
+            )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys (created_at)')
+        if 'reserved_at' not in {row[1] for row in db.execute('PRAGMA table_info(idempotency_keys)')}:
+            db.execute('ALTER TABLE idempotency_keys ADD COLUMN reserved_at TIMESTAMP')
+
+        # Create import_jobs table for background CSV imports
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS import_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT DEFAULT 'queued',
+                filename TEXT,
+                file_path TEXT NOT NULL,
+                mappings TEXT,
+                duplicate_action TEXT DEFAULT 'skip',
+                total_rows_estimate INTEGER DEFAULT 0,
+                rows_processed INTEGER DEFAULT 0,
+                resumed_from_row INTEGER DEFAULT 0,
+                imported INTEGER DEFAULT 0,
+                updated INTEGER DEFAULT 0,
+                skipped INTEGER DEFAULT 0,
+                error_count INTEGER DEFAULT 0,
+                errors TEXT,
+                created_by INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                run_token TEXT,
+                FOREIGN KEY (created_by) REFERENCES users (id)
+            )
+        ''')
+        if 'run_token' not in {row[1] for row in db.execute('PRAGMA table_info(import_jobs)')}:
+            db.execute('ALTER TABLE import_jobs ADD COLUMN run_token TEXT')
+
+        # Migration: typed shadow columns for number/currency/date custom field values
+        field_value_columns = {row[1] for row in db.execute('PRAGMA table_info(field_values)')}
+        if 'value_num' not in field_value_columns:
+            db.execute("ALTER TABLE field_values ADD COLUMN value_num REAL")
+            db.execute("ALTER TABLE field_values ADD COLUMN value_date TEXT")
+            count = backfill_typed_field_values(db)
+            print(f"Added value_num/value_date columns to field_values ({count} values backfilled)")
+        db.execute('CREATE INDEX IF NOT EXISTS idx_field_values_num ON field_values (field_id, value_num)')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_field_values_date ON field_values (field_id, value_date)')
+
+        # Keyset index for the paginated activity timeline
+        db.execute('CREATE INDEX IF NOT EXISTS idx_activities_lead_created ON activities (lead_id, created_at, id)')
+
+        # Content-addressed upload storage, reference-counted by file field values
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS file_blobs (
+                sha256 TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Which lead's file field holds which blob. Only api_upload_file adds rows, so reference
+        # counts never depend on the JSON in field_values.
+        refs_table_exists = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'file_blob_refs'"
+        ).fetchone()
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS file_blob_refs (
+                lead_id INTEGER NOT NULL,
+                field_id INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                PRIMARY KEY (lead_id, field_id),
+                FOREIGN KEY (lead_id) REFERENCES leads (id) ON DELETE CASCADE,
+                FOREIGN KEY (field_id) REFERENCES custom_fields (id) ON DELETE CASCADE,
+                FOREIGN KEY (sha256) REFERENCES file_blobs (sha256)
+            )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_file_blob_refs_sha ON file_blob_refs (sha256)')
+        if not refs_table_exists:
+            count = backfill_file_blob_refs(db)
+            print(f"Created file_blob_refs table ({count} file references backfilled)")
+
+        # Cold storage for old activities and those of closed leads (see archive_activities)
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS activities_archive (
+                id INTEGER PRIMARY KEY,
+                lead_id INTEGER NOT NULL,
+                user_id INTEGER,
+                content TEXT NOT NULL,
+                created_at TIMESTAMP,
+                activity_type TEXT DEFAULT 'note',
+                metadata TEXT,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_activities_archive_lead_created ON activities_archive (lead_id, created_at, id)')
+
+        # Version counters for the per-worker metadata and settings caches
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+
+        # Normalized multi_select options: one row per selected option
+        option_table_exists = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'field_value_options'"
+        ).fetchone()
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS field_value_options (
+                lead_id INTEGER NOT NULL,
+                field_id INTEGER NOT NULL,
+                option TEXT NOT NULL,
+                PRIMARY KEY (lead_id, field_id, option),
+                FOREIGN KEY (lead_id) REFERENCES leads (id) ON DELETE CASCADE,
+                FOREIGN KEY (field_id) REFERENCES custom_fields (id) ON DELETE CASCADE
+            )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_field_value_options_option ON field_value_options (field_id, option)')
+        if not option_table_exists:
+            count = backfill_field_value_options(db)
+            print(f"Created field_value_options table ({count} multi-select values backfilled)")
+
+        # Materialized one-row-per-lead custom field table (rebuilt if the field set changed)
+        ensure_lead_field_matrix(db)
+
         # Create default admin if no users exist
         existing = query_db('SELECT id FROM users LIMIT 1', one=True)
         if not existing:
@@ -443,6 +760,16 @@ def init_db():
                 ('admin@example.com', generate_password_hash('changeme123'), 'Admin', 'admin')
             )
             print("Default admin created: admin@example.com / changeme123")
+
+        # Rows orphaned before foreign keys were enforced block later writes to them. Fixing them
+        # deletes data, so it's left to `flask --app app repair-foreign-keys` rather than done here.
+        dangling = len(db.execute('PRAGMA foreign_key_check').fetchall())
+        if dangling:
+            print(f"Warning: {dangling} rows have dangling foreign keys; "
+                  f"review with `flask --app app repair-foreign-keys`")
+
+        # Migrations above may have changed reference data that other workers have cached
+        bump_cache_version('schema', 'settings', db=db)
         db.commit()
 
 # Constants
@@ -472,6 +799,12 @@ PROPERTY_TYPES = [
     'Other'
 ]
 
+# Column order used by bulk lead inserts (see insert_leads_bulk)
+LEAD_INSERT_COLUMNS = ['name', 'email', 'phone', 'address', 'job_type', 'property_type', 'status', 'notes', 'created_by']
+
+# Maximum number of leads accepted by one POST /api/leads/batch call
+MAX_BATCH_LEADS = 5000
+
 # Custom field types
 FIELD_TYPES = {
     'text': {'label': 'Text', 'icon': '📝'},
@@ -495,6 +828,9 @@ FIELD_TYPES = {
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx', 'xls', 'xlsx', 'txt', 'csv'}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_REQUEST_SIZE = 200 * 1024 * 1024  # Any request body (sized for CSV imports); Werkzeug rejects larger with a 413
+MULTIPART_OVERHEAD = 64 * 1024  # Boundary and part headers around an uploaded file
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_SIZE
 
 # Ensure upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -511,15 +847,279 @@ def generate_unique_filename(original_filename):
     unique_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.urandom(4).hex()}"
     return f"{unique_name}.{ext}" if ext else unique_name
 
+# Uploaded files are stored once per content hash under uploads/blobs/<sha[:2]>/<sha>.<ext>.
+# file_blob_refs records which lead/field holds each blob and file_blobs.ref_count counts those
+# rows; when it hits zero the row goes, and the file is unlinked once that has committed.
+BLOB_FOLDER = os.path.join(UPLOAD_FOLDER, 'blobs')
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+class FileTooLarge(Exception):
+    pass
+
+def stream_upload_to_temp(stream, max_size=MAX_FILE_SIZE):
+    """Copy an upload stream to a temp file in chunks, hashing as it goes -> (temp_path, sha256, size)"""
+    os.makedirs(BLOB_FOLDER, exist_ok=True)
+    temp_path = os.path.join(BLOB_FOLDER, f'.upload_{os.urandom(8).hex()}')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as out:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise FileTooLarge()
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+def blob_relative_path(sha256, extension):
+    filename = f'{sha256}.{extension}' if extension else sha256
+    return f'blobs/{sha256[:2]}/{filename}'
+
+def store_file_blob(db, temp_path, sha256, size, extension):
+    """
+    Make sure a blob row exists for this content, moving temp_path into place if it's new
+    (inside a transaction). If the transaction rolls back the moved file is left for the upload GC.
+    """
+    blob = db.execute('SELECT path FROM file_blobs WHERE sha256 = ?', [sha256]).fetchone()
+    if blob:
+        os.remove(temp_path)
+        return blob[0]
+    path = blob_relative_path(sha256, extension)
+    os.makedirs(os.path.dirname(os.path.join(UPLOAD_FOLDER, path)), exist_ok=True)
+    os.replace(temp_path, os.path.join(UPLOAD_FOLDER, path))
+    db.execute('INSERT INTO file_blobs (sha256, path, size, ref_count) VALUES (?, ?, ?, 0)', [sha256, path, size])
+    return path
+
+def add_file_reference(db, lead_id, field_id, sha256):
+    """Point a lead's file field at a stored blob (inside a transaction, after releasing the old file)"""
+    db.execute('INSERT INTO file_blob_refs (lead_id, field_id, sha256) VALUES (?, ?, ?)', [lead_id, field_id, sha256])
+    db.execute('UPDATE file_blobs SET ref_count = ref_count + 1 WHERE sha256 = ?', [sha256])
+
+def release_file_refs(db, where, args):
+    """
+    Drop the file_blob_refs rows matching `where` and any blob rows left unused (inside a
+    transaction). Returns [(sha256, path)] for remove_released_blobs() to unlink after commit.
+    """
+    counts = db.execute(f'SELECT sha256, COUNT(*) FROM file_blob_refs WHERE {where} GROUP BY sha256', args).fetchall()
+    if not counts:
+        return []
+    db.execute(f'DELETE FROM file_blob_refs WHERE {where}', args)
+    db.executemany('UPDATE file_blobs SET ref_count = ref_count - ? WHERE sha256 = ?',
+                   [(count, sha256) for sha256, count in counts])
+    released = []
+    for sha256, _ in counts:
+        blob = db.execute('SELECT path FROM file_blobs WHERE sha256 = ? AND ref_count <= 0', [sha256]).fetchone()
+        if blob:
+            db.execute('DELETE FROM file_blobs WHERE sha256 = ?', [sha256])
+            released.append((sha256, blob[0]))
+    return released
+
+def release_field_files(db, field_id):
+    """Release the uploads held by a file field that is about to be deleted"""
+    return release_file_refs(db, 'field_id = ?', [field_id])
+
+def backfill_file_blob_refs(db):
+    """Build file_blob_refs from uploads stored before it existed and recount file_blobs"""
+    rows = []
+    for lead_id, field_id, value in db.execute('''
+        SELECT fv.lead_id, fv.field_id, fv.value FROM field_values fv
+        JOIN custom_fields cf ON cf.id = fv.field_id
+        WHERE cf.field_type = 'file' AND fv.value IS NOT NULL AND fv.value != ''
+    ''').fetchall():
+        try:
+            info = json.loads(value)
+        except ValueError:
+            continue
+        if isinstance(info, dict) and info.get('sha256'):
+            rows.append((lead_id, field_id, info['sha256']))
+    db.executemany('''
+        INSERT OR IGNORE INTO file_blob_refs (lead_id, field_id, sha256)
+        SELECT ?, ?, sha256 FROM file_blobs WHERE sha256 = ?
+    ''', rows)
+    db.execute('''
+        UPDATE file_blobs SET ref_count = (SELECT COUNT(*) FROM file_blob_refs r WHERE r.sha256 = file_blobs.sha256)
+    ''')
+    return len(rows)
+
+# Downsized copies of image uploads, cached on disk by content hash and size name under
+# uploads/derived/<size>/<sha[:2]>/<sha>.jpg. Like blobs they never change once written.
+DERIVATIVE_FOLDER = os.path.join(UPLOAD_FOLDER, 'derived')
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+IMAGE_DERIVATIVE_SIZES = {'thumb': 160, 'preview': 800}
+
+def derivative_relative_path(sha256, size):
+    return f'derived/{size}/{sha256[:2]}/{sha256}.jpg'
+
+def is_image_upload(file_info):
+    return bool(file_info.get('sha256')) and get_file_extension(file_info.get('filename', '')) in IMAGE_EXTENSIONS
+
+def generate_image_derivatives(sha256, blob_path, sizes=None):
+    """Write any missing derivatives of an image blob (each to a temp file, then renamed into place)"""
+    if not THUMBNAILS_ENABLED:
+        return
+    source = os.path.join(UPLOAD_FOLDER, blob_path)
+    for size in sizes or IMAGE_DERIVATIVE_SIZES:
+        target = os.path.join(UPLOAD_FOLDER, derivative_relative_path(sha256, size))
+        if os.path.exists(target):
+            continue
+        if not os.path.exists(source):
+            return
+        dimension = IMAGE_DERIVATIVE_SIZES[size]
+        with Image.open(source) as image:
+            # JPEG can decode straight at a reduced scale, which is much cheaper than a full decode
+            image.draft('RGB', (dimension, dimension))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((dimension, dimension))
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.split()[-1])
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp_path = f'{target}.{os.urandom(4).hex()}.tmp'
+            image.save(temp_path, 'JPEG', quality=85, optimize=True)
+        os.replace(temp_path, target)
+
+def remove_image_derivatives(sha256):
+    for size in IMAGE_DERIVATIVE_SIZES:
+        path = os.path.join(UPLOAD_FOLDER, derivative_relative_path(sha256, size))
+        if os.path.exists(path):
+            os.remove(path)
+
+def remove_released_blobs(released):
+    """
+    Unlink blobs released by a committed transaction. Pre-blob uploads in uploads/<lead_id>/
+    aren't tracked by file_blob_refs; the upload GC removes those once nothing refers to them.
+    """
+    if not released:
+        return
+    # With the write lock held no upload can be between moving the same content back into
+    # place and committing its row, so a missing row really means the file is unused
+    with db_transaction() as db:
+        for sha256, path in released:
+            if db.execute('SELECT 1 FROM file_blobs WHERE sha256 = ?', [sha256]).fetchone():
+                continue
+            blob_path = os.path.join(UPLOAD_FOLDER, path)
+            if os.path.exists(blob_path):
+                os.remove(blob_path)
+            remove_image_derivatives(sha256)
+
 # Auth decorator
+# How often a session's user is confirmed to still exist (not on every request)
+USER_RECHECK_SECONDS = 60
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
+        # A deleted user's session would otherwise fail foreign key checks on every write
+        if time.time() - session.get('user_checked_at', 0) > USER_RECHECK_SECONDS:
+            if not query_db('SELECT 1 FROM users WHERE id = ?', [session['user_id']], one=True):
+                session.clear()
+                return redirect(url_for('login'))
+            session['user_checked_at'] = time.time()
         return f(*args, **kwargs)
     return decorated_function
 
+# How long stored Idempotency-Key responses are replayed
+IDEMPOTENCY_TTL_HOURS = 24
+# A reservation with no stored response after this long belongs to a request that died; a retry takes it over
+IDEMPOTENCY_LEASE_SECONDS = 60
+
+def idempotent(f):
+    """
+    Honour an Idempotency-Key header on write APIs.
+    The first request reserves the key; a successful response is stored and replayed
+    for retries with the same key and request instead of running the view again.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key', '').strip()
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'error': 'Idempotency-Key is too long'}), 400
+
+        # Unauthenticated requests go straight to the view (which rejects them) without touching the key table
+        api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
+        if not (validate_api_key(api_key) if api_key else 'user_id' in session):
+            return f(*args, **kwargs)
+
+        # Fingerprint the request, including the caller's credentials so replays stay private
+        credentials = request.headers.get('X-API-Key') or str(session.get('user_id', ''))
+        fingerprint = hashlib.sha256(b'\n'.join([
+            request.method.encode(),
+            request.full_path.encode(),
+            credentials.encode(),
+            request.get_data()
+        ])).hexdigest()
+
+        # Drop expired keys (indexed on created_at)
+        execute_db(
+            "DELETE FROM idempotency_keys WHERE created_at < datetime('now', ?)",
+            [f'-{IDEMPOTENCY_TTL_HOURS} hours']
+        )
+
+        try:
+            execute_db(
+                'INSERT INTO idempotency_keys (key, endpoint, request_hash, reserved_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)',
+                [key, request.endpoint, fingerprint]
+            )
+        except sqlite3.IntegrityError:
+            stored = query_db('SELECT * FROM idempotency_keys WHERE key = ?', [key], one=True)
+            if stored is None:
+                return jsonify({'error': 'Idempotency-Key conflict, please retry'}), 409
+            if stored['request_hash'] != fingerprint:
+                return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+            if stored['status_code'] is None and not take_over_idempotency_key(key):
+                return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+        else:
+            stored = None
+
+        if stored is not None and stored['status_code'] is not None:
+            response = app.response_class(
+                stored['response_body'],
+                status=stored['status_code'],
+                content_type=stored['content_type']
+            )
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = app.make_response(f(*args, **kwargs))
+        except Exception:
+            execute_db('DELETE FROM idempotency_keys WHERE key = ?', [key])
+            raise
+
+        # Only successful responses are stored; failures release the key so the client can retry
+        if 200 <= response.status_code < 300:
+            execute_db(
+                'UPDATE idempotency_keys SET status_code = ?, response_body = ?, content_type = ? WHERE key = ?',
+                [response.status_code, response.get_data(as_text=True), response.content_type, key]
+            )
+        else:
+            execute_db('DELETE FROM idempotency_keys WHERE key = ?', [key])
+        return response
+    return decorated_function
+
+def take_over_idempotency_key(key):
+    """Renew a reservation whose lease ran out without a stored response -> True if this request now holds it"""
+    with db_transaction() as db:
+        return db.execute('''
+            UPDATE idempotency_keys SET reserved_at = CURRENT_TIMESTAMP
+            WHERE key = ? AND status_code IS NULL AND COALESCE(reserved_at, created_at) < datetime('now', ?)
+        ''', [key, f'-{IDEMPOTENCY_LEASE_SECONDS} seconds']).rowcount == 1
+
 # Zapier webhook function
 def send_to_zapier(lead_dict):
     global ZAPIER_WEBHOOK_URL
@@ -703,6 +1303,10 @@ def index():
 @login_required
 def dashboard():
     """Dashboard with pipeline metrics, activity overview, and JobTread integration"""
+    schedule_periodic(archive_activities, _activity_archive_lock,
+                      'last_activity_archive', ACTIVITY_ARCHIVE_INTERVAL_HOURS)
+    schedule_periodic(purge_expired_trash, _trash_purge_lock, 'last_trash_purge', TRASH_PURGE_INTERVAL_HOURS)
+    schedule_periodic(run_upload_gc, _upload_gc_lock, 'last_upload_gc', UPLOAD_GC_INTERVAL_HOURS)
 
     # Get all active leads
     all_leads = query_db('SELECT * FROM leads WHERE deleted_at IS NULL')
@@ -753,13 +1357,18 @@ def dashboard():
         [week_ago], one=True
     )['count']
 
-    # Get stale leads (no activity in 7+ days, excluding Lost/Won statuses)
+    # Get stale leads (no activity in 7+ days, excluding Lost/Won statuses).
+    # An open lead's older history may have been moved to the archive, so both tables count.
     stale_leads = query_db('''
         SELECT l.*,
                MAX(a.created_at) as last_activity,
                julianday('now') - julianday(COALESCE(MAX(a.created_at), l.created_at)) as days_stale
         FROM leads l
-        LEFT JOIN activities a ON l.id = a.lead_id
+        LEFT JOIN (
+            SELECT lead_id, created_at FROM activities
+            UNION ALL
+            SELECT lead_id, created_at FROM activities_archive
+        ) a ON l.id = a.lead_id
         WHERE l.deleted_at IS NULL
           AND l.status NOT IN ('Lost', 'Won', 'Completed')
         GROUP BY l.id
@@ -844,7 +1453,11 @@ def dashboard():
             a.content,
             a.created_at,
             a.metadata
-        FROM activities a
+        FROM (
+            SELECT lead_id, content, created_at, metadata, activity_type FROM activities
+            UNION ALL
+            SELECT lead_id, content, created_at, metadata, activity_type FROM activities_archive
+        ) a
         WHERE a.activity_type = 'status_change'
         ORDER BY a.lead_id, a.created_at
     ''')
@@ -951,103 +1564,271 @@ def logout():
     session.clear()
     return redirect(url_for('login'))
 
-@app.route('/leads')
-@login_required
-def leads():
-    status_filter = request.args.get('status', '')
-    search = request.args.get('search', '')
-    user_id = session.get('user_id')
+# Typed shadow columns on field_values, so range filters and sorts can use an index
+TYPED_NUMBER_FIELDS = ('number', 'currency')
+TYPED_DATE_FIELDS = ('date',)
+FIELD_DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%m-%d-%Y', '%b %d, %Y', '%B %d, %Y')
 
-    # Get user's grouping preferences
-    group_prefs = get_user_group_preferences(user_id)
+def parse_field_number(value):
+    """'$1,250.50' -> 1250.5 (None if it isn't a number)"""
+    if value is None:
+        return None
+    text = str(value).strip().replace(',', '').replace('$', '').replace('%', '')
+    try:
+        return float(text) if text else None
+    except ValueError:
+        return None
 
-    # If no group preferences, default to grouping by status
-    if not group_prefs:
-        group_prefs = [{'field_name': 'status', 'sort_direction': 'asc'}]
+def parse_field_date(value):
+    """Date in any of FIELD_DATE_FORMATS (or ISO datetime) -> 'YYYY-MM-DD' (None if unparseable)"""
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        return datetime.fromisoformat(text).date().isoformat()
+    except ValueError:
+        pass
+    for fmt in FIELD_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+def parse_multi_select_options(value):
+    """Stored multi_select value -> list of options (JSON list, or comma-separated text from imports)"""
+    if value is None or value == '':
+        return []
+    if isinstance(value, list):
+        options = value
+    else:
+        try:
+            options = json.loads(value)
+        except (TypeError, ValueError):
+            options = str(value).split(',')
+        if not isinstance(options, list):
+            options = [options]
+    seen = []
+    for option in options:
+        option = str(option).strip()
+        if option and option not in seen:
+            seen.append(option)
+    return seen
+
+def sync_field_value_options(db, rows):
+    """Replace the field_value_options rows for (lead_id, field_id, value) multi_select writes"""
+    rows = list(rows)
+    if not rows:
+        return
+    db.executemany(
+        'DELETE FROM field_value_options WHERE lead_id = ? AND field_id = ?',
+        [(lead_id, field_id) for lead_id, field_id, _ in rows]
+    )
+    db.executemany(
+        'INSERT OR IGNORE INTO field_value_options (lead_id, field_id, option) VALUES (?, ?, ?)',
+        [
+            (lead_id, field_id, option)
+            for lead_id, field_id, value in rows
+            for option in parse_multi_select_options(value)
+        ]
+    )
 
-    # Build query for all leads
-    query = 'SELECT * FROM leads WHERE deleted_at IS NULL'
+def backfill_field_value_options(db):
+    """Populate field_value_options from existing multi_select values"""
+    rows = db.execute('''
+        SELECT fv.lead_id, fv.field_id, fv.value
+        FROM field_values fv
+        JOIN custom_fields cf ON cf.id = fv.field_id
+        WHERE cf.field_type = 'multi_select' AND fv.value IS NOT NULL AND fv.value != ''
+    ''').fetchall()
+    sync_field_value_options(db, [tuple(row) for row in rows])
+    return len(rows)
+
+def typed_field_values(field_type, value):
+    """(value_num, value_date) shadow values for a stored field value"""
+    if field_type in TYPED_NUMBER_FIELDS:
+        return parse_field_number(value), None
+    if field_type in TYPED_DATE_FIELDS:
+        return None, parse_field_date(value)
+    return None, None
+
+def backfill_typed_field_values(db):
+    """Populate value_num/value_date for existing number, currency and date values"""
+    typed_types = TYPED_NUMBER_FIELDS + TYPED_DATE_FIELDS
+    rows = db.execute(f'''
+        SELECT fv.id, fv.value, cf.field_type
+        FROM field_values fv
+        JOIN custom_fields cf ON cf.id = fv.field_id
+        WHERE cf.field_type IN ({','.join('?' * len(typed_types))}) AND fv.value IS NOT NULL
+    ''', typed_types).fetchall()
+    db.executemany(
+        'UPDATE field_values SET value_num = ?, value_date = ? WHERE id = ?',
+        [typed_field_values(row['field_type'], row['value']) + (row['id'],) for row in rows]
+    )
+    return len(rows)
+
+# Range filters on typed custom fields: ?cf_<field id>_<op>=<value> (plus _within_days, _option)
+FIELD_RANGE_FILTERS = {
+    'min': ('value_num', '>=', TYPED_NUMBER_FIELDS),
+    'max': ('value_num', '<=', TYPED_NUMBER_FIELDS),
+    'from': ('value_date', '>=', TYPED_DATE_FIELDS),
+    'to': ('value_date', '<=', TYPED_DATE_FIELDS),
+}
+
+def build_field_range_filters(params, custom_fields):
+    """
+    Turn cf_<id>_min/max (number, currency), cf_<id>_from/to and cf_<id>_within_days (date)
+    params into indexed lookups on field_values (field_id, value_num/value_date),
+    and cf_<id>_option (multi_select) into a field_value_options (field_id, option) lookup.
+    """
+    field_types = {cf['id']: cf['field_type'] for cf in custom_fields}
+    conditions = []
+    args = []
+    for key, raw in params.items():
+        if not key.startswith('cf_') or raw in (None, ''):
+            continue
+        field_id, _, op = key[3:].partition('_')
+        if not field_id.isdigit() or int(field_id) not in field_types:
+            continue
+        field_id = int(field_id)
+        field_type = field_types[field_id]
+
+        if op == 'option' and field_type == 'multi_select':
+            conditions.append(
+                'leads.id IN (SELECT lead_id FROM field_value_options WHERE field_id = ? AND option = ?)'
+            )
+            args.extend([field_id, raw])
+        elif op == 'within_days' and field_type in TYPED_DATE_FIELDS:
+            try:
+                days = int(raw)
+            except ValueError:
+                continue
+            today = datetime.now().date()
+            bounds = sorted([today, today + timedelta(days=days)])
+            conditions.append(
+                'leads.id IN (SELECT lead_id FROM field_values WHERE field_id = ? AND value_date BETWEEN ? AND ?)'
+            )
+            args.extend([field_id, bounds[0].isoformat(), bounds[1].isoformat()])
+        elif op in FIELD_RANGE_FILTERS and field_type in FIELD_RANGE_FILTERS[op][2]:
+            column, operator, _ = FIELD_RANGE_FILTERS[op]
+            value = parse_field_number(raw) if column == 'value_num' else parse_field_date(raw)
+            if value is None:
+                continue
+            conditions.append(
+                f'leads.id IN (SELECT lead_id FROM field_values WHERE field_id = ? AND {column} {operator} ?)'
+            )
+            args.extend([field_id, value])
+    return conditions, args
+
+def build_lead_order(sort, direction, custom_fields):
+    """
+    ORDER BY (and the join it needs) for ?sort=cf_<id>&dir=asc|desc on a typed custom field.
+    Returns (join_sql, join_args, order_sql); defaults to newest first.
+    """
+    default_order = 'leads.created_at DESC'
+    if not sort or not sort.startswith('cf_') or not sort[3:].isdigit():
+        return '', [], default_order
+    field = next((cf for cf in custom_fields if cf['id'] == int(sort[3:])), None)
+    if not field or field['field_type'] not in TYPED_NUMBER_FIELDS + TYPED_DATE_FIELDS:
+        return '', [], default_order
+
+    column = 'value_num' if field['field_type'] in TYPED_NUMBER_FIELDS else 'value_date'
+    direction = 'DESC' if str(direction).lower() == 'desc' else 'ASC'
+    join_sql = 'LEFT JOIN field_values sort_fv ON sort_fv.lead_id = leads.id AND sort_fv.field_id = ?'
+    order_sql = f'sort_fv.{column} IS NULL, sort_fv.{column} {direction}, {default_order}'
+    return join_sql, [field['id']], order_sql
+
+def build_lead_filters(status_filter='', search='', params=None, custom_fields=()):
+    """
+    WHERE clause and args for the lead list filters (status + free-text search),
+    plus typed custom field range filters when request params are given.
+    """
+    query = 'leads.deleted_at IS NULL'
     args = []
 
     if status_filter:
-        query += ' AND status = ?'
+        query += ' AND leads.status = ?'
         args.append(status_filter)
 
     if search:
-        query += ' AND (name LIKE ? OR email LIKE ? OR address LIKE ? OR phone LIKE ?)'
+        query += ' AND (leads.name LIKE ? OR leads.email LIKE ? OR leads.address LIKE ? OR leads.phone LIKE ?)'
         search_term = f'%{search}%'
         args.extend([search_term, search_term, search_term, search_term])
 
-    query += ' ORDER BY created_at DESC'
-    all_leads = query_db(query, args)
-
-    # Get all custom fields for the field selector
-    all_custom_fields = get_custom_fields()
+    if params:
+        conditions, condition_args = build_field_range_filters(params, custom_fields)
+        for condition in conditions:
+            query += f' AND {condition}'
+        args.extend(condition_args)
 
-    # Get custom field values for all leads first (needed for grouping)
-    all_lead_values = {}
-    for lead in all_leads:
-        all_lead_values[lead['id']] = get_field_values(lead['id'])
+    return query, args
 
-    # Group leads using user preferences
-    grouped_leads = group_leads_by_fields(all_leads, group_prefs, all_lead_values)
+# Default field definitions with labels (all movable, including name, created, stage)
+DEFAULT_FIELD_DEFS = [
+    {'key': 'name', 'label': 'Name'},
+    {'key': 'email', 'label': 'Email/Phone'},
+    {'key': 'address', 'label': 'Address'},
+    {'key': 'job_type', 'label': 'Job Type'},
+    {'key': 'property_type', 'label': 'Property'},
+    {'key': 'created', 'label': 'Created'},
+    {'key': 'stage', 'label': 'Stage'}
+]
 
+def resolve_field_layout(user_id, all_custom_fields):
+    """
+    Work out which lead table columns are shown, and in what order.
+    Global field order wins, then the user's current view, then everything visible.
+    The compiled layout is cached per view until fields, views or settings change - treat it as read-only.
+    """
     # Check if user has a view selected
     current_view = get_user_current_view(user_id)
-    all_views = get_all_views()
+    view_id = current_view['id'] if current_view else None
+
+    layout = cached(
+        ('schema', 'settings'), ('field_layout', view_id),
+        lambda: compile_field_layout(current_view, all_custom_fields)
+    )
+    return {**layout, 'current_view': current_view}
 
-    # Default field definitions with labels (all movable, including name, created, stage)
-    DEFAULT_FIELD_DEFS = [
-        {'key': 'name', 'label': 'Name'},
-        {'key': 'email', 'label': 'Email/Phone'},
-        {'key': 'address', 'label': 'Address'},
-        {'key': 'job_type', 'label': 'Job Type'},
-        {'key': 'property_type', 'label': 'Property'},
-        {'key': 'created', 'label': 'Created'},
-        {'key': 'stage', 'label': 'Stage'}
-    ]
+def compile_field_layout(current_view, all_custom_fields):
+    """Build the column plan for resolve_field_layout() with dict/set lookups (linear in field count)"""
+    default_defs = {f['key']: f for f in DEFAULT_FIELD_DEFS}
+    custom_by_id = {cf['id']: cf for cf in all_custom_fields}
 
     # Load global field order from app_settings
-    global_field_config = query_db(
-        'SELECT value FROM app_settings WHERE key = ?',
-        ['global_field_order'], one=True
-    )
+    config = get_json_setting('global_field_order')
 
-    if global_field_config:
+    if config:
         # Use global field configuration
-        config = json.loads(global_field_config['value'])
-        visible_field_keys = config.get('visible_fields', [])
-        hidden_field_keys = config.get('hidden_fields', [])
+        hidden_field_keys = set(config.get('hidden_fields', []))
         full_order = config.get('full_order', [])
 
-        # Build default field order based on global config
-        default_field_order = []
-        for key in full_order:
-            if not key.startswith('custom_'):
-                field_def = next((f for f in DEFAULT_FIELD_DEFS if f['key'] == key), None)
-                if field_def:
-                    default_field_order.append({**field_def, 'visible': True})
-
-        # Add any missing default fields as hidden
-        for field_def in DEFAULT_FIELD_DEFS:
-            if field_def['key'] not in [f['key'] for f in default_field_order]:
-                is_visible = field_def['key'] not in hidden_field_keys
-                default_field_order.append({**field_def, 'visible': is_visible})
-
-        # Build custom field order
-        custom_field_order = []
-        for key in full_order:
-            if key.startswith('custom_'):
-                cf_id = int(key.replace('custom_', ''))
-                cf = next((c for c in all_custom_fields if c['id'] == cf_id), None)
-                if cf:
-                    custom_field_order.append({'id': cf['id'], 'name': cf['name'], 'visible': True})
-
-        # Add any missing custom fields as hidden
-        for cf in all_custom_fields:
-            if cf['id'] not in [f['id'] for f in custom_field_order]:
-                is_visible = f"custom_{cf['id']}" not in hidden_field_keys
-                custom_field_order.append({'id': cf['id'], 'name': cf['name'], 'visible': is_visible})
+        # Default fields in global order, then any missing ones (hidden if configured so)
+        ordered_default_keys = list(dict.fromkeys(
+            key for key in full_order if not key.startswith('custom_') and key in default_defs
+        ))
+        default_field_order = [{**default_defs[key], 'visible': True} for key in ordered_default_keys]
+        placed = set(ordered_default_keys)
+        default_field_order += [
+            {**f, 'visible': f['key'] not in hidden_field_keys}
+            for f in DEFAULT_FIELD_DEFS if f['key'] not in placed
+        ]
+
+        # Custom fields in global order, then any missing ones
+        ordered_custom_ids = list(dict.fromkeys(
+            int(key.replace('custom_', '')) for key in full_order if key.startswith('custom_')
+        ))
+        ordered_custom_ids = [cf_id for cf_id in ordered_custom_ids if cf_id in custom_by_id]
+        custom_field_order = [
+            {'id': cf_id, 'name': custom_by_id[cf_id]['name'], 'visible': True} for cf_id in ordered_custom_ids
+        ]
+        placed = set(ordered_custom_ids)
+        custom_field_order += [
+            {'id': cf['id'], 'name': cf['name'], 'visible': f"custom_{cf['id']}" not in hidden_field_keys}
+            for cf in all_custom_fields if cf['id'] not in placed
+        ]
 
         # Determine visible fields for table display
         visible_default_fields = [f['key'] for f in default_field_order if f['visible']]
@@ -1060,27 +1841,23 @@ def leads():
         view_custom_fields = get_fields_for_view(current_view['id'])
         visible_custom_field_ids = [f['id'] for f in view_custom_fields]
 
-        # Build field order for default fields based on view
-        default_field_order = []
-        for key in visible_default_fields:
-            field_def = next((f for f in DEFAULT_FIELD_DEFS if f['key'] == key), None)
-            if field_def:
-                default_field_order.append({**field_def, 'visible': True})
-        # Add remaining default fields (not in view) at the end
-        for field_def in DEFAULT_FIELD_DEFS:
-            if field_def['key'] not in visible_default_fields:
-                default_field_order.append({**field_def, 'visible': False})
-
-        # Build custom field order based on view
-        custom_field_order = []
-        for vf in view_custom_fields:
-            cf = next((c for c in all_custom_fields if c['id'] == vf['id']), None)
-            if cf:
-                custom_field_order.append({'id': cf['id'], 'name': cf['name'], 'visible': True})
-        # Add remaining custom fields not in view
-        for cf in all_custom_fields:
-            if cf['id'] not in visible_custom_field_ids:
-                custom_field_order.append({'id': cf['id'], 'name': cf['name'], 'visible': False})
+        # Default fields in view order, then the rest hidden
+        in_view = set(visible_default_fields)
+        default_field_order = [
+            {**default_defs[key], 'visible': True} for key in visible_default_fields if key in default_defs
+        ]
+        default_field_order += [{**f, 'visible': False} for f in DEFAULT_FIELD_DEFS if f['key'] not in in_view]
+
+        # Custom fields in view order, then the rest hidden
+        in_view = set(visible_custom_field_ids)
+        custom_field_order = [
+            {'id': vf['id'], 'name': custom_by_id[vf['id']]['name'], 'visible': True}
+            for vf in view_custom_fields if vf['id'] in custom_by_id
+        ]
+        custom_field_order += [
+            {'id': cf['id'], 'name': cf['name'], 'visible': False}
+            for cf in all_custom_fields if cf['id'] not in in_view
+        ]
     else:
         # Default: all fields visible in default order
         default_field_order = [{**f, 'visible': True} for f in DEFAULT_FIELD_DEFS]
@@ -1090,12 +1867,55 @@ def leads():
         visible_default_fields = [f['key'] for f in DEFAULT_FIELD_DEFS]
         visible_custom_field_ids = [cf['id'] for cf in all_custom_fields]
 
-    # Combine field order for template
-    field_order = {
-        'default_fields': default_field_order,
-        'custom_fields': custom_field_order
+    return {
+        'field_order': {
+            'default_fields': default_field_order,
+            'custom_fields': custom_field_order
+        },
+        'visible_default_fields': visible_default_fields,
+        'visible_custom_field_ids': visible_custom_field_ids,
+        # Sets for O(1) "is this column shown" checks while rendering rows
+        'visible_default_set': frozenset(visible_default_fields),
+        'visible_custom_set': frozenset(visible_custom_field_ids)
     }
 
+@app.route('/leads')
+@login_required
+def leads():
+    status_filter = request.args.get('status', '')
+    search = request.args.get('search', '')
+    user_id = session.get('user_id')
+
+    # Get user's grouping preferences
+    group_prefs = get_user_group_preferences(user_id)
+
+    # If no group preferences, default to grouping by status
+    if not group_prefs:
+        group_prefs = [{'field_name': 'status', 'sort_direction': 'asc'}]
+
+    # Get all custom fields for the field selector
+    all_custom_fields = get_custom_fields()
+
+    # Build query for all leads
+    where, args = build_lead_filters(status_filter, search, request.args, all_custom_fields)
+    join_sql, join_args, order_sql = build_lead_order(
+        request.args.get('sort'), request.args.get('dir'), all_custom_fields
+    )
+    all_leads = query_db(
+        f'SELECT leads.* FROM leads {join_sql} WHERE {where} ORDER BY {order_sql}',
+        join_args + args
+    )
+
+    # Get custom field values for all leads first (needed for grouping)
+    all_lead_values = get_field_values_for_leads(lead['id'] for lead in all_leads)
+
+    # Group leads using user preferences
+    grouped_leads = group_leads_by_fields(all_leads, group_prefs, all_lead_values)
+
+    # Resolve visible columns from global order / current view
+    layout = resolve_field_layout(user_id, all_custom_fields)
+    all_views = get_all_views()
+
     # Get statuses from database with colors
     db_statuses = get_all_statuses()
     status_names = [s['name'] for s in db_statuses] if db_statuses else STATUSES
@@ -1112,12 +1932,149 @@ def leads():
                          status_filter=status_filter,
                          search=search,
                          all_custom_fields=all_custom_fields,
-                         visible_custom_field_ids=visible_custom_field_ids,
-                         visible_default_fields=visible_default_fields,
+                         visible_custom_field_ids=layout['visible_custom_field_ids'],
+                         visible_default_fields=layout['visible_default_fields'],
+                         visible_custom_set=layout['visible_custom_set'],
+                         visible_default_set=layout['visible_default_set'],
                          field_values=all_lead_values,
-                         field_order=field_order,
+                         field_order=layout['field_order'],
                          all_views=all_views,
-                         current_view=current_view)
+                         current_view=layout['current_view'])
+
+# ==================== LEAD EXPORT ====================
+
+# Leads fetched (and custom values joined) per export batch
+EXPORT_BATCH_ROWS = 500
+
+# Lead table column key -> (export header, leads column) pairs
+EXPORT_DEFAULT_COLUMNS = {
+    'name': [('Name', 'name')],
+    'email': [('Email', 'email'), ('Phone', 'phone')],
+    'address': [('Address', 'address')],
+    'job_type': [('Job Type', 'job_type')],
+    'property_type': [('Property Type', 'property_type')],
+    'created': [('Created', 'created_at')],
+    'stage': [('Status', 'status')],
+}
+
+def get_export_columns(layout, all_custom_fields):
+    """Export columns in table order: [(header, leads column or None, custom field or None)]"""
+    columns = [('ID', 'id', None)]
+    for field in layout['field_order']['default_fields']:
+        if field['visible']:
+            columns.extend((header, column, None) for header, column in EXPORT_DEFAULT_COLUMNS.get(field['key'], []))
+    fields_by_id = {cf['id']: cf for cf in all_custom_fields}
+    for field in layout['field_order']['custom_fields']:
+        if field['visible'] and field['id'] in fields_by_id:
+            columns.append((field['name'], None, fields_by_id[field['id']]))
+    return columns
+
+def iter_export_batches(where, args, custom_field_ids):
+    """
+    Yield (leads, {lead_id: {field_id: value}}) in batches of EXPORT_BATCH_ROWS, newest first.
+    Each batch is its own short keyset query, so a slow download never holds a read lock.
+    Uses its own connection: the request's connection is closed once the response starts streaming.
+    """
+    db = sqlite3.connect(DATABASE)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA foreign_keys = ON')
+    try:
+        yield from _iter_export_batches(db, where, args, custom_field_ids)
+    finally:
+        db.close()
+
+def _iter_export_batches(db, where, args, custom_field_ids):
+    # Read custom values straight from the materialized matrix when it covers them
+    matrix_columns = get_lead_field_matrix_columns(db) if LEAD_FIELD_MATRIX_ENABLED else set()
+    use_matrix = all(matrix_column(field_id) in matrix_columns for field_id in custom_field_ids)
+    select = 'leads.*'
+    if use_matrix and custom_field_ids:
+        select += ''.join(f', m.{matrix_column(field_id)}' for field_id in custom_field_ids)
+        select_from = 'leads LEFT JOIN lead_field_matrix m ON m.lead_id = leads.id'
+    else:
+        select_from = 'leads'
+
+    last_id = None
+    while True:
+        batch_where, batch_args = where, list(args)
+        if last_id is not None:
+            batch_where += ' AND leads.id < ?'
+            batch_args.append(last_id)
+        batch = db.execute(
+            f'SELECT {select} FROM {select_from} WHERE {batch_where} ORDER BY leads.id DESC LIMIT ?',
+            batch_args + [EXPORT_BATCH_ROWS]
+        ).fetchall()
+        if not batch:
+            return
+
+        values = {}
+        if custom_field_ids and use_matrix:
+            for lead in batch:
+                values[lead['id']] = {
+                    field_id: lead[matrix_column(field_id)] for field_id in custom_field_ids
+                }
+        elif custom_field_ids:
+            placeholders = ','.join('?' * len(batch))
+            for row in db.execute(
+                f'SELECT lead_id, field_id, value FROM field_values WHERE lead_id IN ({placeholders})',
+                [lead['id'] for lead in batch]
+            ):
+                if row['field_id'] in custom_field_ids:
+                    values.setdefault(row['lead_id'], {})[row['field_id']] = row['value']
+
+        yield batch, values
+        last_id = batch[-1]['id']
+
+def export_field_value(field_type, value, as_json=False):
+    """Stored custom field value -> export value (lists/bools for JSON, flat text for CSV)"""
+    if value is None or value == '':
+        return None if as_json else ''
+    if field_type == 'multi_select':
+        options = parse_multi_select_options(value)
+        return options if as_json else ', '.join(options)
+    if field_type == 'checkbox' and as_json:
+        return str(value) == '1'
+    return value
+
+def export_request_params(user_id):
+    """Filters and column layout for an export request (same query params as the lead list)"""
+    all_custom_fields = get_custom_fields()
+    where, args = build_lead_filters(
+        request.args.get('status', ''), request.args.get('search', ''), request.args, all_custom_fields
+    )
+    columns = get_export_columns(resolve_field_layout(user_id, all_custom_fields), all_custom_fields)
+    custom_field_ids = {cf['id'] for _, _, cf in columns if cf}
+    return where, args, columns, custom_field_ids
+
+@app.route('/leads/export.csv')
+@login_required
+def export_leads_csv():
+    """Stream the filtered lead list as CSV, using the current view's columns"""
+    where, args, columns, custom_field_ids = export_request_params(session.get('user_id'))
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([header for header, _, _ in columns])
+        yield buffer.getvalue()
+
+        for batch, values in iter_export_batches(where, args, custom_field_ids):
+            buffer.seek(0)
+            buffer.truncate()
+            for lead in batch:
+                lead_values = values.get(lead['id'], {})
+                writer.writerow([
+                    lead[column] if column else export_field_value(cf['field_type'], lead_values.get(cf['id']))
+                    for _, column, cf in columns
+                ])
+            yield buffer.getvalue()
+
+    filename = f"leads_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return Response(
+        generate(),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
 @app.route('/leads/add', methods=['GET', 'POST'])
 @login_required
@@ -1178,10 +2135,8 @@ def view_lead(id):
         flash('Lead not found', 'error')
         return redirect(url_for('leads'))
 
-    activities = query_db(
-        'SELECT * FROM activities WHERE lead_id = ? ORDER BY created_at DESC',
-        [id]
-    )
+    # First page only; older entries are fetched from /api/leads/<id>/timeline
+    activities, activities_cursor = get_activity_page(id)
 
     custom_fields = get_custom_fields()
     field_values = get_field_values(id)
@@ -1191,6 +2146,7 @@ def view_lead(id):
     return render_template('lead_detail.html',
                          lead=lead,
                          activities=activities,
+                         activities_cursor=activities_cursor,
                          statuses=status_names,
                          status_colors=get_status_colors(),
                          job_types=JOB_TYPES,
@@ -1274,30 +2230,372 @@ def delete_lead(id):
     flash('Lead moved to trash', 'success')
     return redirect(url_for('leads'))
 
-# Trash routes for soft-deleted leads
-@app.route('/trash')
-@login_required
-def trash():
-    deleted_leads = query_db(
-        'SELECT * FROM leads WHERE deleted_at IS NOT NULL ORDER BY deleted_at DESC'
-    )
-    return render_template('trash.html', leads=deleted_leads)
+def run_jobtread_handoffs(leads):
+    """trigger_jobtread_handoff() for a batch of newly Won leads (background job)"""
+    for lead in leads:
+        trigger_jobtread_handoff(lead['id'], lead)
 
-@app.route('/trash/<int:id>/restore', methods=['POST'])
+# Bulk actions from the leads page multi-select: one request, one transaction
+BULK_ACTIONS = ('status', 'delete', 'restore', 'set_field')
+
+@app.route('/api/leads/bulk', methods=['POST'])
 @login_required
-def restore_lead(id):
-    lead = query_db('SELECT * FROM leads WHERE id = ? AND deleted_at IS NOT NULL', [id], one=True)
-    if not lead:
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return jsonify({'success': False, 'error': 'Lead not found in trash'}), 404
-        flash('Lead not found in trash', 'error')
-        return redirect(url_for('trash'))
+def api_bulk_leads():
+    """
+    Apply one action to many leads: {"ids": [...], "action": "status"|"delete"|"restore"|"set_field",
+    "status": ..., "field_id": ..., "value": ...}. Leads the action doesn't apply to are skipped.
+    """
+    data = request.get_json() or {}
+    action = data.get('action')
+    if action not in BULK_ACTIONS:
+        return jsonify({'success': False, 'error': f'action must be one of {", ".join(BULK_ACTIONS)}'}), 400
+    if not isinstance(data.get('ids'), list):
+        return jsonify({'success': False, 'error': 'ids must be a list of lead IDs'}), 400
+    try:
+        lead_ids = list(dict.fromkeys(int(lead_id) for lead_id in data['ids']))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'ids must be a list of lead IDs'}), 400
+    if not lead_ids:
+        return jsonify({'success': False, 'error': 'No leads selected'}), 400
+
+    new_status = data.get('status')
+    if action == 'status':
+        db_statuses = get_all_statuses()
+        status_names = [s['name'] for s in db_statuses] if db_statuses else STATUSES
+        if new_status not in status_names:
+            return jsonify({'success': False, 'error': 'Invalid status'}), 400
+    field = None
+    if action == 'set_field':
+        field = query_db('SELECT * FROM custom_fields WHERE id = ?', [data.get('field_id')], one=True)
+        if not field:
+            return jsonify({'success': False, 'error': 'Field not found'}), 404
+        if field['field_type'] == 'file':
+            return jsonify({'success': False, 'error': 'File fields cannot be bulk edited'}), 400
+        value = data.get('value')
+        value = '' if value is None or value == [] else coerce_api_field_value(field['field_type'], value)
 
-    # Restore the lead by clearing deleted_at
-    execute_db('UPDATE leads SET deleted_at = NULL WHERE id = ?', [id])
+    user_id = session.get('user_id')
+    with db_transaction() as db:
+        leads = []
+        for start in range(0, len(lead_ids), 500):
+            chunk = lead_ids[start:start + 500]
+            leads += db.execute(
+                f'SELECT * FROM leads WHERE id IN ({",".join("?" * len(chunk))})', chunk
+            ).fetchall()
+
+        if action == 'restore':
+            targets = [lead for lead in leads if lead['deleted_at'] is not None]
+        elif action == 'status':
+            targets = [lead for lead in leads if lead['deleted_at'] is None and lead['status'] != new_status]
+        else:
+            targets = [lead for lead in leads if lead['deleted_at'] is None]
+        target_ids = [lead['id'] for lead in targets]
+
+        if action == 'status':
+            db.executemany('UPDATE leads SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                           [(new_status, lead_id) for lead_id in target_ids])
+            activities = [
+                (lead['id'], user_id, 'status_change',
+                 f'Status changed from "{lead["status"]}" to "{new_status}"',
+                 json.dumps({'old_status': lead['status'], 'new_status': new_status}))
+                for lead in targets
+            ]
+        elif action == 'delete':
+            db.executemany('UPDATE leads SET deleted_at = CURRENT_TIMESTAMP WHERE id = ?',
+                           [(lead_id,) for lead_id in target_ids])
+            activities = [(lead_id, user_id, 'note', 'Lead moved to trash', None) for lead_id in target_ids]
+        elif action == 'restore':
+            db.executemany('UPDATE leads SET deleted_at = NULL WHERE id = ?', [(lead_id,) for lead_id in target_ids])
+            activities = [(lead_id, user_id, 'note', 'Lead restored from trash', None) for lead_id in target_ids]
+        else:
+            write_field_values(db, [(lead_id, field['id'], value) for lead_id in target_ids])
+            activities = [
+                (lead_id, user_id, 'field_update', f'{field["name"]} changed to "{value}"',
+                 json.dumps({'field_id': field['id'], 'value': value}))
+                for lead_id in target_ids
+            ]
 
-    # Log the restoration
-    execute_db(
+        db.executemany('''
+            INSERT INTO activities (lead_id, user_id, activity_type, content, metadata)
+            VALUES (?, ?, ?, ?, ?)
+        ''', activities)
+
+    response = {
+        'success': True,
+        'action': action,
+        'updated': len(target_ids),
+        'skipped': sorted(set(lead_ids) - set(target_ids)),
+    }
+    if action == 'status':
+        # One trigger lookup per distinct transition rather than per lead
+        by_transition = {}
+        for lead in targets:
+            by_transition.setdefault((lead['status'], new_status), []).append(lead['id'])
+        triggers = match_handoff_triggers(by_transition)
+        response['handoffs'] = [
+            {'from_status': from_status, 'to_status': to_status,
+             'department_name': trigger.get('department_name'), 'lead_ids': by_transition[(from_status, to_status)]}
+            for (from_status, to_status), trigger in triggers.items()
+        ]
+        if new_status == 'Won' and targets:
+            run_in_background(run_jobtread_handoffs, [dict(lead) for lead in targets])
+
+    return jsonify(response)
+
+# Permanent deletes. Children (activities, field values, handoffs) go via ON DELETE CASCADE;
+# only the tables without a foreign key to leads are cleared by hand.
+TRASH_PURGE_BATCH = 500
+TRASH_RETENTION_DAYS = 30
+TRASH_PURGE_INTERVAL_HOURS = 24
+_trash_purge_lock = threading.Lock()
+
+def purge_leads(db, lead_ids):
+    """
+    Permanently delete leads and everything hanging off them (call inside a transaction).
+    Returns the released blobs for remove_released_blobs() once committed.
+    """
+    lead_ids = list(lead_ids)
+    detach_references(db, 'leads', lead_ids)
+    released = []
+    for start in range(0, len(lead_ids), 500):
+        chunk = lead_ids[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        released += release_file_refs(db, f'lead_id IN ({placeholders})', chunk)
+        db.execute(f'DELETE FROM activities_archive WHERE lead_id IN ({placeholders})', chunk)
+        if LEAD_FIELD_MATRIX_ENABLED:
+            db.execute(f'DELETE FROM lead_field_matrix WHERE lead_id IN ({placeholders})', chunk)
+        db.execute(f'DELETE FROM leads WHERE id IN ({placeholders})', chunk)
+    return released
+
+def purge_trash(older_than_days=None, batch_size=TRASH_PURGE_BATCH):
+    """Purge trashed leads (optionally only those deleted over N days ago) in batches. Returns the count."""
+    where = 'deleted_at IS NOT NULL'
+    args = []
+    if older_than_days is not None:
+        where += " AND deleted_at < datetime('now', ?)"
+        args.append(f'-{older_than_days} days')
+
+    purged = 0
+    while True:
+        with db_transaction() as db:
+            lead_ids = [row[0] for row in db.execute(
+                f'SELECT id FROM leads WHERE {where} LIMIT ?', args + [batch_size]
+            )]
+            if not lead_ids:
+                break
+            released = purge_leads(db, lead_ids)
+        remove_released_blobs(released)
+        purged += len(lead_ids)
+    return purged
+
+def run_trash_purge(older_than_days=None):
+    """Background entry point: one purge at a time per worker"""
+    if not _trash_purge_lock.acquire(blocking=False):
+        return 0
+    try:
+        purged = purge_trash(older_than_days)
+        if purged:
+            print(f"[Trash] Permanently deleted {purged} leads")
+        return purged
+    finally:
+        _trash_purge_lock.release()
+
+def purge_expired_trash():
+    """Retention policy: purge leads that have been in the trash longer than trash_retention_days"""
+    try:
+        days = int(get_setting('trash_retention_days', TRASH_RETENTION_DAYS))
+    except (TypeError, ValueError):
+        days = TRASH_RETENTION_DAYS
+    set_setting('last_trash_purge', datetime.now().isoformat())
+    if days > 0:
+        run_trash_purge(days)
+
+# Upload garbage collection. Reference counting keeps blobs tidy as values change, but files
+# can still be stranded: pre-blob uploads in uploads/<lead_id>/, blobs whose count drifted, new
+# blobs from a rolled-back upload, a crash between commit and unlink. The GC reconciles the upload
+# tree against file_blob_refs and the file field values. Orphans are moved to upload_quarantine/<run>/ (outside static, so never
+# served) or deleted outright; quarantine runs are dropped after UPLOAD_QUARANTINE_DAYS.
+UPLOAD_GC_MODES = ('dry_run', 'quarantine', 'delete')
+UPLOAD_GC_BATCH = 500
+UPLOAD_GC_GRACE_MINUTES = 60     # leave files this new alone - they may belong to an upload in flight
+UPLOAD_GC_INTERVAL_HOURS = 24 * 7
+UPLOAD_QUARANTINE_DAYS = 30
+UPLOAD_QUARANTINE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'upload_quarantine')
+_upload_gc_lock = threading.Lock()
+
+def referenced_uploads(db):
+    """-> ({sha256: reference count} from file_blob_refs, {legacy path under uploads/} from file values)"""
+    blob_refs = dict(db.execute('SELECT sha256, COUNT(*) FROM file_blob_refs GROUP BY sha256').fetchall())
+    legacy_paths = set()
+    for (value,) in db.execute('''
+        SELECT value FROM field_values
+        WHERE field_id IN (SELECT id FROM custom_fields WHERE field_type = 'file') AND value != ''
+    '''):
+        try:
+            info = json.loads(value)
+        except ValueError:
+            continue
+        # Pre-blob uploads only; anything carrying a sha256 is tracked by file_blob_refs
+        if isinstance(info, dict) and not info.get('sha256') and info.get('path', '').startswith('/static/uploads/'):
+            legacy_paths.add(os.path.normpath(info['path'][len('/static/uploads/'):]))
+    return blob_refs, legacy_paths
+
+def reconcile_file_blobs(db, blob_refs, dry_run=False):
+    """
+    Bring file_blobs.ref_count in line with the actual references (inside a transaction).
+    Rows nothing refers to are dropped so their files become orphans. Returns (live blobs
+    {sha256: path}, number of rows corrected).
+    """
+    live = {}
+    fixes = []
+    dead = []
+    for sha256, path, ref_count in db.execute('SELECT sha256, path, ref_count FROM file_blobs'):
+        actual = blob_refs.get(sha256, 0)
+        if actual:
+            live[sha256] = path
+            if actual != ref_count:
+                fixes.append((actual, sha256))
+        else:
+            dead.append((sha256,))
+    if not dry_run:
+        db.executemany('UPDATE file_blobs SET ref_count = ? WHERE sha256 = ?', fixes)
+        db.executemany('DELETE FROM file_blobs WHERE sha256 = ?', dead)
+    return live, len(fixes) + len(dead)
+
+def find_orphaned_uploads(live_blobs, legacy_paths):
+    """Yield (relative path, size) for upload files nothing refers to"""
+    live_blob_paths = {os.path.normpath(path) for path in live_blobs.values()}
+    cutoff = time.time() - UPLOAD_GC_GRACE_MINUTES * 60
+    for root, dirs, files in os.walk(UPLOAD_FOLDER):
+        rel_root = os.path.relpath(root, UPLOAD_FOLDER)
+        top = rel_root.split(os.sep)[0]
+        # Only the trees uploads write to: blobs/, derived/ and the old per-lead folders
+        if rel_root == '.' or not (top in ('blobs', 'derived') or top.isdigit()):
+            continue
+        for name in files:
+            rel_path = os.path.join(rel_root, name)
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > cutoff:
+                continue
+            if top == 'blobs':
+                orphaned = rel_path not in live_blob_paths
+            elif top == 'derived':
+                orphaned = os.path.splitext(name)[0].split('.')[0] not in live_blobs
+            else:
+                orphaned = rel_path not in legacy_paths
+            if orphaned:
+                yield rel_path, stat.st_size
+
+def remove_empty_upload_dirs():
+    for root, dirs, files in os.walk(UPLOAD_FOLDER, topdown=False):
+        if root != UPLOAD_FOLDER and root not in (BLOB_FOLDER, DERIVATIVE_FOLDER) and not os.listdir(root):
+            os.rmdir(root)
+
+def purge_upload_quarantine(older_than_days=UPLOAD_QUARANTINE_DAYS):
+    """Delete quarantine runs older than the cutoff -> bytes freed"""
+    if not os.path.isdir(UPLOAD_QUARANTINE_FOLDER):
+        return 0
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime('%Y%m%d_%H%M%S')
+    freed = 0
+    for run in os.listdir(UPLOAD_QUARANTINE_FOLDER):
+        if run >= cutoff:
+            continue
+        run_path = os.path.join(UPLOAD_QUARANTINE_FOLDER, run)
+        for root, dirs, files in os.walk(run_path):
+            freed += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        shutil.rmtree(run_path, ignore_errors=True)
+    return freed
+
+def collect_upload_garbage(mode='dry_run', batch_size=UPLOAD_GC_BATCH):
+    """
+    Find upload files no field value refers to and, unless mode is 'dry_run', quarantine or
+    delete them batch by batch. Returns a report dict (files, bytes, blobs_reconciled, ...).
+    """
+    if mode not in UPLOAD_GC_MODES:
+        raise ValueError(f'Unknown upload GC mode: {mode}')
+    dry_run = mode == 'dry_run'
+
+    # Hold the write lock only for the scan + count fix-up; the file walk happens outside it
+    with db_transaction() as db:
+        blob_refs, legacy_paths = referenced_uploads(db)
+        live_blobs, reconciled = reconcile_file_blobs(db, blob_refs, dry_run)
+
+    run_folder = os.path.join(UPLOAD_QUARANTINE_FOLDER, datetime.now().strftime('%Y%m%d_%H%M%S'))
+    report = {'mode': mode, 'files': 0, 'bytes': 0, 'blobs_reconciled': reconciled}
+
+    def flush(batch):
+        for rel_path, size in batch:
+            source = os.path.join(UPLOAD_FOLDER, rel_path)
+            try:
+                if mode == 'quarantine':
+                    target = os.path.join(run_folder, rel_path)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.move(source, target)
+                else:
+                    os.remove(source)
+            except FileNotFoundError:
+                continue
+            report['files'] += 1
+            report['bytes'] += size
+
+    batch = []
+    for orphan in find_orphaned_uploads(live_blobs, legacy_paths):
+        if dry_run:
+            report['files'] += 1
+            report['bytes'] += orphan[1]
+            continue
+        batch.append(orphan)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    flush(batch)
+
+    if not dry_run:
+        remove_empty_upload_dirs()
+        report['quarantine_bytes_freed'] = purge_upload_quarantine()
+    return report
+
+def run_upload_gc(mode='quarantine'):
+    """Background entry point: one GC at a time per worker; the report is kept in settings"""
+    if not _upload_gc_lock.acquire(blocking=False):
+        return None
+    try:
+        report = collect_upload_garbage(mode)
+        report['finished_at'] = datetime.now().isoformat()
+        set_settings({'last_upload_gc': report['finished_at'], 'upload_gc_report': json.dumps(report)})
+        print(f"[Uploads] GC ({mode}): {report['files']} orphaned files, {report['bytes']} bytes, "
+              f"{report['blobs_reconciled']} blob counts corrected")
+        return report
+    finally:
+        _upload_gc_lock.release()
+
+# Trash routes for soft-deleted leads
+@app.route('/trash')
+@login_required
+def trash():
+    deleted_leads = query_db(
+        'SELECT * FROM leads WHERE deleted_at IS NOT NULL ORDER BY deleted_at DESC'
+    )
+    return render_template('trash.html', leads=deleted_leads)
+
+@app.route('/trash/<int:id>/restore', methods=['POST'])
+@login_required
+def restore_lead(id):
+    lead = query_db('SELECT * FROM leads WHERE id = ? AND deleted_at IS NOT NULL', [id], one=True)
+    if not lead:
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return jsonify({'success': False, 'error': 'Lead not found in trash'}), 404
+        flash('Lead not found in trash', 'error')
+        return redirect(url_for('trash'))
+
+    # Restore the lead by clearing deleted_at
+    execute_db('UPDATE leads SET deleted_at = NULL WHERE id = ?', [id])
+
+    # Log the restoration
+    execute_db(
         'INSERT INTO activities (lead_id, user_id, content) VALUES (?, ?, ?)',
         (id, session.get('user_id'), 'Lead restored from trash')
     )
@@ -1318,10 +2616,10 @@ def permanent_delete_lead(id):
         flash('Lead not found in trash', 'error')
         return redirect(url_for('trash'))
 
-    # Permanently delete all associated data
-    execute_db('DELETE FROM field_values WHERE lead_id = ?', [id])
-    execute_db('DELETE FROM activities WHERE lead_id = ?', [id])
-    execute_db('DELETE FROM leads WHERE id = ?', [id])
+    # Permanently delete the lead and all associated data
+    with db_transaction() as db:
+        released = purge_leads(db, [id])
+    remove_released_blobs(released)
 
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return jsonify({'success': True})
@@ -1332,19 +2630,24 @@ def permanent_delete_lead(id):
 @app.route('/trash/empty', methods=['POST'])
 @login_required
 def empty_trash():
-    # Get all deleted leads
-    deleted_leads = query_db('SELECT id FROM leads WHERE deleted_at IS NOT NULL')
+    count = query_db('SELECT COUNT(*) as count FROM leads WHERE deleted_at IS NOT NULL', one=True)['count']
 
-    # Permanently delete all
-    for lead in deleted_leads:
-        execute_db('DELETE FROM field_values WHERE lead_id = ?', [lead['id']])
-        execute_db('DELETE FROM activities WHERE lead_id = ?', [lead['id']])
-        execute_db('DELETE FROM leads WHERE id = ?', [lead['id']])
+    # Small bins are purged right away in one transaction; big ones in batches in the background
+    background = count > TRASH_PURGE_BATCH
+    if background:
+        run_in_background(run_trash_purge)
+    else:
+        with db_transaction() as db:
+            released = purge_leads(db, [row[0] for row in db.execute('SELECT id FROM leads WHERE deleted_at IS NOT NULL')])
+        remove_released_blobs(released)
 
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return jsonify({'success': True, 'count': len(deleted_leads)})
+        return jsonify({'success': True, 'count': count, 'background': background})
 
-    flash(f'{len(deleted_leads)} lead(s) permanently deleted', 'success')
+    if background:
+        flash(f'Permanently deleting {count} lead(s) in the background', 'success')
+    else:
+        flash(f'{count} lead(s) permanently deleted', 'success')
     return redirect(url_for('trash'))
 
 @app.route('/leads/<int:id>/activity', methods=['POST'])
@@ -1401,8 +2704,8 @@ def validate_api_key(api_key):
     if not api_key:
         return False
     try:
-        settings = query_db('SELECT value FROM app_settings WHERE key = ?', ['api_key'], one=True)
-        if settings and settings['value'] == api_key:
+        stored_key = get_setting('api_key')
+        if stored_key and stored_key == api_key:
             return True
     except Exception:
         # Table doesn't exist, use fallback key
@@ -1451,8 +2754,39 @@ def api_leads():
         leads = query_db('SELECT * FROM leads ORDER BY created_at DESC')
     return jsonify([lead_to_dict(lead) for lead in leads])
 
+# Streaming NDJSON export of leads with custom fields (supports API key authentication)
+@app.route('/api/leads/export.ndjson', methods=['GET'])
+def api_export_leads_ndjson():
+    api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
+    if api_key:
+        if not validate_api_key(api_key):
+            return jsonify({'error': 'Invalid API key'}), 401
+        user_id = None
+    elif 'user_id' in session:
+        user_id = session.get('user_id')
+    else:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    where, args, columns, custom_field_ids = export_request_params(user_id)
+
+    def generate():
+        for batch, values in iter_export_batches(where, args, custom_field_ids):
+            lines = []
+            for lead in batch:
+                lead_values = values.get(lead['id'], {})
+                record = {column: lead[column] for _, column, cf in columns if column}
+                record['custom_fields'] = {
+                    cf['field_key']: export_field_value(cf['field_type'], lead_values.get(cf['id']), as_json=True)
+                    for _, _, cf in columns if cf
+                }
+                lines.append(json.dumps(record))
+            yield '\n'.join(lines) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
 # API endpoint for creating leads via webhook (supports API key authentication)
 @app.route('/api/leads', methods=['POST'])
+@idempotent
 def api_create_lead():
     # Check for API key authentication
     api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
@@ -1498,8 +2832,134 @@ def api_create_lead():
     return jsonify({'success': True, 'lead': lead_to_dict(lead)}), 201
 
 
+# API endpoint for creating many leads in one transaction (supports API key authentication)
+@app.route('/api/leads/batch', methods=['POST'])
+@idempotent
+def api_create_leads_batch():
+    """
+    Create many leads at once for backfills and form backlogs.
+    Accepts a JSON array of lead objects, or {"leads": [...], "notify": false}.
+    Each lead may carry "custom_fields": {field_key: value}.
+    Valid leads are inserted with executemany in a single transaction; returns per-item results.
+    """
+    # Check for API key authentication
+    api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
+    if api_key:
+        if not validate_api_key(api_key):
+            return jsonify({'error': 'Invalid API key'}), 401
+    elif 'user_id' not in session:
+        return jsonify({'error': 'Authentication required'}), 401
+
+    data = request.get_json(silent=True)
+    notify = False
+    if isinstance(data, dict):
+        notify = bool(data.get('notify', False))
+        data = data.get('leads')
+    if not isinstance(data, list):
+        return jsonify({'error': 'Expected a JSON array of leads'}), 400
+    if len(data) > MAX_BATCH_LEADS:
+        return jsonify({'error': f'Too many leads in one batch (max {MAX_BATCH_LEADS})'}), 400
+
+    custom_fields = query_db('SELECT id, field_key, field_type FROM custom_fields')
+    field_map = {f['field_key']: {'id': f['id'], 'type': f['field_type']} for f in custom_fields}
+
+    # Validate everything up front so the transaction only contains good rows
+    results = []
+    lead_rows = []
+    lead_custom_values = []
+    for index, item in enumerate(data):
+        if not isinstance(item, dict):
+            results.append({'index': index, 'success': False, 'error': 'Lead must be an object'})
+            continue
+        name = str(item.get('name') or '').strip()
+        if not name:
+            results.append({'index': index, 'success': False, 'error': 'Name is required'})
+            continue
+        # Objects and lists can't be bound as column values; reject them here rather than failing the batch
+        non_scalar = [
+            column for column in ('email', 'phone', 'address', 'job_type', 'property_type', 'status', 'notes')
+            if item.get(column) is not None and not isinstance(item[column], (str, int, float))
+        ]
+        if non_scalar:
+            results.append({'index': index, 'success': False,
+                            'error': f'Fields must be text or numbers: {", ".join(non_scalar)}'})
+            continue
+
+        fields = item.get('custom_fields') or {}
+        if not isinstance(fields, dict):
+            results.append({'index': index, 'success': False, 'error': 'custom_fields must be an object'})
+            continue
+        unknown = [key for key in fields if key not in field_map]
+        if unknown:
+            results.append({'index': index, 'success': False, 'error': f'Unknown custom fields: {", ".join(unknown)}'})
+            continue
+        file_keys = [key for key in fields if field_map[key]['type'] == 'file']
+        if file_keys:
+            results.append({'index': index, 'success': False,
+                            'error': f'File fields can only be set by upload: {", ".join(file_keys)}'})
+            continue
+
+        lead_rows.append((
+            name,
+            item.get('email', ''),
+            item.get('phone', ''),
+            item.get('address', ''),
+            item.get('job_type', ''),
+            item.get('property_type', ''),
+            item.get('status', 'New Lead'),
+            item.get('notes', ''),
+            None  # Created by API
+        ))
+        lead_custom_values.append([
+            (field_map[key]['id'], coerce_api_field_value(field_map[key]['type'], value))
+            for key, value in fields.items()
+        ])
+        results.append({'index': index, 'success': True})
+
+    try:
+        with db_transaction() as db:
+            lead_ids = insert_leads_bulk(db, lead_rows)
+            value_rows = [
+                (lead_id, field_id, value)
+                for lead_id, values in zip(lead_ids, lead_custom_values)
+                for field_id, value in values
+            ]
+            write_field_values(db, value_rows)
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Batch insert failed: {e}'}), 500
+
+    id_iter = iter(lead_ids)
+    for result in results:
+        if result['success']:
+            result['id'] = next(id_iter)
+
+    # Webhooks are opt-in for batches so backfills don't fire thousands of notifications
+    if notify and lead_ids:
+        placeholders = ', '.join('?' for _ in lead_ids)
+        for lead in query_db(f'SELECT * FROM leads WHERE id IN ({placeholders})', lead_ids):
+            send_to_zapier(lead_to_dict(lead))
+            notify_new_lead(lead_to_dict(lead))
+
+    return jsonify({
+        'success': True,
+        'created': len(lead_ids),
+        'failed': len(results) - len(lead_ids),
+        'results': results
+    }), 201
+
+
+def coerce_api_field_value(field_type, value):
+    """Normalize a custom field value sent through the JSON API into its stored text form"""
+    if field_type == 'checkbox':
+        return '1' if value in [True, 'true', '1', 1, 'Yes', 'yes'] else '0'
+    if field_type == 'multi_select' and isinstance(value, list):
+        return json.dumps(value)
+    return str(value)
+
+
 # API endpoint for updating lead custom fields (supports API key)
 @app.route('/api/leads/<int:lead_id>/custom-fields', methods=['POST'])
+@idempotent
 def api_update_custom_fields(lead_id):
     """Update custom field values for a lead via API"""
     # Check for API key authentication
@@ -1525,39 +2985,25 @@ def api_update_custom_fields(lead_id):
     # Get all custom fields to map field_key to id
     custom_fields = query_db('SELECT id, field_key, field_type FROM custom_fields')
     field_map = {f['field_key']: {'id': f['id'], 'type': f['field_type']} for f in custom_fields}
+    file_keys = [key for key in fields if key in field_map and field_map[key]['type'] == 'file']
+    if file_keys:
+        return jsonify({'error': f'File fields can only be set by upload: {", ".join(file_keys)}'}), 400
 
+    value_rows = []
     for field_key, value in fields.items():
         if field_key not in field_map:
             continue
         
         field_info = field_map[field_key]
-        field_id = field_info['id']
-        
+
         # Handle special types
-        if field_info['type'] == 'checkbox':
-            value = '1' if value in [True, 'true', '1', 1, 'Yes', 'yes'] else '0'
-        elif field_info['type'] == 'multi_select' and isinstance(value, list):
-            import json
-            value = json.dumps(value)
-        
-        # Upsert
-        existing = query_db(
-            'SELECT id FROM field_values WHERE lead_id = ? AND field_id = ?',
-            [lead_id, field_id], one=True
-        )
-        
-        if existing:
-            execute_db(
-                'UPDATE field_values SET value = ? WHERE lead_id = ? AND field_id = ?',
-                [str(value), lead_id, field_id]
-            )
-        else:
-            execute_db(
-                'INSERT INTO field_values (lead_id, field_id, value) VALUES (?, ?, ?)',
-                [lead_id, field_id, str(value)]
-            )
+        value = coerce_api_field_value(field_info['type'], value)
+        value_rows.append((lead_id, field_info['id'], str(value)))
         updated += 1
 
+    with db_transaction() as db:
+        write_field_values(db, value_rows)
+
     return jsonify({'success': True, 'updated': updated})
 
 
@@ -1586,6 +3032,7 @@ def api_delete_lead(lead_id):
 
 # API endpoint for updating lead core fields (supports API key)
 @app.route('/api/leads/<int:lead_id>', methods=['PUT', 'PATCH'])
+@idempotent
 def api_update_lead(lead_id):
     """Update core lead fields via API"""
     # Check for API key authentication
@@ -1639,15 +3086,12 @@ def settings():
     user = query_db('SELECT * FROM users WHERE id = ?', [session.get('user_id')], one=True)
     # Get all users for user management
     users = query_db('SELECT id, email, name, role, created_at FROM users ORDER BY name')
-    # Get API key
-    api_key_setting = query_db('SELECT value FROM app_settings WHERE key = ?', ['api_key'], one=True)
-    api_key = api_key_setting['value'] if api_key_setting else None
-
-    # Get backup settings
-    last_backup_setting = query_db('SELECT value FROM app_settings WHERE key = ?', ['last_backup'], one=True)
-    last_backup = last_backup_setting['value'] if last_backup_setting else None
-    backup_email_setting = query_db('SELECT value FROM app_settings WHERE key = ?', ['backup_email'], one=True)
-    backup_email = backup_email_setting['value'] if backup_email_setting else ''
+    # Get API key and backup settings
+    app_settings = get_settings('api_key', 'last_backup', 'backup_email', 'google_places_api_key', 'last_activity_archive',
+                                'upload_gc_report')
+    api_key = app_settings['api_key']
+    last_backup = app_settings['last_backup']
+    backup_email = app_settings['backup_email'] or ''
 
     # Get backup count
     backup_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
@@ -1657,6 +3101,8 @@ def settings():
 
     # Get trash count
     trash_count = query_db('SELECT COUNT(*) as count FROM leads WHERE deleted_at IS NOT NULL', one=True)['count']
+    archive_days, archive_closed_days = get_activity_archive_days()
+    trash_retention_days = get_setting('trash_retention_days', str(TRASH_RETENTION_DAYS))
 
     return render_template('settings.html',
                           zapier_webhook=ZAPIER_WEBHOOK_URL,
@@ -1664,26 +3110,29 @@ def settings():
                           users=users,
                           api_key=api_key,
                           last_backup=last_backup,
+                          backup_progress=get_backup_progress(),
                           backup_email=backup_email,
                           backup_count=backup_count,
                           trash_count=trash_count,
+                          archive_days=archive_days,
+                          trash_retention_days=trash_retention_days,
+                          archive_closed_days=archive_closed_days,
+                          last_activity_archive=app_settings['last_activity_archive'],
+                          upload_gc_report=fromjson_filter(app_settings['upload_gc_report']),
+                          upload_gc_running=_upload_gc_lock.locked(),
                           status_colors=get_status_colors(),
-                          google_places_api_key=get_google_places_api_key())
+                          google_places_api_key=app_settings['google_places_api_key'])
 
 @app.route('/settings/save-google-places-key', methods=['POST'])
 @login_required
 def save_google_places_key():
     if request.form.get('remove_key'):
-        execute_db('DELETE FROM app_settings WHERE key = ?', ['google_places_api_key'])
+        delete_setting('google_places_api_key')
         flash('Google Places API key removed', 'success')
     else:
         api_key = request.form.get('google_places_api_key', '').strip()
         if api_key:
-            existing = query_db('SELECT id FROM app_settings WHERE key = ?', ['google_places_api_key'], one=True)
-            if existing:
-                execute_db('UPDATE app_settings SET value = ? WHERE key = ?', [api_key, 'google_places_api_key'])
-            else:
-                execute_db('INSERT INTO app_settings (key, value) VALUES (?, ?)', ['google_places_api_key', api_key])
+            set_setting('google_places_api_key', api_key)
             flash('Google Places API key saved. Address autocomplete is now enabled.', 'success')
         else:
             flash('Please enter a valid API key', 'error')
@@ -1696,11 +3145,7 @@ def generate_api_key():
     new_key = secrets.token_urlsafe(32)
 
     # Upsert the API key
-    existing = query_db('SELECT id FROM app_settings WHERE key = ?', ['api_key'], one=True)
-    if existing:
-        execute_db('UPDATE app_settings SET value = ? WHERE key = ?', [new_key, 'api_key'])
-    else:
-        execute_db('INSERT INTO app_settings (key, value) VALUES (?, ?)', ['api_key', new_key])
+    set_setting('api_key', new_key)
 
     flash('New API key generated', 'success')
     return redirect(url_for('settings'))
@@ -1708,7 +3153,7 @@ def generate_api_key():
 @app.route('/settings/revoke-api-key', methods=['POST'])
 @login_required
 def revoke_api_key():
-    execute_db('DELETE FROM app_settings WHERE key = ?', ['api_key'])
+    delete_setting('api_key')
     flash('API key revoked', 'success')
     return redirect(url_for('settings'))
 
@@ -1826,7 +3271,10 @@ def delete_user(id):
         flash('Cannot delete the last user', 'error')
         return redirect(url_for('settings'))
 
-    execute_db('DELETE FROM users WHERE id = ?', [id])
+    # Keep the user's leads, activities and views; just drop the authorship
+    with db_transaction() as db:
+        detach_references(db, 'users', [id])
+        db.execute('DELETE FROM users WHERE id = ?', [id])
     flash('User deleted successfully', 'success')
     return redirect(url_for('settings'))
 
@@ -1858,8 +3306,17 @@ def slugify(text):
 
 def get_custom_fields():
     """Get all custom fields ordered by sequence"""
-    rows = query_db('SELECT * FROM custom_fields ORDER BY sequence, id')
-    return [dict(row) for row in rows] if rows else []
+    def load():
+        rows = query_db('SELECT * FROM custom_fields ORDER BY sequence, id')
+        return [dict(row) for row in rows] if rows else []
+    return [dict(field) for field in cached('schema', 'custom_fields', load)]
+
+def get_custom_fields_by_id():
+    """{field_id: field} for all custom fields (cached - treat as read-only)"""
+    def load():
+        rows = query_db('SELECT * FROM custom_fields')
+        return {row['id']: dict(row) for row in rows}
+    return cached('schema', 'custom_fields_by_id', load)
 
 def get_visible_fields(user_id):
     """Get fields visible to a specific user with their visibility settings"""
@@ -1883,10 +3340,145 @@ def get_field_values(lead_id):
     ''', [lead_id])
     return {v['field_key']: {'value': v['value'], 'type': v['field_type']} for v in values}
 
+def get_field_values_for_leads(lead_ids):
+    """get_field_values() for many leads at once: {lead_id: {field_key: {'value', 'type'}}}"""
+    lead_ids = list(lead_ids)
+    values = {lead_id: {} for lead_id in lead_ids}
+    for start in range(0, len(lead_ids), 500):
+        chunk = lead_ids[start:start + 500]
+        rows = query_db(f'''
+            SELECT fv.lead_id, cf.field_key, fv.value, cf.field_type
+            FROM field_values fv
+            JOIN custom_fields cf ON fv.field_id = cf.id
+            WHERE fv.lead_id IN ({','.join('?' * len(chunk))})
+        ''', chunk)
+        for row in rows:
+            values[row['lead_id']][row['field_key']] = {'value': row['value'], 'type': row['field_type']}
+    return values
+
+# Materialized custom field matrix: one row per lead, one typed column (f_<field id>) per field.
+# field_values stays the source of truth; write_field_values() keeps the matrix in step.
+LEAD_FIELD_MATRIX_ENABLED = os.environ.get('LEAD_FIELD_MATRIX', '1').lower() not in ('0', 'false', 'no')
+
+# Column affinity per field type (anything not listed is TEXT)
+MATRIX_COLUMN_TYPES = {
+    'number': 'NUMERIC',
+    'currency': 'NUMERIC',
+    'checkbox': 'INTEGER',
+}
+
+def matrix_column(field_id):
+    return f'f_{int(field_id)}'
+
+def get_lead_field_matrix_columns(db):
+    """Column names of lead_field_matrix (empty set if the table doesn't exist)"""
+    return {row[1] for row in db.execute('PRAGMA table_info(lead_field_matrix)')}
+
+def rebuild_lead_field_matrix(db):
+    """Recreate lead_field_matrix from custom_fields/field_values (call inside a transaction)"""
+    db.execute('DROP TABLE IF EXISTS lead_field_matrix')
+    if not LEAD_FIELD_MATRIX_ENABLED:
+        return
+
+    fields = db.execute('SELECT id, field_type FROM custom_fields ORDER BY id').fetchall()
+    column_defs = ''.join(
+        f", {matrix_column(f['id'])} {MATRIX_COLUMN_TYPES.get(f['field_type'], 'TEXT')}" for f in fields
+    )
+    db.execute(f'CREATE TABLE lead_field_matrix (lead_id INTEGER PRIMARY KEY{column_defs})')
+    if not fields:
+        return
+
+    # Pivot the EAV rows; column affinity converts numbers/checkboxes as they're stored
+    columns = ', '.join(matrix_column(f['id']) for f in fields)
+    pivots = ', '.join(
+        f"NULLIF(MAX(CASE WHEN field_id = {int(f['id'])} THEN value END), '')" for f in fields
+    )
+    db.execute(f'''
+        INSERT INTO lead_field_matrix (lead_id, {columns})
+        SELECT lead_id, {pivots} FROM field_values GROUP BY lead_id
+    ''')
+
+def ensure_lead_field_matrix(db):
+    """Build the matrix if it's missing or its columns don't match the current custom fields"""
+    existing = get_lead_field_matrix_columns(db)
+    if not LEAD_FIELD_MATRIX_ENABLED:
+        if existing:
+            db.execute('DROP TABLE lead_field_matrix')
+        return
+    expected = {'lead_id'} | {matrix_column(row[0]) for row in db.execute('SELECT id FROM custom_fields')}
+    if existing != expected:
+        rebuild_lead_field_matrix(db)
+        print("Rebuilt lead_field_matrix")
+
+def write_field_values(db, rows):
+    """
+    Upsert (lead_id, field_id, value) rows into field_values (with their typed shadow columns)
+    and keep field_value_options and lead_field_matrix in step.
+    Doesn't commit - use inside db_transaction() so both tables change together.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    field_ids = {field_id for _, field_id, _ in rows}
+    field_types = dict(db.execute(
+        f'SELECT id, field_type FROM custom_fields WHERE id IN ({",".join("?" * len(field_ids))})',
+        list(field_ids)
+    ).fetchall())
+    # Values for fields that no longer exist would violate the field_id foreign key
+    rows = [row for row in rows if row[1] in field_types]
+    db.executemany(
+        '''INSERT INTO field_values (lead_id, field_id, value, value_num, value_date) VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(lead_id, field_id) DO UPDATE SET
+               value = excluded.value, value_num = excluded.value_num, value_date = excluded.value_date''',
+        [
+            (lead_id, field_id, value) + typed_field_values(field_types.get(field_id), value)
+            for lead_id, field_id, value in rows
+        ]
+    )
+    sync_field_value_options(db, [row for row in rows if field_types.get(row[1]) == 'multi_select'])
+
+    if not LEAD_FIELD_MATRIX_ENABLED:
+        return
+    matrix_columns = get_lead_field_matrix_columns(db)
+    by_field = {}
+    for lead_id, field_id, value in rows:
+        by_field.setdefault(field_id, []).append((lead_id, None if value == '' else value))
+    for field_id, field_rows in by_field.items():
+        column = matrix_column(field_id)
+        if column not in matrix_columns:
+            continue
+        db.executemany(
+            f'''INSERT INTO lead_field_matrix (lead_id, {column}) VALUES (?, ?)
+                ON CONFLICT(lead_id) DO UPDATE SET {column} = excluded.{column}''',
+            field_rows
+        )
+
+def existing_field_ids(db, field_ids):
+    """
+    Unique custom field IDs from a client payload that actually exist, in the given order.
+    Raises ValueError if the payload isn't a list of integers.
+    """
+    if not isinstance(field_ids, list):
+        raise ValueError('field IDs must be a list')
+    try:
+        field_ids = list(dict.fromkeys(int(field_id) for field_id in field_ids))
+    except TypeError:
+        raise ValueError('field IDs must be integers')
+    if not field_ids:
+        return []
+    existing = {row[0] for row in db.execute(
+        f'SELECT id FROM custom_fields WHERE id IN ({",".join("?" * len(field_ids))})', field_ids
+    )}
+    return [field_id for field_id in field_ids if field_id in existing]
+
 def save_field_values(lead_id, form_data):
     """Save custom field values from form submission"""
     fields = get_custom_fields()
+    rows = []
     for field in fields:
+        # File fields are only changed through the upload endpoints
+        if field['field_type'] == 'file':
+            continue
         field_key = f"custom_{field['field_key']}"
         value = form_data.get(field_key, '')
         
@@ -1899,50 +3491,160 @@ def save_field_values(lead_id, form_data):
         if field['field_type'] == 'checkbox':
             value = '1' if value else '0'
         
-        # Upsert the value
-        existing = query_db(
-            'SELECT id FROM field_values WHERE lead_id = ? AND field_id = ?',
-            [lead_id, field['id']], one=True
-        )
-        
-        if existing:
-            execute_db(
-                'UPDATE field_values SET value = ? WHERE lead_id = ? AND field_id = ?',
-                [value, lead_id, field['id']]
-            )
+        rows.append((lead_id, field['id'], value))
+
+    with db_transaction() as db:
+        write_field_values(db, rows)
+
+# Ordering Helper Functions
+# `sequence` columns hold fractional ranks: an insert or a move writes one row with a rank
+# between its neighbours, and the whole list is renumbered only when a gap runs out.
+RANK_MIN_GAP = 1e-6
+
+def rank_between(before, after):
+    """Rank for a row placed between two neighbours (None for either end of the list)"""
+    if before is None and after is None:
+        return 1.0
+    if before is None:
+        return after - 1.0
+    if after is None:
+        return before + 1.0
+    return (before + after) / 2.0
+
+def _ordered_indices(ranks):
+    """Indices of the longest strictly increasing run of ranks (None ranks never qualify)"""
+    tails, tail_ranks = [], []
+    previous = [None] * len(ranks)
+    for i, rank in enumerate(ranks):
+        if rank is None:
+            continue
+        pos = bisect.bisect_left(tail_ranks, rank)
+        if pos:
+            previous[i] = tails[pos - 1]
+        if pos == len(tails):
+            tails.append(i)
+            tail_ranks.append(rank)
         else:
-            execute_db(
-                'INSERT INTO field_values (lead_id, field_id, value) VALUES (?, ?, ?)',
-                [lead_id, field['id'], value]
-            )
+            tails[pos] = i
+            tail_ranks[pos] = rank
+    keep = set()
+    i = tails[-1] if tails else None
+    while i is not None:
+        keep.add(i)
+        i = previous[i]
+    return keep
+
+def plan_rank_updates(ordered_ids, current_ranks):
+    """
+    New ranks that make ordered_ids read in rank order, touching only the rows that moved.
+    Rows already in relative order keep their rank; the others are slotted between neighbours.
+    Returns {id: rank}, or None when a gap is exhausted and the list needs rebalancing.
+    """
+    ranks = [current_ranks.get(row_id) for row_id in ordered_ids]
+    keep = _ordered_indices(ranks)
+    updates = {}
+    previous_rank = None
+    i = 0
+    while i < len(ordered_ids):
+        if i in keep:
+            previous_rank = ranks[i]
+            i += 1
+            continue
+        # Run of rows to place between previous_rank and the next kept rank
+        j = i
+        while j < len(ordered_ids) and j not in keep:
+            j += 1
+        next_rank = ranks[j] if j < len(ordered_ids) else None
+        count = j - i
+        if previous_rank is None and next_rank is None:
+            new_ranks = [float(k + 1) for k in range(count)]
+        elif previous_rank is None:
+            new_ranks = [next_rank - (count - k) for k in range(count)]
+        elif next_rank is None:
+            new_ranks = [previous_rank + k + 1 for k in range(count)]
+        else:
+            step = (next_rank - previous_rank) / (count + 1)
+            if step < RANK_MIN_GAP:
+                return None
+            new_ranks = [previous_rank + step * (k + 1) for k in range(count)]
+        for k, rank in enumerate(new_ranks):
+            updates[ordered_ids[i + k]] = rank
+        previous_rank = new_ranks[-1]
+        i = j
+    return updates
+
+def apply_rank_order(db, table, ordered_ids, scope='1 = 1', scope_args=(), id_column='id'):
+    """
+    Reorder rows of `table` (within `scope`) to match ordered_ids, writing only moved rows.
+    Returns {id: rank} for ids with no row yet, so the caller can insert them.
+    """
+    current = dict(db.execute(
+        f'SELECT {id_column}, sequence FROM {table} WHERE {scope}', list(scope_args)
+    ).fetchall())
+    updates = plan_rank_updates(ordered_ids, current)
+    if updates is None:
+        # Gaps exhausted: renumber the whole list in this transaction
+        updates = {row_id: float(i + 1) for i, row_id in enumerate(ordered_ids)}
+    db.executemany(
+        f'UPDATE {table} SET sequence = ? WHERE {scope} AND {id_column} = ?',
+        [(rank, *scope_args, row_id) for row_id, rank in updates.items() if row_id in current]
+    )
+    return {row_id: rank for row_id, rank in updates.items() if row_id not in current}
+
+def rank_after(db, table, row_id, scope='1 = 1', scope_args=(), id_column='id'):
+    """Rank for a new row placed right after row_id (rebalancing the list if the gap is used up)"""
+    for _ in range(2):
+        after = db.execute(
+            f'SELECT {id_column} AS row_id, sequence FROM {table} WHERE {scope} AND {id_column} = ?',
+            [*scope_args, row_id]
+        ).fetchone()
+        if not after:
+            return None
+        following = db.execute(
+            f'''SELECT sequence FROM {table}
+                WHERE {scope} AND (sequence > ? OR (sequence = ? AND {id_column} > ?))
+                ORDER BY sequence, {id_column} LIMIT 1''',
+            [*scope_args, after['sequence'], after['sequence'], row_id]
+        ).fetchone()
+        if not following or following['sequence'] - after['sequence'] >= RANK_MIN_GAP:
+            return rank_between(after['sequence'], following['sequence'] if following else None)
+        ordered = [row[0] for row in db.execute(
+            f'SELECT {id_column} FROM {table} WHERE {scope} ORDER BY sequence, {id_column}', list(scope_args)
+        )]
+        db.executemany(
+            f'UPDATE {table} SET sequence = ? WHERE {scope} AND {id_column} = ?',
+            [(float(i + 1), *scope_args, rid) for i, rid in enumerate(ordered)]
+        )
+    return None
 
 # Views Helper Functions
 def get_all_views():
     """Get all views ordered by name"""
-    return query_db('SELECT * FROM views ORDER BY name')
+    return cached('schema', 'views', lambda: query_db('SELECT * FROM views ORDER BY name'))
 
 def get_view_by_id(view_id):
     """Get a single view by ID"""
-    return query_db('SELECT * FROM views WHERE id = ?', [view_id], one=True)
+    return cached('schema', ('view', view_id), lambda: query_db(
+        'SELECT * FROM views WHERE id = ?', [view_id], one=True
+    ))
 
 def get_fields_for_view(view_id):
     """Get all fields associated with a view, ordered by sequence"""
-    return query_db('''
+    return cached('schema', ('view_fields', view_id), lambda: query_db('''
         SELECT cf.*, vf.sequence as view_sequence
         FROM custom_fields cf
         JOIN view_fields vf ON cf.id = vf.field_id
         WHERE vf.view_id = ?
         ORDER BY vf.sequence, cf.id
-    ''', [view_id])
+    ''', [view_id]))
 
 def get_user_current_view(user_id):
-    """Get the user's currently selected view"""
-    pref = query_db('''
+    """Get the user's currently selected view (not cached: it's per user, and one indexed lookup)"""
+    return query_db('''
         SELECT v.* FROM views v
         JOIN user_view_preferences uvp ON v.id = uvp.current_view_id
         WHERE uvp.user_id = ?
     ''', [user_id], one=True)
-    return pref
 
 def set_user_current_view(user_id, view_id):
     """Set the user's current view preference"""
@@ -1961,21 +3663,84 @@ def set_user_current_view(user_id, view_id):
             [user_id, view_id]
         )
 
+# Settings Helper Functions
+def get_all_settings():
+    """All app_settings as a {key: value} dict, loaded in one query and cached per worker"""
+    return cached('settings', 'all', lambda: {
+        row['key']: row['value'] for row in query_db('SELECT key, value FROM app_settings')
+    })
+
+def get_setting(key, default=None):
+    """Get a single app setting"""
+    value = get_all_settings().get(key)
+    return default if value is None else value
+
+def get_settings(*keys):
+    """Get several app settings at once as a {key: value} dict (None when unset)"""
+    settings = get_all_settings()
+    return {key: settings.get(key) for key in keys}
+
+def get_json_setting(key, default=None):
+    """Get a JSON-encoded app setting, parsed (and cached) - treat the result as read-only"""
+    def load():
+        value = get_setting(key)
+        if value is None:
+            return None
+        try:
+            return json.loads(value)
+        except (TypeError, ValueError):
+            return None
+    value = cached('settings', ('json', key), load)
+    return default if value is None else value
+
+def set_settings(values, db=None):
+    """
+    Upsert several app settings ({key: value}); a value of None deletes the key.
+    Commits unless an open transaction's db is passed in.
+    """
+    conn = db or get_db()
+    upserts = [(key, value) for key, value in values.items() if value is not None]
+    deletes = [(key,) for key, value in values.items() if value is None]
+    if upserts:
+        conn.executemany(
+            '''INSERT INTO app_settings (key, value) VALUES (?, ?)
+               ON CONFLICT(key) DO UPDATE SET value = excluded.value''',
+            upserts
+        )
+    if deletes:
+        conn.executemany('DELETE FROM app_settings WHERE key = ?', deletes)
+    bump_cache_version('settings', db=conn)
+    if db is None:
+        conn.commit()
+
+def set_setting(key, value, db=None):
+    """Upsert a single app setting"""
+    set_settings({key: value}, db=db)
+
+def delete_setting(key, db=None):
+    """Remove an app setting"""
+    set_settings({key: None}, db=db)
+
 # Status and Color Helper Functions
 def get_all_statuses():
     """Get all active statuses with colors, ordered by sequence"""
-    statuses = query_db('SELECT * FROM statuses WHERE is_active = 1 ORDER BY sequence')
-    return [dict(s) for s in statuses] if statuses else []
+    def load():
+        statuses = query_db('SELECT * FROM statuses WHERE is_active = 1 ORDER BY sequence')
+        return [dict(s) for s in statuses] if statuses else []
+    return [dict(s) for s in cached('schema', 'statuses', load)]
 
 def get_status_colors():
     """Get status colors as dict for CSS injection"""
-    statuses = get_all_statuses()
-    return {s['name']: {'color': s.get('color', '#6b7280'), 'bg': s.get('bg_color', '#f3f4f6')} for s in statuses}
+    def load():
+        return {
+            s['name']: {'color': s.get('color', '#6b7280'), 'bg': s.get('bg_color', '#f3f4f6')}
+            for s in get_all_statuses()
+        }
+    return cached('schema', 'status_colors', load)
 
 def get_google_places_api_key():
     """Get Google Places API key from app_settings"""
-    setting = query_db('SELECT value FROM app_settings WHERE key = ?', ['google_places_api_key'], one=True)
-    return setting['value'] if setting else None
+    return get_setting('google_places_api_key')
 
 def get_status_names():
     """Get list of status names (for dropdown compatibility)"""
@@ -1984,8 +3749,10 @@ def get_status_names():
 
 def get_job_types_with_colors():
     """Get all active job types with colors"""
-    types = query_db('SELECT * FROM job_type_colors WHERE is_active = 1 ORDER BY sequence')
-    return [dict(t) for t in types] if types else []
+    def load():
+        types = query_db('SELECT * FROM job_type_colors WHERE is_active = 1 ORDER BY sequence')
+        return [dict(t) for t in types] if types else []
+    return [dict(t) for t in cached('schema', 'job_types', load)]
 
 def get_job_type_colors():
     """Get job type colors as dict"""
@@ -1994,8 +3761,10 @@ def get_job_type_colors():
 
 def get_property_types_with_colors():
     """Get all active property types with colors"""
-    types = query_db('SELECT * FROM property_type_colors WHERE is_active = 1 ORDER BY sequence')
-    return [dict(t) for t in types] if types else []
+    def load():
+        types = query_db('SELECT * FROM property_type_colors WHERE is_active = 1 ORDER BY sequence')
+        return [dict(t) for t in types] if types else []
+    return [dict(t) for t in cached('schema', 'property_types', load)]
 
 def get_property_type_colors():
     """Get property type colors as dict"""
@@ -2023,33 +3792,123 @@ def log_activity(lead_id, activity_type, content, user_id=None, metadata=None):
         VALUES (?, ?, ?, ?, ?)
     ''', [lead_id, user_id, activity_type, content, meta_json])
 
-def get_lead_activities(lead_id, limit=50):
-    """Get activities for a lead, most recent first"""
-    import json
-    activities = query_db('''
+ACTIVITY_PAGE_SIZE = 50
+
+def parse_activity_metadata(raw):
+    """Stored metadata JSON -> dict (empty on missing/invalid)"""
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return {}
+
+def encode_activity_cursor(activity):
+    return f"{activity['created_at']}|{activity['id']}"
+
+def decode_activity_cursor(cursor):
+    """'created_at|id' -> (created_at, id), or None if malformed"""
+    created_at, sep, activity_id = (cursor or '').rpartition('|')
+    if not sep or not created_at or not activity_id.isdigit():
+        return None
+    return created_at, int(activity_id)
+
+def _activity_rows(table, lead_id, before, limit):
+    where = 'a.lead_id = ?'
+    args = [lead_id]
+    if before:
+        where += ' AND (a.created_at < ? OR (a.created_at = ? AND a.id < ?))'
+        args += [before[0], before[0], before[1]]
+
+    return query_db(f'''
         SELECT a.*, u.name as user_name
-        FROM activities a
+        FROM {table} a
         LEFT JOIN users u ON a.user_id = u.id
-        WHERE a.lead_id = ?
-        ORDER BY a.created_at DESC
+        WHERE {where}
+        ORDER BY a.created_at DESC, a.id DESC
         LIMIT ?
-    ''', [lead_id, limit])
+    ''', args + [limit])
+
+def get_activity_page(lead_id, before=None, limit=ACTIVITY_PAGE_SIZE, parse_metadata=False):
+    """One page of a lead's timeline, newest first, keyset-paginated on (created_at, id).
 
-    result = []
-    for act in activities:
+    Returns (activities, next_cursor); next_cursor is None on the last page. Metadata is
+    left as the raw JSON string unless parse_metadata is set.
+    """
+    rows = _activity_rows('activities', lead_id, before, limit + 1)
+    if len(rows) <= limit:
+        # Past the hot range: archived rows are always older, so continue from the last hot row
+        archive_before = (rows[-1]['created_at'], rows[-1]['id']) if rows else before
+        rows += _activity_rows('activities_archive', lead_id, archive_before, limit + 1 - len(rows))
+
+    activities = []
+    for act in rows[:limit]:
         a = dict(act)
-        # Parse metadata JSON
-        if a.get('metadata'):
-            try:
-                a['metadata'] = json.loads(a['metadata'])
-            except:
-                a['metadata'] = {}
-        else:
-            a['metadata'] = {}
-        # Add activity type info
+        if parse_metadata:
+            a['metadata'] = parse_activity_metadata(a.get('metadata'))
         a['type_info'] = ACTIVITY_TYPES.get(a.get('activity_type', 'note'), ACTIVITY_TYPES['note'])
-        result.append(a)
-    return result
+        activities.append(a)
+    next_cursor = encode_activity_cursor(activities[-1]) if len(rows) > limit else None
+    return activities, next_cursor
+
+def get_lead_activities(lead_id, limit=50):
+    """Get activities for a lead, most recent first"""
+    return get_activity_page(lead_id, limit=limit, parse_metadata=True)[0]
+
+# Activity archival: old activities, and those of closed leads, move to activities_archive
+# so the hot table stays small. Ages are app settings (days).
+ACTIVITY_ARCHIVE_DAYS = 180
+ACTIVITY_ARCHIVE_CLOSED_DAYS = 30
+ACTIVITY_ARCHIVE_CLOSED_STATUSES = ('Won', 'Lost')
+ACTIVITY_ARCHIVE_BATCH = 1000
+ACTIVITY_ARCHIVE_INTERVAL_HOURS = 24
+_activity_archive_lock = threading.Lock()
+
+def get_activity_archive_days():
+    """(age_days, closed_age_days) from settings, falling back to the defaults"""
+    settings = get_settings('activity_archive_days', 'activity_archive_closed_days')
+    def days(value, default):
+        try:
+            return max(int(value), 7)
+        except (TypeError, ValueError):
+            return default
+    return (days(settings['activity_archive_days'], ACTIVITY_ARCHIVE_DAYS),
+            days(settings['activity_archive_closed_days'], ACTIVITY_ARCHIVE_CLOSED_DAYS))
+
+def archive_activities(batch_size=ACTIVITY_ARCHIVE_BATCH):
+    """Move archivable activities to activities_archive in batches. Returns the number moved."""
+    if not _activity_archive_lock.acquire(blocking=False):
+        return 0
+    try:
+        age_days, closed_days = get_activity_archive_days()
+        closed = ', '.join('?' for _ in ACTIVITY_ARCHIVE_CLOSED_STATUSES)
+        columns = 'id, lead_id, user_id, content, created_at, activity_type, metadata'
+        moved = 0
+        while True:
+            with db_transaction() as db:
+                ids = [row[0] for row in db.execute(f'''
+                    SELECT a.id FROM activities a
+                    LEFT JOIN leads l ON l.id = a.lead_id
+                    WHERE a.created_at < datetime('now', ?)
+                       OR (l.status IN ({closed}) AND a.created_at < datetime('now', ?))
+                    LIMIT ?
+                ''', [f'-{age_days} days', *ACTIVITY_ARCHIVE_CLOSED_STATUSES, f'-{closed_days} days', batch_size])]
+                if not ids:
+                    break
+                placeholders = ', '.join('?' for _ in ids)
+                db.execute(f'''
+                    INSERT OR REPLACE INTO activities_archive ({columns})
+                    SELECT {columns} FROM activities WHERE id IN ({placeholders})
+                ''', ids)
+                db.execute(f'DELETE FROM activities WHERE id IN ({placeholders})', ids)
+            moved += len(ids)
+
+        set_setting('last_activity_archive', datetime.now().isoformat())
+        if moved:
+            print(f"[Archive] Moved {moved} activities to activities_archive")
+        return moved
+    finally:
+        _activity_archive_lock.release()
 
 def check_handoff_trigger(from_status, to_status):
     """Check if a status transition should trigger a handoff"""
@@ -2059,6 +3918,17 @@ def check_handoff_trigger(from_status, to_status):
     ''', [from_status, to_status], one=True)
     return dict(trigger) if trigger else None
 
+def match_handoff_triggers(transitions):
+    """check_handoff_trigger() for many (from_status, to_status) pairs with one query"""
+    triggers = query_db('SELECT * FROM handoff_triggers WHERE is_active = 1 ORDER BY id')
+    matched = {}
+    for from_status, to_status in transitions:
+        for trigger in triggers:
+            if trigger['to_status'] == to_status and trigger['from_status'] in (from_status, None):
+                matched[(from_status, to_status)] = dict(trigger)
+                break
+    return matched
+
 def generate_handoff_summary(lead_id):
     """Generate a handoff summary for a lead"""
     import json
@@ -2077,25 +3947,23 @@ def generate_handoff_summary(lead_id):
         WHERE fv.lead_id = ?
     ''', [lead_id])
 
-    # Get recent activities (last 10)
-    activities = query_db('''
-        SELECT a.*, u.name as user_name
-        FROM activities a
-        LEFT JOIN users u ON a.user_id = u.id
-        WHERE a.lead_id = ?
-        ORDER BY a.created_at DESC
-        LIMIT 10
-    ''', [lead_id])
+    # Get recent activities (last 10), continuing into the archive if needed
+    activities = get_activity_page(lead_id, limit=10)[0]
 
-    # Get notes (last 5 note-type activities)
+    # Get notes (last 5 note-type activities, archived ones included)
     notes = query_db('''
         SELECT a.content, a.created_at, u.name as user_name
-        FROM activities a
+        FROM (
+            SELECT user_id, content, created_at FROM activities
+            WHERE lead_id = ? AND activity_type = 'note'
+            UNION ALL
+            SELECT user_id, content, created_at FROM activities_archive
+            WHERE lead_id = ? AND activity_type = 'note'
+        ) a
         LEFT JOIN users u ON a.user_id = u.id
-        WHERE a.lead_id = ? AND a.activity_type = 'note'
         ORDER BY a.created_at DESC
         LIMIT 5
-    ''', [lead_id])
+    ''', [lead_id, lead_id])
 
     # Build summary
     summary_parts = []
@@ -2196,13 +4064,15 @@ def group_leads_by_fields(leads, group_prefs, all_field_values):
         # No grouping - return flat list
         return {'__flat__': list(leads)}
 
+    field_keys = {cf['id']: cf['field_key'] for cf in get_custom_fields()}
+
     def get_group_value(lead, field_name):
         """Get the value for a field from a lead"""
         if field_name.startswith('custom_'):
             # Custom field - look up in field_values
             field_id = int(field_name.replace('custom_', ''))
             # Find the custom field
-            cf = query_db('SELECT field_key FROM custom_fields WHERE id = ?', [field_id], one=True)
+            cf = {'field_key': field_keys[field_id]} if field_id in field_keys else None
             if cf:
                 values = all_field_values.get(lead['id'], {})
                 val = values.get(cf['field_key'], {}).get('value', '')
@@ -2259,6 +4129,7 @@ def list_fields():
 
 @app.route('/fields/add', methods=['GET', 'POST'])
 @login_required
+@invalidates_cache('schema')
 def add_field():
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
@@ -2284,10 +4155,12 @@ def add_field():
         max_seq = query_db('SELECT MAX(sequence) as max_seq FROM custom_fields', one=True)
         next_seq = (max_seq['max_seq'] or 0) + 1
 
-        execute_db('''
-            INSERT INTO custom_fields (name, field_key, field_type, options, option_colors, is_required, default_value, sequence)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', [name, field_key, field_type, options, option_colors, is_required, default_value, next_seq])
+        with db_transaction() as db:
+            db.execute('''
+                INSERT INTO custom_fields (name, field_key, field_type, options, option_colors, is_required, default_value, sequence)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [name, field_key, field_type, options, option_colors, is_required, default_value, next_seq])
+            rebuild_lead_field_matrix(db)
 
         flash(f'Field "{name}" created successfully', 'success')
         return redirect(url_for('list_fields'))
@@ -2296,6 +4169,7 @@ def add_field():
 
 @app.route('/fields/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
+@invalidates_cache('schema')
 def edit_field(id):
     field = query_db('SELECT * FROM custom_fields WHERE id = ?', [id], one=True)
     if not field:
@@ -2326,10 +4200,14 @@ def edit_field(id):
 
 @app.route('/fields/<int:id>/delete', methods=['POST'])
 @login_required
+@invalidates_cache('schema')
 def delete_field(id):
-    execute_db('DELETE FROM field_values WHERE field_id = ?', [id])
-    execute_db('DELETE FROM field_visibility WHERE field_id = ?', [id])
-    execute_db('DELETE FROM custom_fields WHERE id = ?', [id])
+    with db_transaction() as db:
+        released = release_field_files(db, id)
+        # Values, visibility and view rows cascade
+        db.execute('DELETE FROM custom_fields WHERE id = ?', [id])
+        rebuild_lead_field_matrix(db)
+    remove_released_blobs(released)
     flash('Field deleted successfully', 'success')
     return redirect(url_for('list_fields'))
 
@@ -2377,27 +4255,25 @@ def reorder_fields():
     if not data or 'order' not in data:
         return jsonify({'success': False, 'error': 'Invalid data'}), 400
     
-    for idx, field_id in enumerate(data['order']):
-        existing = query_db(
-            'SELECT id FROM field_visibility WHERE user_id = ? AND field_id = ?',
-            [user_id, field_id], one=True
-        )
-        
-        if existing:
-            execute_db(
-                'UPDATE field_visibility SET sequence = ? WHERE user_id = ? AND field_id = ?',
-                [idx, user_id, field_id]
+    try:
+        with db_transaction() as db:
+            order = existing_field_ids(db, data['order'])
+            # Only moved fields get a new rank; fields without a visibility row yet are inserted
+            new_rows = apply_rank_order(
+                db, 'field_visibility', order, 'user_id = ?', [user_id], id_column='field_id'
             )
-        else:
-            execute_db(
+            db.executemany(
                 'INSERT INTO field_visibility (user_id, field_id, is_visible, sequence) VALUES (?, ?, 1, ?)',
-                [user_id, field_id, idx]
+                [(user_id, field_id, rank) for field_id, rank in new_rows.items()]
             )
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid field id'}), 400
     
     return jsonify({'success': True})
 
 @app.route('/api/fields/add', methods=['POST'])
 @login_required
+@invalidates_cache('schema')
 def api_add_field():
     """AJAX endpoint for adding a new field from the leads page"""
     data = request.get_json()
@@ -2420,41 +4296,58 @@ def api_add_field():
     if existing:
         return jsonify({'success': False, 'error': 'A field with this name already exists'})
 
-    # Calculate sequence number
-    if insert_after:
-        # Get the sequence of the field we're inserting after
-        after_field = query_db('SELECT sequence FROM custom_fields WHERE id = ?', [insert_after], one=True)
-        if after_field:
-            new_sequence = after_field['sequence'] + 1
-            # Shift all fields after this position
-            execute_db('UPDATE custom_fields SET sequence = sequence + 1 WHERE sequence >= ?', [new_sequence])
-        else:
-            # Fallback to end
-            max_seq = query_db('SELECT MAX(sequence) as max_seq FROM custom_fields', one=True)
+    # Insert the new field
+    with db_transaction() as db:
+        # Rank between the field we're inserting after and its successor (no other rows move)
+        new_sequence = rank_after(db, 'custom_fields', insert_after) if insert_after else None
+        if new_sequence is None:
+            # Add to end
+            max_seq = db.execute('SELECT MAX(sequence) as max_seq FROM custom_fields').fetchone()
             new_sequence = (max_seq['max_seq'] or 0) + 1
-    else:
-        # Add to end
-        max_seq = query_db('SELECT MAX(sequence) as max_seq FROM custom_fields', one=True)
-        new_sequence = (max_seq['max_seq'] or 0) + 1
 
-    # Insert the new field
-    field_id = execute_db('''
-        INSERT INTO custom_fields (name, field_key, field_type, options, is_required, default_value, sequence)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', [name, field_key, field_type, options, is_required, default_value, new_sequence])
+        field_id = db.execute('''
+            INSERT INTO custom_fields (name, field_key, field_type, options, is_required, default_value, sequence)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [name, field_key, field_type, options, is_required, default_value, new_sequence]).lastrowid
+        rebuild_lead_field_matrix(db)
 
     return jsonify({'success': True, 'field_id': field_id})
 
+@app.route('/api/fields/<int:field_id>/option-counts', methods=['GET'])
+@login_required
+def api_field_option_counts(field_id):
+    """Number of (non-deleted) leads tagged with each option of a multi-select field"""
+    field = query_db('SELECT * FROM custom_fields WHERE id = ?', [field_id], one=True)
+    if not field:
+        return jsonify({'success': False, 'error': 'Field not found'}), 404
+    if field['field_type'] != 'multi_select':
+        return jsonify({'success': False, 'error': 'Field is not a multi-select field'}), 400
+
+    counts = query_db('''
+        SELECT o.option, COUNT(*) as count
+        FROM field_value_options o
+        JOIN leads l ON l.id = o.lead_id
+        WHERE o.field_id = ? AND l.deleted_at IS NULL
+        GROUP BY o.option
+        ORDER BY count DESC, o.option
+    ''', [field_id])
+    return jsonify({
+        'success': True,
+        'field_id': field_id,
+        'counts': [{'option': row['option'], 'count': row['count']} for row in counts]
+    })
+
 @app.route('/api/fields/<int:id>/delete', methods=['POST'])
 @login_required
+@invalidates_cache('schema')
 def api_delete_field(id):
     """AJAX endpoint for deleting a field"""
-    # Delete associated data first
-    execute_db('DELETE FROM field_values WHERE field_id = ?', [id])
-    execute_db('DELETE FROM field_visibility WHERE field_id = ?', [id])
-    execute_db('DELETE FROM view_fields WHERE field_id = ?', [id])
-    # Delete the field
-    execute_db('DELETE FROM custom_fields WHERE id = ?', [id])
+    with db_transaction() as db:
+        released = release_field_files(db, id)
+        # Values, visibility and view rows cascade
+        db.execute('DELETE FROM custom_fields WHERE id = ?', [id])
+        rebuild_lead_field_matrix(db)
+    remove_released_blobs(released)
 
     return jsonify({'success': True})
 
@@ -2469,42 +4362,81 @@ def api_update_field_value(lead_id, field_id):
     field = query_db('SELECT * FROM custom_fields WHERE id = ?', [field_id], one=True)
     if not field:
         return jsonify({'success': False, 'error': 'Field not found'}), 404
+    if field['field_type'] == 'file':
+        return jsonify({'success': False, 'error': 'File fields can only be set by uploading a file'}), 400
 
-    # Handle multi_select (expects array, store as JSON)
-    if field['field_type'] == 'multi_select' and isinstance(value, list):
-        import json
-        value = json.dumps(value) if value else ''
-
-    # Handle checkbox
-    if field['field_type'] == 'checkbox':
-        value = '1' if value in [True, 'true', '1', 1] else '0'
+    value = normalize_cell_value(field['field_type'], value)
 
     # Upsert the value
-    existing = query_db(
-        'SELECT id FROM field_values WHERE lead_id = ? AND field_id = ?',
-        [lead_id, field_id], one=True
-    )
-
-    if existing:
-        execute_db(
-            'UPDATE field_values SET value = ? WHERE lead_id = ? AND field_id = ?',
-            [value, lead_id, field_id]
-        )
+    with db_transaction() as db:
+        write_field_values(db, [(lead_id, field_id, value)])
+
+    return jsonify({'success': True, 'display_value': format_cell_display(field['field_type'], value)})
+
+
+# Upload serving. Blob names are content hashes, so those responses never change and can be
+# cached for good - by the browser only, since they are customer documents and photos. Set UPLOAD_ACCEL_REDIRECT (an nginx internal location mapped to the uploads
+# folder) or UPLOAD_X_SENDFILE=1 (Apache/lighttpd) to let the front-end server do the transfer.
+UPLOAD_ACCEL_REDIRECT = os.environ.get('UPLOAD_ACCEL_REDIRECT', '')
+app.config['USE_X_SENDFILE'] = os.environ.get('UPLOAD_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+UPLOAD_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+@app.route('/uploads/<path:filename>')
+def serve_upload(filename):
+    """Serve an uploaded file with Range/conditional request support"""
+    path = safe_join(UPLOAD_FOLDER, filename)
+    if path and filename.startswith('derived/') and not os.path.isfile(path):
+        # Not made yet (upload still being processed, or an image from before derivatives existed)
+        ensure_image_derivative(filename)
+    if not path or not os.path.isfile(path) or os.path.basename(path).startswith('.'):
+        abort(404)
+
+    immutable = filename.startswith(('blobs/', 'derived/'))
+    etag = True
+    if immutable:
+        # The sha alone identifies a blob; derivatives of it also need the size name
+        etag = os.path.splitext(os.path.basename(filename))[0]
+        if filename.startswith('derived/'):
+            etag = f"{filename.split('/')[1]}-{etag}"
+    if UPLOAD_ACCEL_REDIRECT:
+        # nginx handles Range/If-None-Match itself once it has the internal redirect
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{UPLOAD_ACCEL_REDIRECT.rstrip('/')}/{filename}"
+        if immutable:
+            response.set_etag(etag)
     else:
-        execute_db(
-            'INSERT INTO field_values (lead_id, field_id, value) VALUES (?, ?, ?)',
-            [lead_id, field_id, value]
-        )
-
-    # Return formatted display value
-    display_value = value
-    if field['field_type'] == 'checkbox':
-        display_value = '✓' if value == '1' else '-'
-    elif field['field_type'] == 'multi_select' and value:
-        display_value = value.replace('[', '').replace(']', '').replace('"', '')
-
-    return jsonify({'success': True, 'display_value': display_value})
+        response = send_file(path, conditional=True, etag=etag,
+                             max_age=UPLOAD_IMMUTABLE_MAX_AGE if immutable else None)
+
+    if immutable:
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.max_age = UPLOAD_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+def ensure_image_derivative(filename):
+    """Generate the derivative behind a derived/<size>/<xx>/<sha>.jpg request, if its blob is an image"""
+    parts = filename.split('/')
+    if not THUMBNAILS_ENABLED or len(parts) != 4 or parts[1] not in IMAGE_DERIVATIVE_SIZES:
+        return
+    sha256 = os.path.splitext(parts[3])[0]
+    blob = query_db('SELECT path FROM file_blobs WHERE sha256 = ?', [sha256], one=True)
+    if not blob or get_file_extension(blob['path']) not in IMAGE_EXTENSIONS:
+        return
+    try:
+        generate_image_derivatives(sha256, blob['path'], [parts[1]])
+    except Exception as e:
+        print(f"[Uploads] Could not make {parts[1]} for {sha256}: {e}")
 
+@app.errorhandler(413)
+def request_too_large(e):
+    """Request bodies over MAX_CONTENT_LENGTH, rejected by Werkzeug while parsing the form"""
+    message = f'File too large. Max size: {MAX_REQUEST_SIZE // (1024*1024)}MB'
+    if request.endpoint == 'import_leads' and request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        flash(message, 'error')
+        return redirect(request.url)
+    return jsonify({'success': False, 'error': message}), 413
 
 @app.route('/api/leads/<int:lead_id>/fields/<int:field_id>/upload', methods=['POST'])
 @login_required
@@ -2524,6 +4456,12 @@ def api_upload_file(lead_id, field_id):
     if field['field_type'] != 'file':
         return jsonify({'success': False, 'error': 'Field is not a file type'}), 400
     
+    # Reading request.files parses (and spools) the whole body, so check its size first
+    if request.content_length is None:
+        return jsonify({'success': False, 'error': 'Content-Length required'}), 411
+    if request.content_length > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+        return jsonify({'success': False, 'error': f'File too large. Max size: {MAX_FILE_SIZE // (1024*1024)}MB'}), 413
+
     if 'file' not in request.files:
         return jsonify({'success': False, 'error': 'No file provided'}), 400
     
@@ -2533,63 +4471,38 @@ def api_upload_file(lead_id, field_id):
     
     if not allowed_file(file.filename):
         return jsonify({'success': False, 'error': f'File type not allowed. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
-    
-    # Check file size
-    file.seek(0, 2)  # Seek to end
-    file_size = file.tell()
-    file.seek(0)  # Seek back to start
-    if file_size > MAX_FILE_SIZE:
-        return jsonify({'success': False, 'error': f'File too large. Max size: {MAX_FILE_SIZE // (1024*1024)}MB'}), 400
-    
-    # Generate unique filename and save
+
+    # Copy to the blob folder while hashing; the overhead allowance above means the file itself can still be over
+    try:
+        temp_path, sha256, file_size = stream_upload_to_temp(file.stream)
+    except FileTooLarge:
+        return jsonify({'success': False, 'error': f'File too large. Max size: {MAX_FILE_SIZE // (1024*1024)}MB'}), 413
+
     original_filename = secure_filename(file.filename)
-    unique_filename = generate_unique_filename(original_filename)
-    
-    # Create lead-specific folder
-    lead_folder = os.path.join(UPLOAD_FOLDER, str(lead_id))
-    os.makedirs(lead_folder, exist_ok=True)
-    
-    file_path = os.path.join(lead_folder, unique_filename)
-    file.save(file_path)
-    
-    # Store file info as JSON in field_values
-    file_info = json.dumps({
-        'filename': unique_filename,
-        'original_name': original_filename,
-        'size': file_size,
-        'uploaded_at': datetime.now().isoformat(),
-        'path': f'/static/uploads/{lead_id}/{unique_filename}'
-    })
-    
-    # Delete old file if exists
-    existing = query_db(
-        'SELECT value FROM field_values WHERE lead_id = ? AND field_id = ?',
-        [lead_id, field_id], one=True
-    )
-    if existing and existing['value']:
-        try:
-            old_info = json.loads(existing['value'])
-            old_path = os.path.join(UPLOAD_FOLDER, str(lead_id), old_info.get('filename', ''))
-            if os.path.exists(old_path):
-                os.remove(old_path)
-        except:
-            pass
-    
-    # Upsert the value
-    if existing:
-        execute_db(
-            'UPDATE field_values SET value = ? WHERE lead_id = ? AND field_id = ?',
-            [file_info, lead_id, field_id]
-        )
-    else:
-        execute_db(
-            'INSERT INTO field_values (lead_id, field_id, value) VALUES (?, ?, ?)',
-            [lead_id, field_id, file_info]
-        )
-    
+    with db_transaction() as db:
+        # Release the file this one replaces (first, so re-uploading the same content keeps its blob)
+        released = release_file_refs(db, 'lead_id = ? AND field_id = ?', [lead_id, field_id])
+        # Identical content already stored just gains a reference
+        blob_path = store_file_blob(db, temp_path, sha256, file_size, get_file_extension(original_filename))
+        add_file_reference(db, lead_id, field_id, sha256)
+        file_info = {
+            'filename': os.path.basename(blob_path),
+            'original_name': original_filename,
+            'size': file_size,
+            'sha256': sha256,
+            'uploaded_at': datetime.now().isoformat(),
+            'path': url_for('serve_upload', filename=blob_path)
+        }
+        write_field_values(db, [(lead_id, field_id, json.dumps(file_info))])
+    remove_released_blobs(released)
+
+    if THUMBNAILS_ENABLED and is_image_upload(file_info):
+        run_in_background(generate_image_derivatives, sha256, blob_path)
+
     return jsonify({
         'success': True,
-        'file_info': json.loads(file_info),
+        'file_info': file_info,
+        'thumbnail_url': thumbnail_filter(file_info),
         'display_value': original_filename
     })
 
@@ -2598,30 +4511,40 @@ def api_upload_file(lead_id, field_id):
 @login_required
 def api_delete_file(lead_id, field_id):
     """Delete an uploaded file"""
-    # Get existing file info
-    existing = query_db(
-        'SELECT value FROM field_values WHERE lead_id = ? AND field_id = ?',
-        [lead_id, field_id], one=True
-    )
-    
-    if existing and existing['value']:
-        try:
-            file_info = json.loads(existing['value'])
-            file_path = os.path.join(UPLOAD_FOLDER, str(lead_id), file_info.get('filename', ''))
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except:
-            pass
-    
-    # Clear the field value
-    execute_db(
-        'UPDATE field_values SET value = NULL WHERE lead_id = ? AND field_id = ?',
-        [lead_id, field_id]
-    )
-    
+    with db_transaction() as db:
+        existing = db.execute(
+            'SELECT value FROM field_values WHERE lead_id = ? AND field_id = ?', [lead_id, field_id]
+        ).fetchone()
+        # Drop this lead's reference and clear the field value
+        released = release_file_refs(db, 'lead_id = ? AND field_id = ?', [lead_id, field_id])
+        if existing:
+            write_field_values(db, [(lead_id, field_id, None)])
+    remove_released_blobs(released)
+
     return jsonify({'success': True})
 
 
+# Default lead columns that can be edited inline on the leads grid
+INLINE_LEAD_FIELDS = ['email', 'phone', 'address', 'job_type', 'property_type']
+
+def normalize_cell_value(field_type, value):
+    """Inline-edit value from the grid -> stored text (field_type None for default lead columns)"""
+    if value is None or value == []:
+        return ''
+    if field_type == 'checkbox':
+        return '1' if value in [True, 'true', '1', 1] else '0'
+    if field_type == 'multi_select' and isinstance(value, list):
+        return json.dumps(value)
+    return str(value)
+
+def format_cell_display(field_type, value):
+    """Stored value -> the text shown in a grid cell"""
+    if field_type == 'checkbox':
+        return '✓' if value == '1' else '-'
+    if field_type == 'multi_select' and value:
+        return ', '.join(parse_multi_select_options(value)) or '-'
+    return value or '-'
+
 @app.route('/api/leads/<int:lead_id>/update', methods=['POST'])
 @login_required
 def api_update_lead_field(lead_id):
@@ -2635,19 +4558,96 @@ def api_update_lead_field(lead_id):
     value = data.get('value', '')
 
     # Only allow updating specific fields
-    allowed_fields = ['email', 'phone', 'address', 'job_type', 'property_type']
-    if field_name not in allowed_fields:
+    if field_name not in INLINE_LEAD_FIELDS:
         return jsonify({'success': False, 'error': 'Invalid field'}), 400
 
     # Update the lead field
+    value = normalize_cell_value(None, value)
     execute_db(f'UPDATE leads SET {field_name} = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
                [value, lead_id])
 
-    return jsonify({'success': True, 'display_value': value or '-'})
+    return jsonify({'success': True, 'display_value': format_cell_display(None, value)})
+
+@app.route('/api/leads/cells', methods=['PATCH'])
+@login_required
+def api_update_cells():
+    """
+    Batched inline edits: {"edits": [{"lead_id": 1, "field": "email", "value": ...},
+    {"lead_id": 1, "field_id": 7, "value": ...}, ...]}. Valid edits are applied in one
+    transaction; every edit gets a result with its display value or an error.
+    """
+    data = request.get_json() or {}
+    edits = data.get('edits')
+    if not isinstance(edits, list) or not edits:
+        return jsonify({'success': False, 'error': 'edits must be a non-empty list'}), 400
+
+    custom_fields = get_custom_fields_by_id()
+    results = []
+    applied = []        # (result, lead_id) for edits that passed validation
+    lead_updates = {}   # (lead_id, field_name) -> value
+    field_updates = {}  # (lead_id, field_id) -> value
+    for edit in edits:
+        edit = edit if isinstance(edit, dict) else {}
+        result = {key: edit.get(key) for key in ('lead_id', 'field', 'field_id') if key in edit}
+        results.append(result)
+        try:
+            lead_id = int(edit.get('lead_id'))
+        except (TypeError, ValueError):
+            result['error'] = 'Invalid lead_id'
+            continue
+
+        if 'field_id' in edit:
+            try:
+                field = custom_fields.get(int(edit['field_id']))
+            except (TypeError, ValueError):
+                field = None
+            if not field or field['field_type'] == 'file':
+                result['error'] = 'Invalid field'
+                continue
+            value = normalize_cell_value(field['field_type'], edit.get('value'))
+            field_updates[(lead_id, field['id'])] = value
+            result['display_value'] = format_cell_display(field['field_type'], value)
+        elif edit.get('field') in INLINE_LEAD_FIELDS:
+            value = normalize_cell_value(None, edit.get('value'))
+            lead_updates[(lead_id, edit['field'])] = value
+            result['display_value'] = format_cell_display(None, value)
+        else:
+            result['error'] = 'Invalid field'
+            continue
+        applied.append((result, lead_id))
+
+    with db_transaction() as db:
+        lead_ids = list({lead_id for _, lead_id in applied})
+        live_ids = set()
+        for start in range(0, len(lead_ids), 500):
+            chunk = lead_ids[start:start + 500]
+            live_ids.update(row[0] for row in db.execute(
+                f'SELECT id FROM leads WHERE deleted_at IS NULL AND id IN ({",".join("?" * len(chunk))})', chunk
+            ))
+
+        by_column = {}
+        for (lead_id, field_name), value in lead_updates.items():
+            if lead_id in live_ids:
+                by_column.setdefault(field_name, []).append((value, lead_id))
+        for field_name, rows in by_column.items():
+            db.executemany(f'UPDATE leads SET {field_name} = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', rows)
+        write_field_values(db, [
+            (lead_id, field_id, value) for (lead_id, field_id), value in field_updates.items() if lead_id in live_ids
+        ])
+
+    for result, lead_id in applied:
+        if lead_id not in live_ids:
+            del result['display_value']
+            result['error'] = 'Lead not found'
+    for result in results:
+        result['success'] = 'error' not in result
+
+    return jsonify({'success': all(result['success'] for result in results), 'results': results})
 
 # Views Management API Routes
 @app.route('/api/views/save', methods=['POST'])
 @login_required
+@invalidates_cache('schema')
 def api_save_view():
     """Save current field selection as a new view"""
     data = request.get_json()
@@ -2663,19 +4663,20 @@ def api_save_view():
     if existing:
         return jsonify({'success': False, 'error': 'A view with this name already exists'}), 400
 
-    # Insert view with default_fields as JSON
-    import json
-    view_id = execute_db('''
-        INSERT INTO views (name, default_fields, created_by)
-        VALUES (?, ?, ?)
-    ''', [name, json.dumps(default_fields), session.get('user_id')])
-
-    # Insert custom field associations
-    for idx, field_id in enumerate(custom_field_ids):
-        execute_db('''
-            INSERT INTO view_fields (view_id, field_id, sequence)
-            VALUES (?, ?, ?)
-        ''', [view_id, field_id, idx])
+    # Insert view with default_fields as JSON, and its custom field associations
+    try:
+        with db_transaction() as db:
+            view_id = db.execute('''
+                INSERT INTO views (name, default_fields, created_by)
+                VALUES (?, ?, ?)
+            ''', [name, json.dumps(default_fields), session.get('user_id')]).lastrowid
+            custom_field_ids = existing_field_ids(db, custom_field_ids)
+            db.executemany('''
+                INSERT INTO view_fields (view_id, field_id, sequence)
+                VALUES (?, ?, ?)
+            ''', [(view_id, field_id, idx + 1) for idx, field_id in enumerate(custom_field_ids)])
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid field id'}), 400
 
     # Set this view as current for the user
     set_user_current_view(session.get('user_id'), view_id)
@@ -2684,6 +4685,7 @@ def api_save_view():
 
 @app.route('/api/views/<int:id>/update', methods=['POST'])
 @login_required
+@invalidates_cache('schema')
 def api_update_view(id):
     """Update an existing view's field selection"""
     view = get_view_by_id(id)
@@ -2694,30 +4696,37 @@ def api_update_view(id):
     default_fields = data.get('default_fields', [])
     custom_field_ids = data.get('custom_field_ids', [])
 
-    import json
-    # Update view's default_fields
-    execute_db('''
-        UPDATE views SET default_fields = ?
-        WHERE id = ?
-    ''', [json.dumps(default_fields), id])
-
-    # Delete existing custom field associations and re-insert
-    execute_db('DELETE FROM view_fields WHERE view_id = ?', [id])
-
-    for idx, field_id in enumerate(custom_field_ids):
-        execute_db('''
-            INSERT INTO view_fields (view_id, field_id, sequence)
-            VALUES (?, ?, ?)
-        ''', [id, field_id, idx])
+    try:
+        with db_transaction() as db:
+            custom_field_ids = existing_field_ids(db, custom_field_ids)
+            # Update view's default_fields
+            db.execute('''
+                UPDATE views SET default_fields = ?
+                WHERE id = ?
+            ''', [json.dumps(default_fields), id])
+
+            # Drop removed fields, re-rank only moved ones, insert new ones
+            db.execute(
+                f'DELETE FROM view_fields WHERE view_id = ? AND field_id NOT IN ({",".join("?" * len(custom_field_ids))})',
+                [id] + custom_field_ids
+            )
+            new_rows = apply_rank_order(db, 'view_fields', custom_field_ids, 'view_id = ?', [id], id_column='field_id')
+            db.executemany('''
+                INSERT INTO view_fields (view_id, field_id, sequence)
+                VALUES (?, ?, ?)
+            ''', [(id, field_id, rank) for field_id, rank in new_rows.items()])
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid field id'}), 400
 
     return jsonify({'success': True})
 
 @app.route('/api/views/<int:id>/delete', methods=['POST'])
 @login_required
+@invalidates_cache('schema')
 def api_delete_view(id):
     """Delete a view"""
+    # view_fields cascade; user_view_preferences.current_view_id is set NULL
     execute_db('DELETE FROM views WHERE id = ?', [id])
-    execute_db('UPDATE user_view_preferences SET current_view_id = NULL WHERE current_view_id = ?', [id])
     return jsonify({'success': True})
 
 @app.route('/api/fields/order', methods=['POST'])
@@ -2745,15 +4754,7 @@ def api_save_field_order():
         'custom_fields': custom_field_order
     }
 
-    existing = query_db('SELECT id FROM app_settings WHERE key = ?', ['global_field_order'], one=True)
-    if existing:
-        execute_db('''
-            UPDATE app_settings SET value = ? WHERE key = ?
-        ''', [json.dumps(field_config), 'global_field_order'])
-    else:
-        execute_db('''
-            INSERT INTO app_settings (key, value) VALUES (?, ?)
-        ''', ['global_field_order', json.dumps(field_config)])
+    set_setting('global_field_order', json.dumps(field_config))
 
     return jsonify({'success': True})
 
@@ -2883,6 +4884,7 @@ def api_get_statuses():
 
 @app.route('/api/statuses', methods=['POST'])
 @login_required
+@invalidates_cache('schema')
 def api_add_status():
     """Add a new status"""
     data = request.get_json()
@@ -2908,6 +4910,7 @@ def api_add_status():
 
 @app.route('/api/statuses/<int:id>/color', methods=['POST'])
 @login_required
+@invalidates_cache('schema')
 def api_update_status_color(id):
     """Update status colors"""
     data = request.get_json()
@@ -2931,6 +4934,7 @@ def api_update_status_color(id):
 
 @app.route('/api/statuses/<int:id>', methods=['DELETE'])
 @login_required
+@invalidates_cache('schema')
 def api_delete_status(id):
     """Delete a status (soft delete by setting is_active=0)"""
     execute_db('UPDATE statuses SET is_active = 0 WHERE id = ?', [id])
@@ -2938,13 +4942,25 @@ def api_delete_status(id):
 
 @app.route('/api/statuses/reorder', methods=['POST'])
 @login_required
+@invalidates_cache('schema')
 def api_reorder_statuses():
     """Reorder statuses"""
-    data = request.get_json()
-    order = data.get('order', [])
-
-    for idx, status_id in enumerate(order):
-        execute_db('UPDATE statuses SET sequence = ? WHERE id = ?', [idx, status_id])
+    data = request.get_json(silent=True) or {}
+    order = data.get('order')
+    if not isinstance(order, list):
+        return jsonify({'success': False, 'error': 'order must be a list of status IDs'}), 400
+    try:
+        order = list(dict.fromkeys(int(status_id) for status_id in order))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'order must be a list of status IDs'}), 400
+
+    # Only statuses that actually moved are rewritten
+    with db_transaction() as db:
+        existing = {row[0] for row in db.execute('SELECT id FROM statuses')}
+        unknown = [status_id for status_id in order if status_id not in existing]
+        if unknown:
+            return jsonify({'success': False, 'error': f'Unknown status IDs: {unknown}'}), 400
+        apply_rank_order(db, 'statuses', order)
 
     return jsonify({'success': True})
 
@@ -2958,6 +4974,7 @@ def api_get_job_types():
 
 @app.route('/api/job-types/<int:id>/color', methods=['POST'])
 @login_required
+@invalidates_cache('schema')
 def api_update_job_type_color(id):
     """Update job type color"""
     data = request.get_json()
@@ -2976,6 +4993,7 @@ def api_get_property_types():
 
 @app.route('/api/property-types/<int:id>/color', methods=['POST'])
 @login_required
+@invalidates_cache('schema')
 def api_update_property_type_color(id):
     """Update property type color"""
     data = request.get_json()
@@ -2987,6 +5005,7 @@ def api_update_property_type_color(id):
 # Custom Field Option Colors API
 @app.route('/api/fields/<int:id>/option-colors', methods=['POST'])
 @login_required
+@invalidates_cache('schema')
 def api_update_field_option_colors(id):
     """Update custom field option colors"""
     data = request.get_json()
@@ -3002,6 +5021,25 @@ def api_get_activities(lead_id):
     activities = get_lead_activities(lead_id)
     return jsonify(activities)
 
+@app.route('/api/leads/<int:lead_id>/timeline', methods=['GET'])
+@login_required
+def api_get_timeline(lead_id):
+    """Cursor-paginated activities: ?before=<next_cursor>&limit=N&metadata=1"""
+    before = None
+    if request.args.get('before'):
+        before = decode_activity_cursor(request.args['before'])
+        if not before:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    limit = min(max(request.args.get('limit', ACTIVITY_PAGE_SIZE, type=int), 1), 200)
+
+    with_metadata = request.args.get('metadata') == '1'
+    activities, next_cursor = get_activity_page(lead_id, before, limit, parse_metadata=with_metadata)
+    for a in activities:
+        if not with_metadata:
+            a['has_metadata'] = bool(a.pop('metadata'))
+        a['created_at_display'] = strftime_filter(a['created_at'], '%b %d, %Y at %I:%M %p')
+    return jsonify({'activities': activities, 'next_cursor': next_cursor})
+
 @app.route('/api/leads/<int:lead_id>/activities', methods=['POST'])
 @login_required
 def api_add_activity(lead_id):
@@ -3027,7 +5065,9 @@ def api_add_activity(lead_id):
 @login_required
 def api_delete_activity(lead_id, activity_id):
     """Delete an activity"""
-    execute_db('DELETE FROM activities WHERE id = ? AND lead_id = ?', [activity_id, lead_id])
+    with db_transaction() as db:
+        db.execute('DELETE FROM activities WHERE id = ? AND lead_id = ?', [activity_id, lead_id])
+        db.execute('DELETE FROM activities_archive WHERE id = ? AND lead_id = ?', [activity_id, lead_id])
     return jsonify({'success': True})
 
 # Handoff API
@@ -3107,39 +5147,135 @@ def fromjson_filter(value):
         return {}
 
 
+@app.template_filter('thumbnail')
+def thumbnail_filter(value, size='thumb'):
+    """Stored file value (or file_info dict) -> URL of its image derivative, '' if it has none"""
+    file_info = fromjson_filter(value) if isinstance(value, str) else (value or {})
+    if not THUMBNAILS_ENABLED or not isinstance(file_info, dict) or not is_image_upload(file_info):
+        return ''
+    return url_for('serve_upload', filename=derivative_relative_path(file_info['sha256'], size))
+
+
+@app.template_filter('multiselect')
+def multiselect_filter(value):
+    """Stored multi_select value -> 'Option A, Option B'"""
+    return ', '.join(parse_multi_select_options(value))
+
+
+# Backups run on a background thread in this process; backup.create_backup copies the
+# database in page steps with pauses between them. One backup at a time: the lock covers
+# this worker, and the backup_running_since setting covers the others.
+BACKUP_STALE_MINUTES = 60
+_backup_lock = threading.Lock()
+_backup_progress = {'state': 'idle'}
+
+def backup_claim_is_live(running_since):
+    """
+    True if a backup_running_since value belongs to a backup that may still be running.
+    Older claims were left by a worker that died mid-backup and never cleared them.
+    """
+    if not running_since:
+        return False
+    try:
+        return datetime.now() - datetime.fromisoformat(running_since) < timedelta(minutes=BACKUP_STALE_MINUTES)
+    except ValueError:
+        return False
+
+def claim_backup():
+    """Mark a backup as running unless another worker already has one going -> True if claimed"""
+    with db_transaction() as db:
+        running = db.execute("SELECT value FROM app_settings WHERE key = 'backup_running_since'").fetchone()
+        if running and backup_claim_is_live(running[0]):
+            return False
+        set_setting('backup_running_since', datetime.now().isoformat(), db=db)
+    return True
+
+def run_backup():
+    """Background entry point: copy the database, recording progress in _backup_progress"""
+    def report(remaining, total):
+        _backup_progress.update(pages_done=total - remaining, pages_total=total)
+
+    backup_path = None
+    try:
+        backup_path = create_backup(DATABASE, progress=report)
+    finally:
+        finished_at = datetime.now().isoformat()
+        _backup_progress.update(state='done' if backup_path else 'failed', finished_at=finished_at,
+                                file=os.path.basename(backup_path) if backup_path else None)
+        try:
+            # The outcome is kept in settings too: the settings page may be polling another worker
+            updates = {'backup_running_since': None, 'backup_last_state': _backup_progress['state'],
+                       'backup_last_finished_at': finished_at}
+            if backup_path:
+                updates['last_backup'] = finished_at
+            set_settings(updates)
+        finally:
+            _backup_lock.release()
+
+def start_backup():
+    """Start a background backup unless one is already running -> True if this call started it"""
+    if not _backup_lock.acquire(blocking=False):
+        return False
+    try:
+        claimed = claim_backup()
+    except Exception:
+        _backup_lock.release()
+        raise
+    if not claimed:
+        _backup_lock.release()
+        return False
+
+    _backup_progress.clear()
+    _backup_progress.update(state='running', started_at=datetime.now().isoformat(), pages_done=0, pages_total=None)
+    run_in_background(run_backup)
+    return True
+
+def get_backup_progress():
+    """{'state': 'idle' | 'running' | 'done' | 'failed', ...} for the settings page"""
+    progress = dict(_backup_progress)
+    if progress['state'] != 'running':
+        # Possibly running (or run) in another worker, which is the one with the page counts
+        shared = get_settings('backup_running_since', 'backup_last_state', 'backup_last_finished_at')
+        if backup_claim_is_live(shared['backup_running_since']):
+            progress = {'state': 'running', 'started_at': shared['backup_running_since'],
+                        'pages_done': 0, 'pages_total': None}
+        elif shared['backup_running_since']:
+            # The worker running it died; the next backup reclaims the stale claim
+            progress = {'state': 'failed', 'started_at': shared['backup_running_since'],
+                        'error': 'The backup was interrupted'}
+        elif shared['backup_last_state']:
+            progress = {'state': shared['backup_last_state'], 'finished_at': shared['backup_last_finished_at']}
+    if progress.get('pages_total'):
+        progress['percent'] = round(100 * progress['pages_done'] / progress['pages_total'])
+    return progress
+
 # Backup routes
 @app.route('/settings/backup', methods=['POST'])
 @login_required
 def manual_backup():
-    """Trigger a manual database backup"""
-    import subprocess
-
-    backup_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup.py')
-
+    """Trigger a manual database backup (runs in the background)"""
     try:
-        # Run backup script
-        result = subprocess.run(
-            ['python', backup_script],
-            capture_output=True,
-            text=True,
-            cwd=os.path.dirname(backup_script)
-        )
-
-        if result.returncode == 0:
-            # Store last backup time
-            execute_db(
-                '''INSERT OR REPLACE INTO app_settings (key, value)
-                   VALUES ('last_backup', ?)''',
-                [datetime.now().isoformat()]
-            )
-            flash('Backup created successfully', 'success')
-        else:
-            flash(f'Backup failed: {result.stderr}', 'error')
+        started = start_backup()
     except Exception as e:
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return jsonify({'success': False, 'error': str(e)}), 500
         flash(f'Backup failed: {str(e)}', 'error')
+        return redirect(url_for('settings'))
 
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return jsonify({'success': True, 'started': started, 'progress': get_backup_progress()})
+    if started:
+        flash('Backup started', 'success')
+    else:
+        flash('A backup is already running', 'success')
     return redirect(url_for('settings'))
 
+@app.route('/settings/backup/progress')
+@login_required
+def backup_progress():
+    """Progress of the current (or last) backup, polled by the settings page"""
+    return jsonify(get_backup_progress())
+
 @app.route('/settings/backup-email', methods=['POST'])
 @login_required
 def save_backup_email():
@@ -3147,11 +5283,7 @@ def save_backup_email():
     backup_email = request.form.get('backup_email', '').strip()
 
     # Store in app_settings
-    existing = query_db('SELECT id FROM app_settings WHERE key = ?', ['backup_email'], one=True)
-    if existing:
-        execute_db('UPDATE app_settings SET value = ? WHERE key = ?', [backup_email, 'backup_email'])
-    else:
-        execute_db('INSERT INTO app_settings (key, value) VALUES (?, ?)', ['backup_email', backup_email])
+    set_setting('backup_email', backup_email)
 
     if backup_email:
         flash('Backup email saved', 'success')
@@ -3159,6 +5291,53 @@ def save_backup_email():
         flash('Backup email cleared', 'success')
     return redirect(url_for('settings'))
 
+@app.route('/settings/activity-archive', methods=['POST'])
+@login_required
+def save_activity_archive():
+    """Save activity archival ages and run the archive job"""
+    try:
+        archive_days = max(int(request.form.get('archive_days', ACTIVITY_ARCHIVE_DAYS)), 7)
+        archive_closed_days = max(int(request.form.get('archive_closed_days', ACTIVITY_ARCHIVE_CLOSED_DAYS)), 7)
+    except ValueError:
+        flash('Archive ages must be whole numbers of days', 'error')
+        return redirect(url_for('settings'))
+
+    set_settings({'activity_archive_days': str(archive_days),
+                  'activity_archive_closed_days': str(archive_closed_days)})
+    run_in_background(archive_activities)
+    flash('Activity archive settings saved; archiving is running in the background', 'success')
+    return redirect(url_for('settings'))
+
+@app.route('/settings/trash-retention', methods=['POST'])
+@login_required
+def save_trash_retention():
+    """Save how many days deleted leads stay in the trash (0 = keep forever)"""
+    try:
+        days = max(int(request.form.get('trash_retention_days', TRASH_RETENTION_DAYS)), 0)
+    except ValueError:
+        flash('Retention must be a whole number of days', 'error')
+        return redirect(url_for('settings'))
+
+    set_setting('trash_retention_days', str(days))
+    flash('Trash retention saved', 'success')
+    return redirect(url_for('settings'))
+
+@app.route('/settings/upload-gc', methods=['POST'])
+@login_required
+def start_upload_gc():
+    """Scan for orphaned uploads in the background (dry run, quarantine or delete)"""
+    mode = request.form.get('mode', 'dry_run')
+    if mode not in UPLOAD_GC_MODES:
+        flash('Unknown cleanup mode', 'error')
+        return redirect(url_for('settings'))
+    if _upload_gc_lock.locked():
+        flash('Upload cleanup is already running', 'error')
+        return redirect(url_for('settings'))
+
+    run_in_background(run_upload_gc, mode)
+    flash('Upload cleanup started; refresh in a moment for the report', 'success')
+    return redirect(url_for('settings'))
+
 @app.route('/settings/backup-download')
 @login_required
 def download_backup():
@@ -3229,6 +5408,10 @@ CUSTOMER_CSV_MAPPINGS = {
     'Site Address': 'address',
 }
 
+# CSV import streaming: rows processed per chunk, bytes read for previews
+IMPORT_CHUNK_ROWS = 500
+PREVIEW_HEAD_BYTES = 256 * 1024
+
 # Default fields available for mapping
 DEFAULT_LEAD_FIELDS = [
     {'key': 'name', 'label': 'Name', 'required': True},
@@ -3241,49 +5424,497 @@ DEFAULT_LEAD_FIELDS = [
     {'key': 'notes', 'label': 'Notes'},
 ]
 
-def auto_detect_mapping(csv_column, custom_fields):
-    """Smart auto-detection of column mappings"""
-    col_lower = csv_column.lower().strip()
-    col_normalized = col_lower.replace('_', ' ').replace('-', ' ')
-    
-    # Check exact matches in default mappings first
-    if csv_column in CUSTOMER_CSV_MAPPINGS:
-        return CUSTOMER_CSV_MAPPINGS[csv_column]
-    
-    # Check case-insensitive matches
+# Keywords for fuzzy matching CSV headers to default lead fields (in priority order)
+DEFAULT_FIELD_KEYWORDS = {
+    'name': ['name', 'customer', 'client', 'contact', 'full name', 'customer name', 'client name'],
+    'email': ['email', 'e-mail', 'mail', 'email address'],
+    'phone': ['phone', 'telephone', 'tel', 'mobile', 'cell', 'phone number'],
+    'address': ['address', 'location', 'site', 'project address', 'street'],
+    'job_type': ['job type', 'type', 'service', 'work type', 'project type'],
+    'property_type': ['property type', 'property', 'building type'],
+    'status': ['status', 'stage', 'state', 'lead status', 'customer stage'],
+    'notes': ['notes', 'note', 'comments', 'description', 'details', 'job scope', 'scope'],
+}
+
+# Confidence scores for the different kinds of header match
+MATCH_CONFIDENCE = {
+    'exact_mapping': 1.0,      # header is a known export column, as written
+    'mapping': 0.95,           # known export column, ignoring case/punctuation
+    'custom_exact': 0.9,       # header equals a custom field name or key
+    'keyword_exact': 0.85,     # header equals a default-field keyword
+    'partial': 0.5,            # token overlap; scaled up to 0.8 by coverage
+}
+
+def normalize_header(text):
+    """Lowercase a header and collapse _, - and whitespace into single spaces"""
+    return ' '.join(str(text).lower().replace('_', ' ').replace('-', ' ').split())
+
+_column_matcher_cache = {}
+
+def get_column_matcher(custom_fields):
+    """
+    Compiled lookup tables for CSV header auto-detection, built once per custom-field schema.
+    Header results are memoized on the matcher, so repeated previews/imports are dict lookups.
+    """
+    schema_key = tuple((cf['id'], cf['name'], cf['field_key']) for cf in custom_fields)
+    matcher = _column_matcher_cache.get(schema_key)
+    if matcher is not None:
+        return matcher
+
+    phrases = {}        # normalized phrase -> [(field, kind)]
+    token_index = {}    # token -> [(field, phrase_tokens)]
+    field_order = {}    # field -> priority (ties go to the earlier field, like the original scan)
+
+    def add_phrase(phrase, field, kind):
+        norm = normalize_header(phrase)
+        if not norm:
+            return
+        phrases.setdefault(norm, []).append((field, kind))
+        if kind in ('keyword_exact', 'custom_exact'):
+            tokens = frozenset(norm.split())
+            for token in tokens:
+                token_index.setdefault(token, []).append((field, tokens))
+        field_order.setdefault(field, len(field_order))
+
     for csv_col, field in CUSTOMER_CSV_MAPPINGS.items():
-        if csv_col.lower() == col_lower:
-            return field
-    
-    # Fuzzy matching for default fields
-    default_matches = {
-        'name': ['name', 'customer', 'client', 'contact', 'full name', 'customer name', 'client name'],
-        'email': ['email', 'e-mail', 'mail', 'email address'],
-        'phone': ['phone', 'telephone', 'tel', 'mobile', 'cell', 'phone number'],
-        'address': ['address', 'location', 'site', 'project address', 'street'],
-        'job_type': ['job type', 'type', 'service', 'work type', 'project type'],
-        'property_type': ['property type', 'property', 'building type'],
-        'status': ['status', 'stage', 'state', 'lead status', 'customer stage'],
-        'notes': ['notes', 'note', 'comments', 'description', 'details', 'job scope', 'scope'],
-    }
-    
-    for field, keywords in default_matches.items():
+        add_phrase(csv_col, field, 'mapping')
+    for field, keywords in DEFAULT_FIELD_KEYWORDS.items():
         for keyword in keywords:
-            if keyword in col_normalized or col_normalized in keyword:
-                return field
-    
-    # Check custom fields
+            add_phrase(keyword, field, 'keyword_exact')
     for cf in custom_fields:
-        cf_name_lower = cf['name'].lower()
-        cf_key_lower = cf['field_key'].lower()
-        # Exact or close match
-        if col_lower == cf_name_lower or col_lower == cf_key_lower:
-            return f"custom_{cf['id']}"
-        # Partial match
-        if cf_name_lower in col_normalized or col_normalized in cf_name_lower:
-            return f"custom_{cf['id']}"
-    
-    return 'skip'
+        add_phrase(cf['name'], f"custom_{cf['id']}", 'custom_exact')
+        add_phrase(cf['field_key'], f"custom_{cf['id']}", 'custom_exact')
+
+    matcher = {'phrases': phrases, 'token_index': token_index, 'field_order': field_order, 'results': {}}
+    if len(_column_matcher_cache) >= 8:
+        _column_matcher_cache.clear()
+    _column_matcher_cache[schema_key] = matcher
+    return matcher
+
+def detect_column_mapping(csv_column, custom_fields):
+    """
+    Detect the CRM field for a CSV header.
+    Returns {'field', 'confidence', 'ambiguous', 'alternatives'}; field is 'skip' when nothing matches.
+    """
+    matcher = get_column_matcher(custom_fields)
+    cached = matcher['results'].get(csv_column)
+    if cached is not None:
+        return cached
+
+    scores = {}
+    def consider(field, confidence):
+        if confidence > scores.get(field, 0):
+            scores[field] = confidence
+
+    # Check exact matches in default mappings first
+    if csv_column in CUSTOMER_CSV_MAPPINGS:
+        consider(CUSTOMER_CSV_MAPPINGS[csv_column], MATCH_CONFIDENCE['exact_mapping'])
+
+    # Normalized phrase lookups (export columns, keywords, custom field names/keys)
+    norm = normalize_header(csv_column)
+    for field, kind in matcher['phrases'].get(norm, []):
+        consider(field, MATCH_CONFIDENCE[kind])
+
+    # Token overlap with keywords and custom field names, scored by coverage of the header
+    header_tokens = frozenset(norm.split())
+    if header_tokens:
+        for token in header_tokens:
+            for field, phrase_tokens in matcher['token_index'].get(token, []):
+                if phrase_tokens <= header_tokens or header_tokens <= phrase_tokens:
+                    coverage = len(phrase_tokens & header_tokens) / max(len(header_tokens), len(phrase_tokens))
+                    consider(field, round(MATCH_CONFIDENCE['partial'] + 0.3 * coverage, 2))
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], matcher['field_order'].get(item[0], 0)))
+    if ranked:
+        best_field, best_confidence = ranked[0]
+        result = {
+            'field': best_field,
+            'confidence': best_confidence,
+            'ambiguous': len(ranked) > 1 and ranked[1][1] >= best_confidence,
+            'alternatives': [{'field': f, 'confidence': c} for f, c in ranked[1:4]]
+        }
+    else:
+        result = {'field': 'skip', 'confidence': 0, 'ambiguous': False, 'alternatives': []}
+
+    matcher['results'][csv_column] = result
+    return result
+
+def auto_detect_mapping(csv_column, custom_fields):
+    """Smart auto-detection of column mappings"""
+    return detect_column_mapping(csv_column, custom_fields)['field']
+
+
+def open_csv_reader(binary_stream):
+    """Wrap an uploaded binary stream in an incremental text reader (never decodes the whole file)"""
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    return csv.DictReader(text_stream)
+
+def iter_csv_chunks(reader, chunk_size=None, start_row=2):
+    """Yield (first_row_number, rows) in bounded chunks; row numbers match the spreadsheet (header is row 1)"""
+    chunk_size = chunk_size or IMPORT_CHUNK_ROWS
+    row_num = start_row
+    while True:
+        chunk = list(itertools.islice(reader, chunk_size))
+        if not chunk:
+            return
+        yield row_num, chunk
+        row_num += len(chunk)
+
+def read_csv_head(binary_stream):
+    """
+    Parse only the first PREVIEW_HEAD_BYTES of a CSV upload.
+    Returns (fieldnames, head_rows, total_rows, estimated); total_rows is estimated
+    from the average row size when the file is larger than the head.
+    """
+    # Total size without reading the body
+    binary_stream.seek(0, os.SEEK_END)
+    total_bytes = binary_stream.tell()
+    binary_stream.seek(0)
+
+    head = binary_stream.read(PREVIEW_HEAD_BYTES)
+    binary_stream.seek(0)
+    truncated = len(head) < total_bytes
+    if truncated:
+        # Drop the trailing partial line
+        head = head[:head.rfind(b'\n') + 1]
+    head_text = head.decode('utf-8-sig', errors='replace')
+
+    reader = csv.DictReader(io.StringIO(head_text, newline=''))
+    head_rows = list(reader)
+
+    # Estimate the row count from the average row size in the head
+    total_rows = len(head_rows)
+    if truncated and head_rows:
+        header_bytes = len(head_text.split('\n', 1)[0].encode('utf-8')) + 1
+        bytes_per_row = max((len(head) - header_bytes) / len(head_rows), 1)
+        total_rows = int((total_bytes - header_bytes) / bytes_per_row)
+
+    return reader.fieldnames, head_rows, total_rows, truncated
+
+def resolve_import_mappings(fieldnames, form, custom_fields):
+    """Split the submitted column mappings into default-field and custom-field mappings"""
+    mappings = {}
+    custom_mappings = {}  # Separate dict for custom fields
+
+    for csv_col in fieldnames:
+        mapped_field = form.get(f'mapping_{csv_col}')
+        if mapped_field and mapped_field != 'skip':
+            if mapped_field.startswith('custom_'):
+                custom_mappings[csv_col] = mapped_field
+            else:
+                mappings[csv_col] = mapped_field
+
+    # If no mappings provided, use auto-detection
+    if not mappings and not custom_mappings:
+        for csv_col in fieldnames:
+            detected = auto_detect_mapping(csv_col, custom_fields)
+            if detected != 'skip':
+                if detected.startswith('custom_'):
+                    custom_mappings[csv_col] = detected
+                else:
+                    mappings[csv_col] = detected
+
+    return mappings, custom_mappings
+
+def normalize_dedupe_key(value):
+    """Normalize an email or name for duplicate detection"""
+    return ' '.join(str(value).split()).lower() if value else ''
+
+def load_lead_dedupe_index():
+    """
+    Load normalized email -> lead and name -> lead maps for every active lead in one query.
+    Values are lead IDs, or pending-insert entries for rows imported earlier in the same file.
+    """
+    index = {'email': {}, 'name': {}}
+    for row in query_db('SELECT id, email, name FROM leads WHERE deleted_at IS NULL ORDER BY id'):
+        email = normalize_dedupe_key(row['email'])
+        if email:
+            index['email'].setdefault(email, row['id'])
+        name = normalize_dedupe_key(row['name'])
+        if name:
+            index['name'].setdefault(name, row['id'])
+    return index
+
+# Core lead columns that CSV rows may set, in the order used by the bulk UPDATE below
+IMPORT_LEAD_FIELDS = ['name', 'email', 'phone', 'address', 'job_type', 'property_type', 'status', 'notes']
+
+def import_lead_rows(rows, first_row_num, mappings, custom_mappings, duplicate_action, user_id, stats, dedupe_index,
+                     on_commit=None):
+    """
+    Import one chunk of CSV rows set-wise, accumulating counts and errors into stats.
+    Rows are classified against the in-memory dedupe index (which also covers rows earlier
+    in the same file), then applied with executemany in a single transaction.
+    on_commit(db, chunk_stats, chunk_errors) runs inside that transaction (used for job progress).
+    Returns False if the chunk was rolled back.
+    """
+    custom_columns = [(csv_col, int(ref.replace('custom_', ''))) for csv_col, ref in custom_mappings.items()]
+    chunk_stats = {'imported': 0, 'skipped': 0, 'updated': 0}
+    chunk_errors = []
+    inserts = []   # pending-insert entries: {'lead': {...}, 'custom': {...}, 'id': None, 'keys': [...]}
+    updates = {}   # existing lead id -> {'lead': {...}, 'custom': {...}}
+
+    # Classification pass - no database access
+    for row_num, row in enumerate(rows, start=first_row_num):
+        try:
+            # Build lead data from default mappings
+            lead_data = {}
+            for csv_col, db_field in mappings.items():
+                if csv_col in row:
+                    lead_data[db_field] = row[csv_col].strip() if row[csv_col] else ''
+
+            # Build custom field data
+            custom_data = {}
+            for csv_col, field_id in custom_columns:
+                if csv_col in row and row[csv_col] and row[csv_col].strip():
+                    custom_data[field_id] = row[csv_col].strip()
+
+            # Require at least a name
+            if not lead_data.get('name'):
+                chunk_stats['skipped'] += 1
+                continue
+
+            # Check for duplicates by email, then name
+            email_key = normalize_dedupe_key(lead_data.get('email'))
+            name_key = normalize_dedupe_key(lead_data.get('name'))
+            existing = dedupe_index['email'].get(email_key) if email_key else None
+            if existing is None:
+                existing = dedupe_index['name'].get(name_key)
+            if isinstance(existing, dict) and existing['id'] is not None:
+                # Inserted by an earlier chunk of this file
+                existing = existing['id']
+
+            if existing is not None and duplicate_action in ('skip', 'update'):
+                if duplicate_action == 'skip':
+                    chunk_stats['skipped'] += 1
+                    continue
+
+                # Update existing record, or fold the row into a lead pending insert in this chunk
+                target = existing if isinstance(existing, dict) else updates.setdefault(existing, {'lead': {}, 'custom': {}})
+                target['lead'].update({k: v for k, v in lead_data.items() if v and k in IMPORT_LEAD_FIELDS})
+                target['custom'].update(custom_data)
+                chunk_stats['updated'] += 1
+                continue
+
+            # Insert new lead
+            entry = {'lead': lead_data, 'custom': custom_data, 'id': None, 'keys': []}
+            inserts.append(entry)
+            for kind, key in (('email', email_key), ('name', name_key)):
+                if key and key not in dedupe_index[kind]:
+                    dedupe_index[kind][key] = entry
+                    entry['keys'].append((kind, key))
+            chunk_stats['imported'] += 1
+
+        except Exception as e:
+            chunk_errors.append(f"Row {row_num}: {str(e)}")
+            continue
+
+    # Apply the whole chunk in one transaction
+    try:
+        with db_transaction() as db:
+            lead_ids = insert_leads_bulk(db, [
+                (
+                    entry['lead'].get('name', ''),
+                    entry['lead'].get('email', ''),
+                    entry['lead'].get('phone', ''),
+                    entry['lead'].get('address', ''),
+                    entry['lead'].get('job_type', ''),
+                    entry['lead'].get('property_type', ''),
+                    entry['lead'].get('status') or 'New Lead',
+                    entry['lead'].get('notes', ''),
+                    user_id
+                )
+                for entry in inserts
+            ])
+            for entry, lead_id in zip(inserts, lead_ids):
+                entry['id'] = lead_id
+
+            if updates:
+                # Empty values keep the current column value
+                db.executemany(
+                    f'''UPDATE leads SET {", ".join(f"{f} = COALESCE(NULLIF(?, ''), {f})" for f in IMPORT_LEAD_FIELDS)},
+                        updated_at = CURRENT_TIMESTAMP WHERE id = ?''',
+                    [
+                        [update['lead'].get(f, '') for f in IMPORT_LEAD_FIELDS] + [lead_id]
+                        for lead_id, update in updates.items()
+                    ]
+                )
+
+            value_rows = [
+                (entry['id'], field_id, value)
+                for entry in inserts for field_id, value in entry['custom'].items()
+            ] + [
+                (lead_id, field_id, value)
+                for lead_id, update in updates.items() for field_id, value in update['custom'].items()
+            ]
+            write_field_values(db, value_rows)
+
+            # Log activity
+            db.executemany(
+                'INSERT INTO activities (lead_id, user_id, content, activity_type) VALUES (?, ?, ?, ?)',
+                [(lead_id, user_id, 'Lead imported from CSV', 'created') for lead_id in lead_ids]
+            )
+
+            if on_commit:
+                on_commit(db, chunk_stats, chunk_errors)
+    except ImportJobTakenOver:
+        raise
+    except Exception as e:
+        # Forget the rolled-back inserts so later chunks don't match against them
+        for entry in inserts:
+            for kind, key in entry['keys']:
+                if dedupe_index[kind].get(key) is entry:
+                    del dedupe_index[kind][key]
+        stats['errors'].extend(chunk_errors)
+        stats['errors'].append(f"Rows {first_row_num}-{first_row_num + len(rows) - 1}: {str(e)}")
+        return False
+
+    for key, count in chunk_stats.items():
+        stats[key] += count
+    stats['errors'].extend(chunk_errors)
+    return True
+
+
+# Background import jobs
+IMPORT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'imports')
+IMPORT_ERROR_SAMPLE = 20          # errors kept on the job record
+IMPORT_JOB_STALE_SECONDS = 120    # a running job with no progress this long can be resumed
+IMPORT_CHUNK_ATTEMPTS = 3         # a rolled-back chunk (e.g. database locked) is retried this often
+IMPORT_CHUNK_RETRY_DELAY = 2      # seconds, multiplied by the attempt number
+
+class ImportJobTakenOver(Exception):
+    """The job was claimed by another run (e.g. resumed on another worker while this one stalled)"""
+
+def claim_import_job(job_id):
+    """
+    Atomically mark a queued, failed or stalled job as running under a new run token.
+    Returns the token, or None if the job is running elsewhere (or finished).
+    """
+    token = os.urandom(8).hex()
+    with db_transaction() as db:
+        claimed = db.execute('''
+            UPDATE import_jobs SET status = 'running', run_token = ?, resumed_from_row = rows_processed,
+                started_at = strftime('%Y-%m-%d %H:%M:%f', 'now'), updated_at = CURRENT_TIMESTAMP, finished_at = NULL
+            WHERE id = ? AND (status IN ('queued', 'failed')
+                OR (status = 'running' AND (updated_at IS NULL OR updated_at < datetime('now', ?))))
+        ''', [token, job_id, f'-{IMPORT_JOB_STALE_SECONDS} seconds']).rowcount
+    return token if claimed == 1 else None
+
+def check_import_job_owner(db, job_id, run_token):
+    if not db.execute('SELECT 1 FROM import_jobs WHERE id = ? AND run_token = ?', [job_id, run_token]).fetchone():
+        raise ImportJobTakenOver()
+
+def run_import_job(job_id, run_token):
+    """
+    Run (or resume) a background CSV import job claimed with claim_import_job().
+    Progress is written in the same transaction as each chunk, so a restart resumes
+    from the last committed chunk. A chunk only commits while this run still owns the job.
+    A chunk that keeps rolling back fails the job at that chunk, so resuming retries it.
+    """
+    try:
+        job = query_db('SELECT * FROM import_jobs WHERE id = ?', [job_id], one=True)
+        if not job or job['run_token'] != run_token:
+            return
+
+        config = json.loads(job['mappings'] or '{}')
+        errors_sample = json.loads(job['errors'] or '[]')
+        stats = {'imported': 0, 'skipped': 0, 'updated': 0, 'errors': []}
+        dedupe_index = load_lead_dedupe_index()
+
+        def record_progress(db, row_count, chunk_stats, chunk_errors):
+            check_import_job_owner(db, job_id, run_token)
+            errors_sample.extend(chunk_errors[:IMPORT_ERROR_SAMPLE - len(errors_sample)])
+            db.execute('''
+                UPDATE import_jobs SET rows_processed = rows_processed + ?, imported = imported + ?,
+                    updated = updated + ?, skipped = skipped + ?, error_count = error_count + ?,
+                    errors = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', [row_count, chunk_stats['imported'], chunk_stats['updated'], chunk_stats['skipped'],
+                  len(chunk_errors), json.dumps(errors_sample), job_id])
+
+        with open(job['file_path'], 'rb') as f:
+            reader = open_csv_reader(f)
+            # Skip rows committed by an earlier run
+            skip = job['rows_processed']
+            for _ in itertools.islice(reader, skip):
+                pass
+
+            for first_row_num, rows in iter_csv_chunks(reader, start_row=skip + 2):
+                for attempt in range(1, IMPORT_CHUNK_ATTEMPTS + 1):
+                    check_import_job_owner(get_db(), job_id, run_token)
+                    stats['errors'] = []
+                    committed = import_lead_rows(
+                        rows, first_row_num, config.get('mappings', {}), config.get('custom_mappings', {}),
+                        job['duplicate_action'], job['created_by'], stats, dedupe_index,
+                        on_commit=lambda db, chunk_stats, chunk_errors: record_progress(db, len(rows), chunk_stats, chunk_errors)
+                    )
+                    if committed:
+                        break
+                    # Rolled back - rows_processed still points at this chunk
+                    print(f"[Import Job {job_id}] {stats['errors'][-1]} (attempt {attempt})")
+                    if attempt < IMPORT_CHUNK_ATTEMPTS:
+                        time.sleep(IMPORT_CHUNK_RETRY_DELAY * attempt)
+                else:
+                    raise RuntimeError(stats['errors'][-1])
+                stats['errors'] = []
+
+        with db_transaction() as db:
+            completed = db.execute('''
+                UPDATE import_jobs SET status = 'completed', finished_at = strftime('%Y-%m-%d %H:%M:%f', 'now'),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND run_token = ?
+            ''', [job_id, run_token]).rowcount
+        if completed:
+            try:
+                os.remove(job['file_path'])
+            except OSError:
+                pass
+    except ImportJobTakenOver:
+        print(f"[Import Job {job_id}] Claimed by another run; stopping")
+    except Exception as e:
+        print(f"[Import Job {job_id}] Failed: {e}")
+        job = query_db('SELECT errors FROM import_jobs WHERE id = ?', [job_id], one=True)
+        errors = json.loads(job['errors'] or '[]') if job else []
+        execute_db(
+            "UPDATE import_jobs SET status = 'failed', errors = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND run_token = ?",
+            [json.dumps(errors + [f'Import stopped: {e}']), job_id, run_token]
+        )
+
+def import_job_to_dict(job):
+    """Progress summary for an import job, including throughput"""
+    elapsed = job['elapsed_seconds'] or 0
+    rows_this_run = job['rows_processed'] - (job['resumed_from_row'] or 0)
+    rate = rows_this_run / elapsed if elapsed > 0 else 0
+    total = job['rows_processed'] if job['status'] == 'completed' else max(job['total_rows_estimate'] or 0, job['rows_processed'])
+    remaining = total - job['rows_processed']
+    stalled = job['status'] == 'running' and (job['idle_seconds'] or 0) > IMPORT_JOB_STALE_SECONDS
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'filename': job['filename'],
+        'rows_processed': job['rows_processed'],
+        'total_rows_estimate': total,
+        'percent': 100.0 if job['status'] == 'completed' else (round(job['rows_processed'] / total * 100, 1) if total else 0),
+        'rows_per_second': round(rate, 1),
+        'eta_seconds': int(remaining / rate) if rate > 0 and remaining > 0 else None,
+        'imported': job['imported'],
+        'updated': job['updated'],
+        'skipped': job['skipped'],
+        'error_count': job['error_count'],
+        'errors': json.loads(job['errors'] or '[]'),
+        'stalled': stalled,
+        'can_resume': job['status'] == 'failed' or stalled,
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at']
+    }
+
+def get_import_job(job_id):
+    """Fetch an import job with elapsed/idle times computed by SQLite"""
+    return query_db('''
+        SELECT *,
+               (julianday(COALESCE(finished_at, 'now')) - julianday(started_at)) * 86400 AS elapsed_seconds,
+               (julianday('now') - julianday(updated_at)) * 86400 AS idle_seconds
+        FROM import_jobs WHERE id = ?
+    ''', [job_id], one=True)
 
 
 @app.route('/leads/import', methods=['GET', 'POST'])
@@ -3293,6 +5924,7 @@ def import_leads():
     custom_fields = get_custom_fields()
     
     if request.method == 'POST':
+        is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
         if 'csv_file' not in request.files:
             flash('No file uploaded', 'error')
             return redirect(request.url)
@@ -3307,163 +5939,47 @@ def import_leads():
             return redirect(request.url)
         
         try:
-            # Read CSV content
-            stream = io.StringIO(file.stream.read().decode('utf-8-sig'))
-            reader = csv.DictReader(stream)
-            rows = list(reader)
-            
-            if not rows:
+            # Persist the upload (copied in chunks) so the import can run and resume in the background
+            os.makedirs(IMPORT_FOLDER, exist_ok=True)
+            file_path = os.path.join(IMPORT_FOLDER, generate_unique_filename('import.csv'))
+            file.save(file_path)
+
+            with open(file_path, 'rb') as f:
+                fieldnames, _, total_rows, _ = read_csv_head(f)
+            if not fieldnames or not total_rows:
+                os.remove(file_path)
                 flash('CSV file is empty', 'error')
                 return redirect(request.url)
-            
+
             # Get column mappings from form
-            mappings = {}
-            custom_mappings = {}  # Separate dict for custom fields
-            
-            for csv_col in reader.fieldnames:
-                mapped_field = request.form.get(f'mapping_{csv_col}')
-                if mapped_field and mapped_field != 'skip':
-                    if mapped_field.startswith('custom_'):
-                        custom_mappings[csv_col] = mapped_field
-                    else:
-                        mappings[csv_col] = mapped_field
-            
-            # If no mappings provided, use auto-detection
-            if not mappings and not custom_mappings:
-                for csv_col in reader.fieldnames:
-                    detected = auto_detect_mapping(csv_col, custom_fields)
-                    if detected != 'skip':
-                        if detected.startswith('custom_'):
-                            custom_mappings[csv_col] = detected
-                        else:
-                            mappings[csv_col] = detected
-            
-            # Import settings
-            duplicate_action = request.form.get('duplicate_action', 'skip')
-            
-            imported = 0
-            skipped = 0
-            updated = 0
-            errors = []
-            
-            for row_num, row in enumerate(rows, start=2):
-                try:
-                    # Build lead data from default mappings
-                    lead_data = {}
-                    for csv_col, db_field in mappings.items():
-                        if csv_col in row:
-                            lead_data[db_field] = row[csv_col].strip() if row[csv_col] else ''
-                    
-                    # Build custom field data
-                    custom_data = {}
-                    for csv_col, custom_field_ref in custom_mappings.items():
-                        if csv_col in row:
-                            field_id = int(custom_field_ref.replace('custom_', ''))
-                            custom_data[field_id] = row[csv_col].strip() if row[csv_col] else ''
-                    
-                    # Require at least a name
-                    if not lead_data.get('name'):
-                        skipped += 1
-                        continue
-                    
-                    # Check for duplicates by email or name
-                    existing = None
-                    if lead_data.get('email'):
-                        existing = query_db(
-                            'SELECT id FROM leads WHERE email = ? AND deleted_at IS NULL',
-                            [lead_data['email']], one=True
-                        )
-                    if not existing and lead_data.get('name'):
-                        existing = query_db(
-                            'SELECT id FROM leads WHERE name = ? AND deleted_at IS NULL',
-                            [lead_data['name']], one=True
-                        )
-                    
-                    if existing:
-                        if duplicate_action == 'skip':
-                            skipped += 1
-                            continue
-                        elif duplicate_action == 'update':
-                            # Update existing record - default fields
-                            update_fields = []
-                            update_values = []
-                            valid_fields = ['name', 'email', 'phone', 'address', 'job_type', 'property_type', 'status', 'notes']
-                            for field, value in lead_data.items():
-                                if value and field in valid_fields:
-                                    update_fields.append(f'{field} = ?')
-                                    update_values.append(value)
-                            if update_fields:
-                                update_values.append(existing['id'])
-                                execute_db(
-                                    f'UPDATE leads SET {", ".join(update_fields)}, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-                                    update_values
-                                )
-                            
-                            # Update custom fields
-                            for field_id, value in custom_data.items():
-                                if value:
-                                    existing_val = query_db(
-                                        'SELECT id FROM field_values WHERE lead_id = ? AND field_id = ?',
-                                        [existing['id'], field_id], one=True
-                                    )
-                                    if existing_val:
-                                        execute_db(
-                                            'UPDATE field_values SET value = ? WHERE lead_id = ? AND field_id = ?',
-                                            [value, existing['id'], field_id]
-                                        )
-                                    else:
-                                        execute_db(
-                                            'INSERT INTO field_values (lead_id, field_id, value) VALUES (?, ?, ?)',
-                                            [existing['id'], field_id, value]
-                                        )
-                            
-                            updated += 1
-                            continue
-                    
-                    # Insert new lead
-                    lead_id = execute_db(
-                        '''INSERT INTO leads (name, email, phone, address, job_type, property_type, status, notes, created_by)
-                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                        (
-                            lead_data.get('name', ''),
-                            lead_data.get('email', ''),
-                            lead_data.get('phone', ''),
-                            lead_data.get('address', ''),
-                            lead_data.get('job_type', ''),
-                            lead_data.get('property_type', ''),
-                            lead_data.get('status', 'New Lead'),
-                            lead_data.get('notes', ''),
-                            session.get('user_id')
-                        )
-                    )
-                    
-                    # Insert custom field values
-                    for field_id, value in custom_data.items():
-                        if value:
-                            execute_db(
-                                'INSERT INTO field_values (lead_id, field_id, value) VALUES (?, ?, ?)',
-                                [lead_id, field_id, value]
-                            )
-                    
-                    # Log activity
-                    execute_db(
-                        'INSERT INTO activities (lead_id, user_id, content, activity_type) VALUES (?, ?, ?, ?)',
-                        (lead_id, session.get('user_id'), 'Lead imported from CSV', 'created')
-                    )
-                    
-                    imported += 1
-                    
-                except Exception as e:
-                    errors.append(f"Row {row_num}: {str(e)}")
-                    continue
-            
-            # Build result message
-            msg = f'Import complete: {imported} added, {updated} updated, {skipped} skipped'
-            if errors:
-                msg += f', {len(errors)} errors'
-            flash(msg, 'success' if not errors else 'warning')
-            
-            return redirect(url_for('leads'))
+            mappings, custom_mappings = resolve_import_mappings(fieldnames, request.form, custom_fields)
+
+            # Ignore mappings to custom fields that no longer exist, and to file fields (set by upload only)
+            custom_field_refs = {f"custom_{cf['id']}" for cf in custom_fields if cf['field_type'] != 'file'}
+            custom_mappings = {col: ref for col, ref in custom_mappings.items() if ref in custom_field_refs}
+
+            job_id = execute_db('''
+                INSERT INTO import_jobs (filename, file_path, mappings, duplicate_action, total_rows_estimate, created_by)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [
+                file.filename,
+                file_path,
+                json.dumps({'mappings': mappings, 'custom_mappings': custom_mappings}),
+                request.form.get('duplicate_action', 'skip'),
+                total_rows,
+                session.get('user_id')
+            ])
+            run_in_background(run_import_job, job_id, claim_import_job(job_id))
+
+            if is_ajax:
+                return jsonify({
+                    'success': True,
+                    'job_id': job_id,
+                    'progress_url': url_for('api_import_job_progress', job_id=job_id)
+                }), 202
+
+            flash('Import started - you can leave this page while it runs', 'success')
+            return redirect(url_for('import_leads', job=job_id))
             
         except Exception as e:
             flash(f'Error processing CSV: {str(e)}', 'error')
@@ -3483,12 +5999,42 @@ def import_leads():
     return render_template('import_leads.html',
                          default_mappings=CUSTOMER_CSV_MAPPINGS,
                          lead_fields=all_fields,
-                         custom_fields=custom_fields)
+                         custom_fields=custom_fields,
+                         preview_head_bytes=PREVIEW_HEAD_BYTES,
+                         import_job_id=request.args.get('job', type=int))
+
+@app.route('/api/import-jobs/<int:job_id>', methods=['GET'])
+@login_required
+def api_import_job_progress(job_id):
+    """Progress of a background CSV import: rows processed, rate and an error sample"""
+    job = get_import_job(job_id)
+    if not job:
+        return jsonify({'error': 'Import job not found'}), 404
+    return jsonify(import_job_to_dict(job))
+
+@app.route('/api/import-jobs/<int:job_id>/resume', methods=['POST'])
+@login_required
+def api_resume_import_job(job_id):
+    """Resume a failed or stalled import from its last committed chunk"""
+    job = get_import_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Import job not found'}), 404
+    if not import_job_to_dict(job)['can_resume']:
+        return jsonify({'success': False, 'error': f"Import is {job['status']}"}), 400
+    if not os.path.exists(job['file_path']):
+        return jsonify({'success': False, 'error': 'Uploaded file is no longer available'}), 410
+
+    # Another worker may have resumed it since the check above
+    run_token = claim_import_job(job_id)
+    if not run_token:
+        return jsonify({'success': False, 'error': 'Import is already running'}), 409
+    run_in_background(run_import_job, job_id, run_token)
+    return jsonify({'success': True})
 
 @app.route('/leads/import/preview', methods=['POST'])
 @login_required
 def preview_import():
-    """AJAX endpoint to preview CSV data before import"""
+    """AJAX endpoint to preview CSV data before import (reads only the head of the file)"""
     if 'csv_file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
     
@@ -3500,25 +6046,27 @@ def preview_import():
         return jsonify({'error': 'Invalid file'}), 400
     
     try:
-        stream = io.StringIO(file.stream.read().decode('utf-8-sig'))
-        reader = csv.DictReader(stream)
-        rows = list(reader)
-        
+        fieldnames, head_rows, total_rows, estimated = read_csv_head(file.stream)
+
         # Return headers and first 5 rows for preview
-        preview_rows = rows[:5]
-        
+        preview_rows = head_rows[:5]
+
         # Auto-detect mappings using smart detection
         auto_mappings = {}
-        for csv_col in reader.fieldnames:
-            detected = auto_detect_mapping(csv_col, custom_fields)
-            if detected != 'skip':
-                auto_mappings[csv_col] = detected
+        mapping_confidence = {}
+        for csv_col in fieldnames or []:
+            detected = detect_column_mapping(csv_col, custom_fields)
+            if detected['field'] != 'skip':
+                auto_mappings[csv_col] = detected['field']
+                mapping_confidence[csv_col] = detected
         
         return jsonify({
-            'headers': reader.fieldnames,
+            'headers': fieldnames,
             'preview': preview_rows,
-            'total_rows': len(rows),
-            'auto_mappings': auto_mappings
+            'total_rows': total_rows,
+            'total_rows_estimated': estimated,
+            'auto_mappings': auto_mappings,
+            'mapping_confidence': mapping_confidence
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -3570,7 +6118,38 @@ def deploy_webhook():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Bulk sync endpoint for custom fields and statuses (API key protected)
+# ==================== CONFIG SYNC ====================
+# The sync endpoints diff the pushed config against the database and apply only the changes
+# in one transaction. The payload hash is remembered (with the schema version it produced),
+# so re-pushing an unchanged config is a no-op.
+
+def sync_payload_hash(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+def sync_is_unchanged(kind, payload_hash):
+    """True if this exact payload was the last one synced and nothing has changed since"""
+    return get_setting(f'sync_hash_{kind}') == f"{payload_hash}:{get_cache_version('schema')}"
+
+def record_sync(db, kind, payload_hash, changed):
+    """Bump the schema version if anything changed, and remember the payload hash (inside the transaction)"""
+    if changed:
+        bump_cache_version('schema', db=db)
+    set_setting(f'sync_hash_{kind}', f"{payload_hash}:{get_cache_version('schema')}", db=db)
+
+def sync_unchanged_response():
+    return jsonify({'success': True, 'changed': False, 'created': 0, 'updated': 0})
+
+def duplicate_sync_keys_response(keys, what):
+    """400 response if a payload names the same item twice (it would hit a UNIQUE constraint), else None"""
+    seen, duplicates = set(), []
+    for key in keys:
+        if key in seen and key not in duplicates:
+            duplicates.append(key)
+        seen.add(key)
+    if duplicates:
+        return jsonify({'success': False, 'error': f'Duplicate {what} in payload: {duplicates}'}), 400
+    return None
+
 @app.route('/api/sync/custom-fields', methods=['POST'])
 def api_sync_custom_fields():
     # Check for API key authentication
@@ -3583,30 +6162,59 @@ def api_sync_custom_fields():
 
     data = request.get_json() or {}
     fields = data.get('fields', [])
-    
-    created = 0
-    updated = 0
-    
-    for field in fields:
-        existing = query_db('SELECT id FROM custom_fields WHERE field_key = ?', [field['field_key']], one=True)
-        if existing:
-            execute_db('''
-                UPDATE custom_fields SET name=?, field_type=?, options=?, option_colors=?, 
-                is_required=?, default_value=?, sequence=? WHERE field_key=?
-            ''', [field['name'], field['field_type'], field.get('options', ''), 
-                  field.get('option_colors', ''), field.get('is_required', 0),
-                  field.get('default_value', ''), field.get('sequence', 0), field['field_key']])
-            updated += 1
-        else:
-            execute_db('''
-                INSERT INTO custom_fields (name, field_key, field_type, options, option_colors, is_required, default_value, sequence)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', [field['name'], field['field_key'], field['field_type'], field.get('options', ''),
-                  field.get('option_colors', ''), field.get('is_required', 0),
-                  field.get('default_value', ''), field.get('sequence', 0)])
-            created += 1
-    
-    return jsonify({'success': True, 'created': created, 'updated': updated})
+    duplicates = duplicate_sync_keys_response([field.get('field_key') for field in fields], 'field keys')
+    if duplicates:
+        return duplicates
+
+    payload_hash = sync_payload_hash(fields)
+    if sync_is_unchanged('custom_fields', payload_hash):
+        return sync_unchanged_response()
+
+    columns = ['name', 'field_type', 'options', 'option_colors', 'is_required', 'default_value', 'sequence']
+    def normalize(values):
+        name, field_type, options, option_colors, is_required, default_value, sequence = values
+        return (name, field_type, options or '', option_colors or '', int(is_required or 0),
+                default_value or '', float(sequence or 0))
+
+    with db_transaction() as db:
+        existing = {
+            row['field_key']: row for row in db.execute(
+                f'SELECT id, field_key, {", ".join(columns)} FROM custom_fields'
+            )
+        }
+        inserts, updates, retyped = [], [], []
+        for field in fields:
+            values = (field['name'], field['field_type'], field.get('options', ''),
+                      field.get('option_colors', ''), field.get('is_required', 0),
+                      field.get('default_value', ''), field.get('sequence', 0))
+            current = existing.get(field['field_key'])
+            if not current:
+                inserts.append((field['field_key'],) + values)
+            elif normalize(values) != normalize(tuple(current[c] for c in columns)):
+                updates.append(values + (field['field_key'],))
+                if current['field_type'] != field['field_type']:
+                    retyped.append(current['id'])
+
+        db.executemany(f'''
+            UPDATE custom_fields SET {", ".join(f"{c}=?" for c in columns)} WHERE field_key=?
+        ''', updates)
+        db.executemany(f'''
+            INSERT INTO custom_fields (field_key, {", ".join(columns)})
+            VALUES ({", ".join("?" * (len(columns) + 1))})
+        ''', inserts)
+
+        # New or retyped fields change the matrix columns and the derived typed/option rows
+        if inserts or retyped:
+            rebuild_lead_field_matrix(db)
+        if retyped:
+            db.executemany('DELETE FROM field_value_options WHERE field_id = ?', [(i,) for i in retyped])
+            backfill_typed_field_values(db)
+            backfill_field_value_options(db)
+
+        record_sync(db, 'custom_fields', payload_hash, bool(inserts or updates))
+
+    return jsonify({'success': True, 'changed': bool(inserts or updates),
+                    'created': len(inserts), 'updated': len(updates)})
 
 @app.route('/api/sync/statuses', methods=['POST'])
 def api_sync_statuses():
@@ -3620,34 +6228,46 @@ def api_sync_statuses():
 
     data = request.get_json() or {}
     statuses = data.get('statuses', [])
-    
-    created = 0
-    updated = 0
-    
-    for status in statuses:
-        existing = query_db('SELECT id FROM statuses WHERE name = ?', [status['name']], one=True)
-        if existing:
-            execute_db('''
-                UPDATE statuses SET color=?, bg_color=?, sequence=?, is_active=? WHERE name=?
-            ''', [status.get('color', '#6b7280'), status.get('bg_color', '#f3f4f6'),
-                  status.get('sequence', 0), status.get('is_active', 1), status['name']])
-            updated += 1
-        else:
-            execute_db('''
-                INSERT INTO statuses (name, color, bg_color, sequence, is_active)
-                VALUES (?, ?, ?, ?, ?)
-            ''', [status['name'], status.get('color', '#6b7280'), status.get('bg_color', '#f3f4f6'),
-                  status.get('sequence', 0), status.get('is_active', 1)])
-            created += 1
-    
-    return jsonify({'success': True, 'created': created, 'updated': updated})
+    duplicates = duplicate_sync_keys_response([status.get('name') for status in statuses], 'status names')
+    if duplicates:
+        return duplicates
+
+    payload_hash = sync_payload_hash(statuses)
+    if sync_is_unchanged('statuses', payload_hash):
+        return sync_unchanged_response()
+
+    with db_transaction() as db:
+        existing = {
+            row['name']: (row['color'], row['bg_color'], float(row['sequence'] or 0), int(row['is_active']))
+            for row in db.execute('SELECT name, color, bg_color, sequence, is_active FROM statuses')
+        }
+        inserts, updates = [], []
+        for status in statuses:
+            values = (status.get('color', '#6b7280'), status.get('bg_color', '#f3f4f6'),
+                      status.get('sequence', 0), status.get('is_active', 1))
+            current = existing.get(status['name'])
+            if current is None:
+                inserts.append((status['name'],) + values)
+            elif current != (values[0], values[1], float(values[2] or 0), int(values[3])):
+                updates.append(values + (status['name'],))
+
+        db.executemany('''
+            UPDATE statuses SET color=?, bg_color=?, sequence=?, is_active=? WHERE name=?
+        ''', updates)
+        db.executemany('''
+            INSERT INTO statuses (name, color, bg_color, sequence, is_active)
+            VALUES (?, ?, ?, ?, ?)
+        ''', inserts)
+
+        record_sync(db, 'statuses', payload_hash, bool(inserts or updates))
+
+    return jsonify({'success': True, 'changed': bool(inserts or updates),
+                    'created': len(inserts), 'updated': len(updates)})
 
 
 @app.route('/api/sync/views', methods=['POST'])
 def api_sync_views():
     """Sync views with API key authentication"""
-    import json as json_module
-    
     # Check for API key authentication
     api_key = request.headers.get('X-API-Key') or request.args.get('api_key')
     if not api_key:
@@ -3658,54 +6278,82 @@ def api_sync_views():
 
     data = request.get_json() or {}
     views = data.get('views', [])
-    
+    duplicates = duplicate_sync_keys_response(
+        [view.get('name', '').strip() for view in views if view.get('name', '').strip()], 'view names'
+    )
+    if duplicates:
+        return duplicates
+
+    payload_hash = sync_payload_hash(views)
+    if sync_is_unchanged('views', payload_hash):
+        return sync_unchanged_response()
+
     created = 0
     updated = 0
-    
-    # Get custom field ID mapping
-    custom_fields = query_db('SELECT id, field_key FROM custom_fields')
-    field_key_to_id = {f['field_key']: f['id'] for f in custom_fields}
-    
-    for view in views:
-        name = view.get('name', '').strip()
-        if not name:
-            continue
-            
-        default_fields = view.get('default_fields', [])
-        custom_field_keys = view.get('custom_fields', [])  # List of field_keys
-        
-        # Convert field_keys to IDs
-        custom_field_ids = []
-        for key in custom_field_keys:
-            if key in field_key_to_id:
-                custom_field_ids.append(field_key_to_id[key])
-        
-        existing = query_db('SELECT id FROM views WHERE name = ?', [name], one=True)
-        
-        if existing:
-            view_id = existing['id']
-            # Update view
-            execute_db('UPDATE views SET default_fields = ? WHERE id = ?',
-                      [json_module.dumps(default_fields), view_id])
-            # Clear and re-add field associations
-            execute_db('DELETE FROM view_fields WHERE view_id = ?', [view_id])
+
+    with db_transaction() as db:
+        # Get custom field ID mapping and the current views with their fields
+        field_key_to_id = {f['field_key']: f['id'] for f in db.execute('SELECT id, field_key FROM custom_fields')}
+        existing_views = {v['name']: v for v in db.execute('SELECT id, name, default_fields FROM views')}
+        existing_fields = {}
+        for row in db.execute('SELECT view_id, field_id FROM view_fields ORDER BY view_id, sequence, id'):
+            existing_fields.setdefault(row['view_id'], []).append(row['field_id'])
+
+        for view in views:
+            name = view.get('name', '').strip()
+            if not name:
+                continue
+
+            default_fields = view.get('default_fields', [])
+            custom_field_keys = view.get('custom_fields', [])  # List of field_keys
+
+            # Convert field_keys to IDs
+            custom_field_ids = list(dict.fromkeys(
+                field_key_to_id[key] for key in custom_field_keys if key in field_key_to_id
+            ))
+
+            current = existing_views.get(name)
+            if not current:
+                # Create new view
+                view_id = db.execute('''
+                    INSERT INTO views (name, default_fields, created_by)
+                    VALUES (?, ?, ?)
+                ''', [name, json.dumps(default_fields), None]).lastrowid
+                db.executemany('''
+                    INSERT INTO view_fields (view_id, field_id, sequence)
+                    VALUES (?, ?, ?)
+                ''', [(view_id, field_id, idx + 1) for idx, field_id in enumerate(custom_field_ids)])
+                created += 1
+                continue
+
+            view_id = current['id']
+            try:
+                current_defaults = json.loads(current['default_fields'] or '[]')
+            except ValueError:
+                current_defaults = None
+            fields_changed = existing_fields.get(view_id, []) != custom_field_ids
+            if current_defaults == default_fields and not fields_changed:
+                continue
+
+            if current_defaults != default_fields:
+                db.execute('UPDATE views SET default_fields = ? WHERE id = ?',
+                           [json.dumps(default_fields), view_id])
+            if fields_changed:
+                # Drop removed fields, re-rank only moved ones, insert new ones
+                removed = set(existing_fields.get(view_id, [])) - set(custom_field_ids)
+                db.executemany('DELETE FROM view_fields WHERE view_id = ? AND field_id = ?',
+                               [(view_id, field_id) for field_id in removed])
+                new_rows = apply_rank_order(db, 'view_fields', custom_field_ids, 'view_id = ?', [view_id],
+                                            id_column='field_id')
+                db.executemany('''
+                    INSERT INTO view_fields (view_id, field_id, sequence)
+                    VALUES (?, ?, ?)
+                ''', [(view_id, field_id, rank) for field_id, rank in new_rows.items()])
             updated += 1
-        else:
-            # Create new view
-            view_id = execute_db('''
-                INSERT INTO views (name, default_fields, created_by)
-                VALUES (?, ?, ?)
-            ''', [name, json_module.dumps(default_fields), None])
-            created += 1
-        
-        # Add custom field associations
-        for idx, field_id in enumerate(custom_field_ids):
-            execute_db('''
-                INSERT INTO view_fields (view_id, field_id, sequence)
-                VALUES (?, ?, ?)
-            ''', [view_id, field_id, idx])
-    
-    return jsonify({'success': True, 'created': created, 'updated': updated})
+
+        record_sync(db, 'views', payload_hash, bool(created or updated))
+
+    return jsonify({'success': True, 'changed': bool(created or updated), 'created': created, 'updated': updated})
 
 
 @app.route('/api/custom-fields', methods=['GET'])
@@ -3726,6 +6374,27 @@ def api_get_custom_fields():
 # This ensures tables are always in sync with the code
 init_db()
 
+@app.cli.command('repair-foreign-keys')
+@click.option('--apply', is_flag=True, help='Back up the database, then delete or detach the dangling rows.')
+def repair_foreign_keys_command(apply):
+    """List rows with dangling foreign keys (and fix them with --apply)"""
+    with db_transaction() as db:
+        repairs = repair_foreign_keys(db)
+    for table, rowid, column, action in repairs:
+        print(f"{table} rowid={rowid} {column}: {action}")
+    if not repairs:
+        print("No dangling foreign keys")
+        return
+    if not apply:
+        print(f"{len(repairs)} rows need repair; re-run with --apply to fix them")
+        return
+
+    if not create_backup(DATABASE):
+        raise click.ClickException('Backup failed; nothing was changed')
+    with db_transaction() as db:
+        repairs = repair_foreign_keys(db, apply=True)
+    print(f"Repaired {len(repairs)} rows")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', 'false').lower() == 'true'
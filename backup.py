@@ -23,6 +23,7 @@ import sys
 import shutil
 import smtplib
 import sqlite3
+import time
 from datetime import datetime
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
@@ -34,9 +35,23 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATABASE = os.path.join(SCRIPT_DIR, 'crm.db')
 BACKUP_DIR = os.path.join(SCRIPT_DIR, 'backups')
 MAX_BACKUPS = 30  # Keep last 30 backups
-
-def create_backup():
-    """Create a timestamped backup of the database"""
+BACKUP_PAGES_PER_STEP = 256  # Pages copied per backup step
+BACKUP_STEP_SLEEP = 0.05  # Seconds to pause between steps so writers can get in
+BACKUP_MAX_RESTARTS = 5  # Stepped copies restarted this often by writes finish in one step instead
+
+class TooManyBackupRestarts(Exception):
+    pass
+
+def create_backup(database=DATABASE, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP, progress=None,
+                  max_restarts=BACKUP_MAX_RESTARTS):
+    """
+    Create a timestamped backup of the database. The copy is made in steps of `pages`
+    pages; the source is only locked during a step. progress(remaining, total) is
+    called after each step.
+    A write from another connection restarts a stepped copy from the beginning; after
+    max_restarts of those the copy is made in a single step, holding the read lock
+    throughout, so a steady write load can't put the backup off forever.
+    """
     # Ensure backup directory exists
     os.makedirs(BACKUP_DIR, exist_ok=True)
 
@@ -46,17 +61,44 @@ def create_backup():
     backup_path = os.path.join(BACKUP_DIR, backup_filename)
 
     # Check if database exists
-    if not os.path.exists(DATABASE):
-        print(f"Error: Database not found at {DATABASE}")
+    if not os.path.exists(database):
+        print(f"Error: Database not found at {database}")
         return None
 
-    # Create backup using SQLite's backup API for consistency
+    restarts = 0
+    last_remaining = None
+
+    def step_done(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise TooManyBackupRestarts()
+        last_remaining = remaining
+        if progress:
+            progress(remaining, total)
+        # sqlite3 only sleeps when the source is busy; pause here so writers get a turn between steps
+        if remaining and sleep:
+            time.sleep(sleep)
+
+    # Create backup using SQLite's backup API for consistency. It is written under a
+    # .partial name and renamed when complete, so a half-made copy is never listed.
+    partial_path = backup_path + '.partial'
     try:
-        source = sqlite3.connect(DATABASE)
-        dest = sqlite3.connect(backup_path)
-        source.backup(dest)
-        source.close()
-        dest.close()
+        source = sqlite3.connect(database)
+        dest = sqlite3.connect(partial_path)
+        try:
+            try:
+                source.backup(dest, pages=pages, progress=step_done)
+            except TooManyBackupRestarts:
+                print(f"Backup restarted {max_restarts} times by writes; copying in one step")
+                source.backup(dest)
+                if progress:
+                    progress(0, 1)
+        finally:
+            source.close()
+            dest.close()
+        os.replace(partial_path, backup_path)
 
         # Get file size
         size = os.path.getsize(backup_path)
@@ -70,6 +112,8 @@ def create_backup():
         return backup_path
     except Exception as e:
         print(f"Error creating backup: {e}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
         return None
 
 def cleanup_old_backups():